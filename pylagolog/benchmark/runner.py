@@ -0,0 +1,260 @@
+# Copyright (c) 2019 Nippon Telegraph and Telephone Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import json
+import logging as std_logging
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import timeit
+import traceback
+
+from oslo_config import cfg
+
+from pylagolog.benchmark import workloads
+from pylagolog.congress.policy_engines import agnostic
+
+# format of the JSON results, increased on incompatible changes
+FORMAT = 1
+POLICY = 'bench'
+
+common_opts = [
+    cfg.ListOpt('workloads',
+                default=list(workloads.WORKLOADS),
+                help='Workloads to run'),
+    cfg.ListOpt('kinds',
+                default=list(workloads.ENGINES),
+                help='Kinds of policy to run the workloads on'),
+    cfg.FloatOpt('scale',
+                 default=1.0,
+                 help='Multiply the sizes of the workloads by this'),
+    cfg.IntOpt('seed',
+               default=0,
+               help='Seed of the data generated by the workloads'),
+    cfg.StrOpt('output',
+               short='o',
+               help='Write the results as JSON to this file'),
+    cfg.StrOpt('compare',
+               short='c',
+               help='Compare with the results in this JSON file'),
+    cfg.FloatOpt('threshold',
+                 default=0.1,
+                 help='Relative slowdown reported as a regression'),
+]
+
+
+def measure(workload_class, kind, scale=1, seed=0):
+    """Run the workload WORKLOAD_CLASS on a policy of KIND.
+
+    The workload runs in a forked process, so that its peak memory use
+    is its own and no state is left behind.  Returns a dictionary of
+    results; its 'error' tells why the workload failed, if it did.
+    """
+    context = multiprocessing.get_context('fork')
+    conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_measure_child,
+        args=(child_conn, workload_class, kind, scale, seed))
+    process.start()
+    child_conn.close()
+    try:
+        result = conn.recv()
+    except EOFError:
+        result = {'error': 'exited with code %s' % process.exitcode}
+    process.join()
+    result.update({'workload': workload_class.name, 'kind': kind})
+    return result
+
+
+def _measure_child(conn, workload_class, kind, scale, seed):
+    # the servers log every request, which is not what is measured
+    std_logging.getLogger('pylagolog').setLevel(std_logging.WARNING)
+    try:
+        conn.send(_measure(workload_class, kind, scale, seed))
+    except Exception:
+        conn.send({'error': traceback.format_exc()})
+    conn.close()
+
+
+def _measure(workload_class, kind, scale, seed):
+    start_rss = _peak_rss()
+    workload = workload_class(scale=scale, seed=seed)
+    run = agnostic.Runtime()
+    run.create_policy(POLICY, kind=kind)
+    try:
+        start = timeit.default_timer()
+        workload.setup(run, POLICY)
+        setup = timeit.default_timer() - start
+        operations = workload.operations(run, POLICY)
+        latencies = []
+        for operation in operations:
+            start = timeit.default_timer()
+            operation()
+            latencies.append(timeit.default_timer() - start)
+    finally:
+        workload.close()
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        'params': workload.params,
+        'setup_seconds': setup,
+        'operations': len(latencies),
+        'seconds': total,
+        'throughput': len(latencies) / total if total else None,
+        'latency_ms': {
+            'mean': 1000 * total / len(latencies) if latencies else None,
+            'p50': 1000 * _percentile(latencies, 50),
+            'p90': 1000 * _percentile(latencies, 90),
+            'p99': 1000 * _percentile(latencies, 99),
+            'max': 1000 * _percentile(latencies, 100)},
+        'start_rss_kb': start_rss,
+        'peak_rss_kb': _peak_rss()}
+
+
+def _percentile(values, percent):
+    """Return the nearest-rank PERCENT percentile of the sorted VALUES."""
+    if not values:
+        return 0
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def _peak_rss():
+    """Return the peak resident set size of this process in KiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def run_all(names, kinds, scale=1, seed=0):
+    """Return the results of the workloads NAMES on the policy KINDS.
+
+    Kinds a workload cannot run on are skipped.
+    """
+    results = []
+    for name in names:
+        workload_class = workloads.WORKLOADS[name]
+        for kind in kinds:
+            if workload_class.supports(kind):
+                results.append(measure(workload_class, kind, scale, seed))
+    return {'format': FORMAT,
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'scale': scale,
+            'seed': seed,
+            'results': results}
+
+
+def _commit():
+    """Return the git commit of the working tree, or None."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold=0.1):
+    """Return the lines comparing the results NEW with the results OLD.
+
+    Each line gives the change in throughput and median latency of a
+    workload and kind run in both.  Returns a pair: the lines and the
+    number of regressions, i.e. throughputs that dropped by more than
+    THRESHOLD.
+    """
+    previous = dict(((r['workload'], r['kind']), r)
+                    for r in old['results'] if 'error' not in r)
+    lines = []
+    regressions = 0
+    for result in new['results']:
+        before = previous.get((result['workload'], result['kind']))
+        if before is None or 'error' in result:
+            continue
+        if before['params'] != result['params']:
+            lines.append("%-20s %-13s parameters differ" % (
+                result['workload'], result['kind']))
+            continue
+        change = _change(before['throughput'], result['throughput'])
+        latency = _change(before['latency_ms']['p50'],
+                          result['latency_ms']['p50'])
+        regressed = change is not None and change < -threshold
+        regressions += regressed
+        lines.append("%-20s %-13s throughput %s  p50 %s%s" % (
+            result['workload'], result['kind'], _percent(change),
+            _percent(latency), "  REGRESSION" if regressed else ""))
+    return lines, regressions
+
+
+def _change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before
+
+
+def _percent(change):
+    if change is None:
+        return "    n/a"
+    return "%+6.1f%%" % (100 * change)
+
+
+def format_results(results):
+    """Return RESULTS, as returned by run_all, as lines of text."""
+    lines = ["%-20s %-13s %10s %9s %9s %9s %10s" % (
+        'workload', 'kind', 'ops/s', 'p50 ms', 'p90 ms', 'p99 ms',
+        'peak KiB')]
+    for result in results['results']:
+        if 'error' in result:
+            lines.append("%-20s %-13s failed: %s" % (
+                result['workload'], result['kind'],
+                result['error'].strip().splitlines()[-1]))
+            continue
+        latency = result['latency_ms']
+        lines.append("%-20s %-13s %10.1f %9.3f %9.3f %9.3f %10d" % (
+            result['workload'], result['kind'], result['throughput'] or 0,
+            latency['p50'], latency['p90'], latency['p99'],
+            result['peak_rss_kb']))
+    return lines
+
+
+def main():
+    conf = cfg.ConfigOpts()
+    conf.register_cli_opts(common_opts)
+    conf(sys.argv[1:])
+
+    unknown = [name for name in conf.workloads
+               if name not in workloads.WORKLOADS]
+    if unknown:
+        sys.exit("Unknown workloads: %s (choose from %s)" % (
+            ", ".join(unknown), ", ".join(workloads.WORKLOADS)))
+    results = run_all(conf.workloads, conf.kinds, conf.scale, conf.seed)
+    print("\n".join(format_results(results)))
+    if conf.output:
+        with open(conf.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if conf.compare:
+        with open(conf.compare) as f:
+            lines, regressions = compare(json.load(f), results,
+                                         conf.threshold)
+        print("\n".join(lines))
+        if regressions:
+            sys.exit(1)
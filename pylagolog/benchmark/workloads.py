@@ -0,0 +1,392 @@
+# Copyright (c) 2019 Nippon Telegraph and Telephone Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import collections
+import random
+
+from six.moves import range
+
+from pylagolog.congress.datalog import base
+from pylagolog.congress import exception
+
+# what each kind of theory evaluates: (rules, recursive rules).  Kinds
+#   missing here are assumed to evaluate everything.
+ENGINES = collections.OrderedDict([
+    (base.NONRECURSIVE_POLICY_TYPE, (True, False)),
+    (base.MATERIALIZED_POLICY_TYPE, (True, False)),
+    (base.BOTTOMUP_POLICY_TYPE, (True, True)),
+    (base.DATABASE_POLICY_TYPE, (False, False)),
+])
+
+
+def insert(run, text, policy):
+    """Insert the policy string TEXT into POLICY or raise."""
+    permitted, errors = run.insert(text, policy)
+    if not permitted:
+        raise exception.PolicyException(
+            "; ".join(str(e) for e in errors))
+
+
+def delete(run, text, policy):
+    """Delete the policy string TEXT from POLICY or raise."""
+    permitted, errors = run.delete(text, policy)
+    if not permitted:
+        raise exception.PolicyException(
+            "; ".join(str(e) for e in errors))
+
+
+def atoms(table, rows):
+    """Return the policy string of the facts ROWS of TABLE."""
+    return "\n".join("%s(%s)" % (table, ", ".join(str(v) for v in row))
+                     for row in rows)
+
+
+class Workload(object):
+    """A program and the operations timed against it.
+
+    Sizes are multiplied by SCALE, and the data is drawn from a random
+    generator seeded with SEED, so a workload is the same on every run.
+    PARAMS records the sizes used.  RULES and RECURSIVE tell whether the
+    program needs an engine evaluating rules and recursive rules.
+    """
+
+    name = None
+    rules = True
+    recursive = False
+
+    def __init__(self, scale=1, seed=0):
+        self.scale = scale
+        self.random = random.Random(seed)
+        self.params = {}
+
+    def size(self, name, value):
+        """Return VALUE scaled, recorded as the parameter NAME."""
+        self.params[name] = max(1, int(value * self.scale))
+        return self.params[name]
+
+    @classmethod
+    def supports(cls, kind):
+        """Return True if a policy of KIND can run the workload."""
+        rules, recursive = ENGINES.get(kind, (True, True))
+        return ((rules or not cls.rules) and
+                (recursive or not cls.recursive))
+
+    def setup(self, run, policy):
+        """Load the program into POLICY of RUN before timing starts."""
+        raise NotImplementedError
+
+    def operations(self, run, policy):
+        """Return the list of functions to time, one call per operation."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release what setup acquired."""
+        pass
+
+
+class ChainJoin(Workload):
+    """Queries joining a chain of binary tables on a bound first column."""
+
+    name = 'chain_join'
+
+    def setup(self, run, policy):
+        self.length = self.size('length', 4)
+        self.rows = self.size('rows', 1000)
+        self.queries = self.size('queries', 200)
+        body = ", ".join("e%d(x%d, x%d)" % (i, i, i + 1)
+                         for i in range(self.length))
+        insert(run, "chain(x0, x%d) :- %s" % (self.length, body), policy)
+        for i in range(self.length):
+            insert(run, atoms('e%d' % i,
+                              [(j, self.random.randrange(self.rows))
+                               for j in range(self.rows)]), policy)
+
+    def operations(self, run, policy):
+        return [_select(run, "chain(%d, y)" %
+                        self.random.randrange(self.rows), policy)
+                for _ in range(self.queries)]
+
+
+class StarJoin(Workload):
+    """Queries joining a fact table with dimension tables on its key."""
+
+    name = 'star_join'
+
+    def setup(self, run, policy):
+        self.dimensions = self.size('dimensions', 4)
+        self.rows = self.size('rows', 1000)
+        dimension_rows = self.size('dimension_rows', 100)
+        self.queries = self.size('queries', 200)
+        dims = range(self.dimensions)
+        insert(run, "star(id, %s) :- fact(id, %s), %s" % (
+            ", ".join("a%d" % i for i in dims),
+            ", ".join("d%d" % i for i in dims),
+            ", ".join("dim%d(d%d, a%d)" % (i, i, i) for i in dims)), policy)
+        insert(run, atoms('fact', [
+            [j] + [self.random.randrange(dimension_rows) for _ in dims]
+            for j in range(self.rows)]), policy)
+        for i in dims:
+            insert(run, atoms('dim%d' % i, [
+                (j, self.random.randrange(self.rows))
+                for j in range(dimension_rows)]), policy)
+
+    def operations(self, run, policy):
+        query = "star(%d, " + ", ".join("a%d" % i
+                                        for i in range(self.dimensions)) + ")"
+        return [_select(run, query % self.random.randrange(self.rows),
+                        policy)
+                for _ in range(self.queries)]
+
+
+class WideTable(Workload):
+    """Lookups on one bound column of a table with many columns."""
+
+    name = 'wide_table'
+    rules = False
+
+    def setup(self, run, policy):
+        self.columns = self.size('columns', 20)
+        self.rows = self.size('rows', 2000)
+        self.queries = self.size('queries', 200)
+        self.values = 100
+        insert(run, atoms('wide', [
+            [self.random.randrange(self.values) for _ in range(self.columns)]
+            for _ in range(self.rows)]), policy)
+
+    def operations(self, run, policy):
+        ops = []
+        for _ in range(self.queries):
+            args = ["x%d" % i for i in range(self.columns)]
+            column = self.random.randrange(self.columns)
+            args[column] = str(self.random.randrange(self.values))
+            ops.append(_select(run, "wide(%s)" % ", ".join(args), policy))
+        return ops
+
+
+class Negation(Workload):
+    """Queries through a rule with a negated literal."""
+
+    name = 'negation'
+
+    def setup(self, run, policy):
+        self.rows = self.size('rows', 1000)
+        self.queries = self.size('queries', 200)
+        insert(run, "p(x) :- q(x, y), not r(y)", policy)
+        insert(run, atoms('q', [(j, self.random.randrange(self.rows))
+                                for j in range(self.rows)]), policy)
+        insert(run, atoms('r', [(j,) for j in range(0, self.rows, 2)]),
+               policy)
+
+    def operations(self, run, policy):
+        return [_select(run, "p(%d)" % self.random.randrange(self.rows),
+                        policy)
+                for _ in range(self.queries)]
+
+
+class Builtins(Workload):
+    """Queries through a rule computing with several builtins."""
+
+    name = 'builtins'
+
+    def setup(self, run, policy):
+        self.rows = self.size('rows', 1000)
+        self.keys = max(1, self.rows // 10)
+        self.queries = self.size('queries', 200)
+        insert(run, "b(x, z) :- q(x, y), plus(y, 1, w), mul(w, 2, z), "
+                    "lt(z, %d)" % self.rows, policy)
+        insert(run, atoms('q', [(self.random.randrange(self.keys), j)
+                                for j in range(self.rows)]), policy)
+
+    def operations(self, run, policy):
+        return [_select(run, "b(%d, z)" % self.random.randrange(self.keys),
+                        policy)
+                for _ in range(self.queries)]
+
+
+class TransitiveClosure(Workload):
+    """Edges added to a graph, each followed by a reachability query."""
+
+    name = 'transitive_closure'
+    recursive = True
+
+    def setup(self, run, policy):
+        self.nodes = self.size('nodes', 100)
+        self.updates = self.size('updates', 50)
+        insert(run, "path(x, y) :- edge(x, y)\n"
+                    "path(x, z) :- edge(x, y), path(y, z)", policy)
+        # a sparse random graph whose edges only go forward keeps the
+        #   closure small enough for every engine
+        insert(run, atoms('edge', set(self._edge()
+                                      for _ in range(self.nodes))), policy)
+
+    def _edge(self):
+        source = self.random.randrange(self.nodes - 1)
+        return (source, self.random.randrange(source + 1, self.nodes))
+
+    def operations(self, run, policy):
+        ops = []
+        for _ in range(self.updates):
+            edge = self._edge()
+            ops.append(_update_and_select(
+                run, atoms('edge', [edge]), "path(%d, y)" % edge[0], policy))
+        return ops
+
+
+class BulkInsert(Workload):
+    """Batches of facts inserted in one call each."""
+
+    name = 'bulk_insert'
+    rules = False
+
+    def setup(self, run, policy):
+        self.batches = self.size('batches', 10)
+        self.batch = self.size('batch', 1000)
+
+    def operations(self, run, policy):
+        return [_insert(run, atoms('bulk', [
+            (i, j, self.random.randrange(self.batch))
+            for j in range(self.batch)]), policy)
+            for i in range(self.batches)]
+
+
+class Churn(Workload):
+    """Facts deleted and inserted under a rule deriving a view from them."""
+
+    name = 'churn'
+
+    def setup(self, run, policy):
+        self.rows = self.size('rows', 1000)
+        self.changes = self.size('changes', 500)
+        insert(run, "v(x, z) :- q(x, y), r(y, z)", policy)
+        self.facts = [(j, self.random.randrange(self.rows))
+                      for j in range(self.rows)]
+        insert(run, atoms('q', self.facts), policy)
+        insert(run, atoms('r', [(j, j) for j in range(self.rows)]), policy)
+
+    def operations(self, run, policy):
+        ops = []
+        for j in range(self.changes):
+            # replace a random fact; the replacement keeps its first column
+            i = self.random.randrange(len(self.facts))
+            old = self.facts[i]
+            new = (old[0], self.random.randrange(self.rows))
+            self.facts[i] = new
+            ops.append(_delete(run, atoms('q', [old]), policy))
+            ops.append(_insert(run, atoms('q', [new]), policy))
+        return ops
+
+
+class TriggerFanout(Workload):
+    """Inserts into a table many triggered views depend on."""
+
+    name = 'trigger_fanout'
+
+    def setup(self, run, policy):
+        self.triggers = self.size('triggers', 20)
+        self.inserts = self.size('inserts', 200)
+        self.fired = [0]
+        for i in range(self.triggers):
+            insert(run, "t%d(x) :- base(x, y), lt(y, %d)" % (i, i), policy)
+            run.register_trigger('t%d' % i, self._callback, policy=policy,
+                                 delta=True)
+
+    def _callback(self, table, added, removed):
+        self.fired[0] += 1
+
+    def operations(self, run, policy):
+        return [_insert(run, atoms('base', [(j, j % self.triggers)]),
+                        policy)
+                for j in range(self.inserts)]
+
+
+class GrpcRoundTrip(Workload):
+    """Updates and queries sent through the gRPC server, one per RPC."""
+
+    name = 'grpc_round_trip'
+
+    def setup(self, run, policy):
+        # imported here, so the other workloads do not need gRPC
+        from concurrent import futures
+
+        import grpc
+
+        from pylagolog.proto import pylagolog_pb2
+        from pylagolog.proto import pylagolog_pb2_grpc
+        from pylagolog.proto import server
+
+        self.pb2 = pylagolog_pb2
+        self.requests = self.size('requests', 200)
+        insert(run, "p(x) :- q(x, y), r(y)", policy)
+        insert(run, atoms('r', [(j,) for j in range(0, self.requests, 2)]),
+               policy)
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        pylagolog_pb2_grpc.add_DatalogServicer_to_server(
+            server.DatalogServicer(run), self.server)
+        port = self.server.add_insecure_port('127.0.0.1:0')
+        self.server.start()
+        self.channel = grpc.insecure_channel('127.0.0.1:%d' % port)
+        self.stub = pylagolog_pb2_grpc.DatalogStub(self.channel)
+
+    def operations(self, run, policy):
+        ops = []
+        for j in range(self.requests):
+            rule = atoms('q', [(j, self.random.randrange(self.requests))])
+            ops.append(self._add(rule))
+            ops.append(self._query("p(%d)" % j))
+        return ops
+
+    def _add(self, rule):
+        def add():
+            self.stub.ModRules(iter([self.pb2.ModifyRule(
+                Type=self.pb2.ADD, Rule=rule)]))
+        return add
+
+    def _query(self, query):
+        def query_():
+            list(self.stub.Queries(iter([self.pb2.Query(Query=query)])))
+        return query_
+
+    def close(self):
+        self.channel.close()
+        self.server.stop(0)
+
+
+WORKLOADS = collections.OrderedDict(
+    (workload.name, workload) for workload in [
+        ChainJoin, StarJoin, WideTable, Negation, Builtins,
+        TransitiveClosure, BulkInsert, Churn, TriggerFanout, GrpcRoundTrip])
+
+
+def _select(run, query, policy):
+    return lambda: run.select(query, policy)
+
+
+def _insert(run, text, policy):
+    return lambda: insert(run, text, policy)
+
+
+def _delete(run, text, policy):
+    return lambda: delete(run, text, policy)
+
+
+def _update_and_select(run, text, query, policy):
+    def operation():
+        insert(run, text, policy)
+        run.select(query, policy)
+    return operation
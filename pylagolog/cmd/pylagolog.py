@@ -11,6 +11,7 @@ from pylagolog.congress.datalog import base as datalog_base
 from pylagolog.congress.datalog import database
 from pylagolog.congress.datalog import nonrecursive
 from pylagolog.congress.datalog import compile
+from pylagolog.congress.datalog import loader
 from pylagolog.congress.datalog import materialized
 from pylagolog.congress.datalog import utility
 from pylagolog.congress.tests import helper
@@ -31,7 +32,21 @@ common_opts = [
     cfg.StrOpt('query',
                short='q',
                default='querys.datalog',
-               help='query')
+               help='query'),
+    cfg.MultiStrOpt('facts',
+                    short='f',
+                    default=[],
+                    help='Load the rows of a CSV, TSV or JSON Lines file '
+                         'into a table, without parsing them as rules: '
+                         '[TABLE=]PATH.  TABLE defaults to the name of '
+                         'the file without its extension.  The default '
+                         'policy is nonrecursive; materialized and '
+                         'database policies cannot load facts.  May be '
+                         'repeated'),
+    cfg.BoolOpt('profile',
+                default=False,
+                help='Print the work done for each rule and table '
+                     'to stderr')
 ]
 
 
@@ -53,6 +68,15 @@ def main(args=None, prog=None):
     default_policy = "default"
     run = agnostic.Runtime()
     run.create_policy(default_policy)
+    if conf.profile:
+        run.profile()
+
+    for spec in conf.facts:
+        table, sep, path = spec.partition('=')
+        if not sep:
+            path = table
+            table = loader.file_table(path)
+        run.load_facts(table, path)
 
     for l in reqs(conf.rules):
         run.insert(l)
@@ -63,4 +87,7 @@ def main(args=None, prog=None):
         if ans != '':
             err_count += 1
             print(ans)
+    if conf.profile:
+        print(datalog_base.Profiler.format_report(run.profile_report()),
+              file=sys.stderr)
     return
@@ -18,6 +18,7 @@ from __future__ import division
 from __future__ import absolute_import
 
 import collections
+import timeit
 
 from oslo_log import log as logging
 import six
@@ -28,6 +29,7 @@ LOG = logging.getLogger(__name__)
 
 DATABASE_POLICY_TYPE = 'database'
 NONRECURSIVE_POLICY_TYPE = 'nonrecursive'
+BOTTOMUP_POLICY_TYPE = 'bottomup'
 ACTION_POLICY_TYPE = 'action'
 MATERIALIZED_POLICY_TYPE = 'materialized'
 DELTA_POLICY_TYPE = 'delta'
@@ -36,12 +38,20 @@ Z3_POLICY_TYPE = 'z3'
 
 
 class Tracer(object):
+    """Sends trace messages about the tables given to TRACE to FUNCS.
+
+    ENABLED is False as long as nothing is traced.  Callers check it
+    before building a message, so tracing costs nothing when disabled.
+    """
+
     def __init__(self):
         self.expressions = []
         self.funcs = [LOG.debug]   # functions to call to trace
+        self.enabled = False
 
     def trace(self, table):
         self.expressions.append(table)
+        self.enabled = True
 
     def is_traced(self, table):
         return table in self.expressions or '*' in self.expressions
@@ -68,6 +78,109 @@ class StringTracer(Tracer):
         return self.stream.getvalue()
 
 
+class Profiler(object):
+    """Counts the work done evaluating each table and rule.
+
+    TABLES maps (theory name, table) and RULES maps (theory name, rule)
+    to a collections.Counter.  The counters of a table are
+
+      calls: goals evaluated against the table
+      time: seconds spent on those goals, subgoals included
+      unify_attempts, unify_successes: unifications with its facts
+      facts_scanned, facts_returned: facts looked at and returned by
+        FactSet lookups
+      index_hits: lookups answered from an index
+      builtin_calls: calls to the builtin
+      negations: negated subqueries (NAF) on the table
+
+    and those of a rule are invocations, time, unify_attempts and
+    unify_successes of its head, plan_runs (native join plan
+    executions) and delta_firings (times a delta rule of a materialized
+    theory fired).  Theories only count while a Profiler is set on them,
+    see Theory.set_profiler.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.rules = {}
+
+    def table(self, theory, table):
+        """Return the Counter of TABLE in the theory named THEORY."""
+        key = (theory, table)
+        counts = self.tables.get(key)
+        if counts is None:
+            counts = self.tables.setdefault(key, collections.Counter())
+        return counts
+
+    def rule(self, theory, rule):
+        """Return the Counter of RULE in the theory named THEORY."""
+        key = (theory, rule)
+        counts = self.rules.get(key)
+        if counts is None:
+            counts = self.rules.setdefault(key, collections.Counter())
+        return counts
+
+    @staticmethod
+    def start():
+        """Return the time to pass to stop."""
+        return timeit.default_timer()
+
+    @staticmethod
+    def stop(counts, start):
+        """Add the time since START to the Counter COUNTS."""
+        counts['time'] += timeit.default_timer() - start
+
+    def reset(self):
+        self.tables = {}
+        self.rules = {}
+
+    def report(self):
+        """Return the counters as a dictionary of lists.
+
+        Its 'tables' and 'rules' hold one dictionary per table and rule
+        with the counters, the name of the 'theory' and the 'table' or
+        the 'rule' as a string, the most time consuming first.
+        """
+        def entries(counters, field):
+            result = []
+            for (theory, item), counts in list(counters.items()):
+                entry = dict(counts)
+                entry['theory'] = theory
+                entry[field] = str(item)
+                result.append(entry)
+            result.sort(key=lambda entry: (-entry.get('time', 0),
+                                           entry['theory'], entry[field]))
+            return result
+
+        return {'tables': entries(self.tables, 'table'),
+                'rules': entries(self.rules, 'rule')}
+
+    def merge(self, report):
+        """Add the counts of REPORT, as returned by report, to this one."""
+        for kind, field, counters in (('tables', 'table', self.tables),
+                                      ('rules', 'rule', self.rules)):
+            for entry in report[kind]:
+                entry = dict(entry)
+                key = (entry.pop('theory'), entry.pop(field))
+                counters.setdefault(key, collections.Counter()).update(entry)
+
+    @staticmethod
+    def format_report(report):
+        """Return REPORT, as returned by report, as lines of text."""
+        lines = []
+        for kind, field in (('tables', 'table'), ('rules', 'rule')):
+            lines.append("%s:" % kind.capitalize())
+            for entry in report[kind]:
+                counts = " ".join(
+                    "%s=%s" % (name, value)
+                    for name, value in sorted(entry.items())
+                    if name not in ('theory', field, 'time'))
+                lines.append("  %9.3fms  %s: %s  %s" % (
+                    entry.get('time', 0) * 1000, entry['theory'],
+                    entry[field], counts))
+        return "\n".join(lines)
+
+
 ##############################################################################
 # Logical Building Blocks
 ##############################################################################
@@ -139,6 +252,8 @@ class Theory(object):
         self.owner = owner
 
         self.tracer = Tracer()
+        # Profiler counting the work done, or None
+        self.profiler = None
         if name is None:
             self.name = repr(self)
         else:
@@ -166,6 +281,50 @@ class Theory(object):
         """
         raise NotImplementedError
 
+    def estimate_rows(self, table, columns):
+        """Estimate the number of rows of TABLE matching a key on COLUMNS.
+
+        COLUMNS is a sorted tuple of argument positions whose values are
+        known.  Returns None when the theory cannot tell, e.g. because
+        TABLE is defined by rules.
+        """
+        return None
+
+    def rules_defining(self, table):
+        """Return the rules with TABLE in the head.
+
+        Returns None when the theory cannot list them, e.g. because it
+        does not evaluate its rules top-down.
+        """
+        return None
+
+    def overlay(self, theories):
+        """Return a copy of this theory that changes independently of it.
+
+        The copy shares the contents of this theory, which its own
+        updates leave untouched, and looks up other theories in the
+        dictionary THEORIES.  Returns None when the theory cannot be
+        copied that way.
+        """
+        return None
+
+    def has_cached_results(self):
+        """Return True if the theory holds data derived from other tables."""
+        return False
+
+    def clear_answer_tables(self):
+        """Discard the answers cached across queries, if any."""
+        pass
+
+    def tables_changed(self, tablenames):
+        """Event handler for changes to the global TABLENAMES.
+
+        Called after an update with the tables it changed and every table
+        depending on them, so that theories caching derived data can
+        discard it.
+        """
+        pass
+
     def actual_events(self, events):
         """Returns subset of EVENTS that are not noops."""
         actual = []
@@ -189,9 +348,20 @@ class Theory(object):
     def get_tracer(self):
         return self.tracer
 
+    def set_profiler(self, profiler):
+        """Count the work done by this theory in PROFILER, or stop if None."""
+        self.profiler = profiler
+
+    def table_counts(self, table):
+        """Return the profiler's Counter for TABLE, or None if none is set."""
+        if self.profiler is None:
+            return None
+        return self.profiler.table(self.name, table)
+
     def log(self, table, msg, *args, **kwargs):
-        msg = self.trace_prefix + ": " + msg
-        self.tracer.log(table, msg, *args, **kwargs)
+        if self.tracer.enabled:
+            msg = self.trace_prefix + ": " + msg
+            self.tracer.log(table, msg, *args, **kwargs)
 
     def policy(self):
         """Return a list of the policy statements in this theory."""
@@ -0,0 +1,442 @@
+# Copyright (c) 2019 Nippon Telegraph and Telephone Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import threading
+
+from oslo_log import log as logging
+import six
+
+from pylagolog.congress.datalog import base
+from pylagolog.congress.datalog import compile
+from pylagolog.congress.datalog import factset
+from pylagolog.congress.datalog import joinplan
+from pylagolog.congress.datalog import nonrecursive
+from pylagolog.congress.datalog import ruleset
+from pylagolog.congress.datalog import unify
+from pylagolog.congress.datalog import utility
+from pylagolog.congress import exception
+
+
+LOG = logging.getLogger(__name__)
+
+
+class BottomUpTheory(nonrecursive.NonrecursiveRuleTheory):
+    """A stratified, possibly recursive, collection of Rules.
+
+    Instead of proving each answer separately, the first query after a
+    change computes the whole model of the theory set-at-a-time, stratum
+    by stratum, with semi-naive iteration.  Queries are then answered by
+    looking facts up in that model.  Rule bodies are joined with their
+    join plans over the indexed facts; rules with literals referring to
+    other policies are still evaluated top-down.
+    """
+
+    def __init__(self, name=None, abbr=None,
+                 schema=None, theories=None, desc=None, owner=None):
+        super(BottomUpTheory, self).__init__(
+            name=name, abbr=abbr, theories=theories, schema=schema,
+            desc=desc, owner=owner)
+        self.kind = base.BOTTOMUP_POLICY_TYPE
+        # facts derived by the rules (and not already base facts),
+        #   or None if the model needs to be recomputed
+        self.model = None
+        # True while the model is being computed
+        self._evaluating = False
+        # held while the model is computed, so that concurrent queries
+        #   wait for it instead of reading a partial model
+        self._model_lock = threading.RLock()
+        # dependency graph of the rules, kept up to date as rules are
+        #   inserted and deleted, or None until it is needed
+        self.dependency_graph = None
+
+    # External Interface
+
+    def initialize_tables(self, tablenames, facts):
+        super(BottomUpTheory, self).initialize_tables(tablenames, facts)
+        self.dependency_graph = None
+        self.invalidate()
+
+    def empty(self, tablenames=None, invert=False):
+        super(BottomUpTheory, self).empty(tablenames=tablenames,
+                                          invert=invert)
+        self.dependency_graph = None
+        self.invalidate()
+
+    def invalidate(self):
+        """Discard the computed model."""
+        self.model = None
+
+    def set_tabling(self, enabled=True, persistent=False):
+        # the model already keeps every answer across queries, and
+        #   answers computed while it is being built would be incomplete
+        super(BottomUpTheory, self).set_tabling(enabled=enabled,
+                                                persistent=False)
+
+    def has_cached_results(self):
+        return self.model is not None
+
+    def overlay(self, theories):
+        th = super(BottomUpTheory, self).overlay(theories)
+        # the copy starts from the complete model, which it replaces
+        #   rather than modifies once its rules or tables change
+        with self._model_lock:
+            th.model = self.model
+        th._evaluating = False
+        th._model_lock = threading.RLock()
+        th.dependency_graph = None
+        return th
+
+    def tables_changed(self, tablenames):
+        prefix = self.name + ':'
+        if (self.model is not None and
+                any(table.startswith(prefix) for table in tablenames)):
+            self.invalidate()
+
+    def update_would_cause_errors(self, events):
+        """Return a list of PolicyException.
+
+        Besides the usual checks, rejects updates that would leave the
+        rules of this theory without a stratification.
+        """
+        errors = super(BottomUpTheory, self).update_would_cause_errors(events)
+        if errors:
+            return errors
+        # the rules inserted or deleted once all EVENTS are applied
+        changed = {}
+        for event in events:
+            if self._in_graph(event.formula):
+                changed[event.formula] = event.insert
+        changed = [compile.Event(rule, insert=insert)
+                   for rule, insert in changed.items()
+                   if insert != self.rules.contains(rule.head.table.table,
+                                                    rule)]
+        if not changed:
+            return errors
+        graph = self._dependency_graph()
+        changes = graph.formula_update(changed, include_atoms=False)
+        try:
+            if not compile.is_stratified(graph):
+                errors.append(exception.PolicyException(
+                    "Rules are recursive through negation"))
+        finally:
+            graph.undo_changes(changes)
+        return errors
+
+    def consequences(self, filter=None, table_theories=None):
+        """Return all the true instances of any table in this theory."""
+        if table_theories is not None:
+            return super(BottomUpTheory, self).consequences(
+                filter=filter, table_theories=table_theories)
+        self.compute_model()
+        results = set()
+        for table in set(self.rules.keys()):
+            if filter is None or filter(table):
+                for fact in self._facts(table):
+                    results.add(
+                        compile.Literal.create_from_table_tuple(table, fact))
+        return results
+
+    def estimate_rows(self, table, columns):
+        """Estimate the number of rows of TABLE matching a key on COLUMNS.
+
+        Tables defined by rules count the facts the model derived for
+        them, once it is being computed.
+        """
+        if not self.rules.rules.get(table):
+            return super(BottomUpTheory, self).estimate_rows(table, columns)
+        if self.model is None:
+            return None
+        return sum(facts.estimate(columns)
+                   for facts in (self.rules.facts.get(table),
+                                 self.model.facts.get(table))
+                   if facts is not None)
+
+    def compute_model(self):
+        """Compute the facts derived by the rules, if not already known."""
+        if self.model is not None and not self._evaluating:
+            return
+        with self._model_lock:
+            # the model is complete, or is being computed by this thread
+            if self.model is not None:
+                return
+            self.log(None, "Computing model")
+            # set before the model, for the unlocked test above
+            self._evaluating = True
+            self.model = ruleset.RuleSet()
+            try:
+                for stratum in self._strata():
+                    self._evaluate_stratum(stratum)
+            except Exception:
+                self.model = None
+                raise
+            finally:
+                self._evaluating = False
+
+    # Internal Interface
+
+    def _insert_actual(self, rule):
+        changed = super(BottomUpTheory, self)._insert_actual(rule)
+        if changed:
+            self._update_graph(rule, True)
+            self.invalidate()
+        return changed
+
+    def _delete_actual(self, rule):
+        changed = super(BottomUpTheory, self)._delete_actual(rule)
+        if changed:
+            self._update_graph(rule, False)
+            self.invalidate()
+        return changed
+
+    def _all_rules(self):
+        for rules in self.rules.rules.values():
+            for rule in rules:
+                yield rule
+
+    @staticmethod
+    def _in_graph(formula):
+        """Return True if FORMULA is kept as a rule, not as a fact."""
+        return not compile.is_atom(formula) and len(formula.body) > 0
+
+    def _dependency_graph(self):
+        """Return the dependency graph of the rules of this theory."""
+        if self.dependency_graph is None:
+            self.dependency_graph = compile.RuleDependencyGraph(
+                self._all_rules(), include_atoms=False)
+        return self.dependency_graph
+
+    def _update_graph(self, rule, insert):
+        if self.dependency_graph is not None and self._in_graph(rule):
+            self.dependency_graph.formula_update(
+                [compile.Event(rule, insert=insert)], include_atoms=False)
+
+    def _strata(self):
+        """Return lists of (head, rule) pairs, lowest stratum first.
+
+        Heads with modals are left out of the model; they are proven
+        top-down from the model instead.
+        """
+        rules = list(self._all_rules())
+        strata = compile.stratification(self._dependency_graph())
+        assert strata is not None, "Rules must be stratified"
+        by_stratum = {}
+        for rule in rules:
+            for head in rule.heads:
+                if head.table.modal is not None:
+                    continue
+                level = strata.get(head.table.table, 1)
+                by_stratum.setdefault(level, []).append((head, rule))
+        return [by_stratum[level] for level in sorted(by_stratum)]
+
+    def _is_local(self, lit):
+        return (not lit.is_negated() and not lit.is_builtin() and
+                lit.table.modal is None and
+                lit.table.service in (None, self.name))
+
+    def _facts(self, table, match_literal=None):
+        counts = self.table_counts(table)
+        facts = self.rules.get_facts(table, match_literal, counts)
+        if self.model is not None:
+            facts.extend(self.model.get_facts(table, match_literal, counts))
+        return facts
+
+    def _is_known(self, table, fact):
+        return ((table in self.rules.facts and
+                 fact in self.rules.facts[table]) or
+                (table in self.model.facts and
+                 fact in self.model.facts[table]))
+
+    def _evaluate_stratum(self, stratum):
+        """Compute the least fixpoint of the rules in STRATUM.
+
+        Every round only joins against the facts that are new since the
+        previous round (semi-naive evaluation).
+        """
+        recursive = set(head.table.table for head, rule in stratum)
+        delta = {}
+        for head, rule in stratum:
+            self._derive(head, rule, None, None, delta)
+        while delta:
+            self._add_to_model(delta)
+            previous, delta = delta, {}
+            for head, rule in stratum:
+                for i, lit in enumerate(rule.body):
+                    if (not self._is_local(lit) or
+                            lit.table.table not in recursive or
+                            lit.table.table not in previous):
+                        continue
+                    self._derive(head, rule, i, previous, delta)
+
+    def _derive(self, head, rule, index, previous, delta):
+        """Add the new instances of HEAD proven by RULE to DELTA.
+
+        If INDEX is given, the INDEX-th literal of the body only ranges
+        over PREVIOUS, the facts derived in the previous round.  The body
+        is joined set-at-a-time with its join plan when possible, and is
+        evaluated top-down otherwise.
+        """
+        table = head.table.table
+        profiler = self.profiler
+        if profiler is not None:
+            counts = profiler.rule(self.name, rule)
+            counts['invocations'] += 1
+            start = profiler.start()
+        plan = None
+        if (len(rule.heads) == 1 and not self.includes and
+                not self.tracer.enabled):
+            plan = self._model_plan(rule, index)
+        if plan is not None and plan.steps is not None:
+            table_counts = None
+            if profiler is not None:
+                counts['plan_runs'] += 1
+                table_counts = self.table_counts
+            facts = _ModelFacts(self.rules.facts, self.model.facts,
+                                previous)
+            for row in plan.execute(facts, (), table_counts):
+                fact = compile.Fact(table, row)
+                if not self._is_known(table, fact):
+                    delta.setdefault(table, set()).add(fact)
+        elif index is None:
+            self._derive_top_down(head, rule, rule.body, None, delta)
+        else:
+            lit = rule.body[index]
+            rest = rule.body[:index] + rule.body[index + 1:]
+            tablename = lit.table.global_tablename()
+            for fact in previous[lit.table.table]:
+                binding = self.new_bi_unifier(slots=rule.variable_slots())
+                atom = compile.Literal.create_from_table_tuple(
+                    tablename, fact)
+                if unify.match_atoms(lit, binding, atom) is None:
+                    continue
+                self._derive_top_down(head, rule, rest, binding, delta)
+        if profiler is not None:
+            profiler.stop(counts, start)
+
+    def _derive_top_down(self, head, rule, literals, binding, delta):
+        """Add the new instances of HEAD proven by LITERALS to DELTA."""
+        table = head.table.table
+        for answer in self.top_down_evaluation(rule.variables(), literals,
+                                               binding=binding):
+            atom = head.plug(answer)
+            fact = compile.Fact(table, [arg.name for arg in atom.arguments])
+            if self._is_known(table, fact):
+                continue
+            delta.setdefault(table, set()).add(fact)
+
+    def _model_plan(self, rule, index):
+        """Return the join plan of RULE with no head argument bound.
+
+        With INDEX, the plan starts with the INDEX-th literal of the body,
+        read from the delta of its table.
+        """
+        bound = (False,) * len(rule.head.arguments)
+        if index is None:
+            return self.join_plan(rule, bound)
+        key = (rule, index)
+        plan = self.join_plans.get(key)
+        if plan is None or plan.drifted(self.estimate_literal):
+            plan = joinplan.compile_plan(rule, bound, self.name,
+                                         self.estimate_literal, delta=index)
+            self.join_plans[key] = plan
+        return plan
+
+    def _add_to_model(self, delta):
+        for table, facts in delta.items():
+            self.log(table, "Derived %s", utility.iterstr(facts))
+            for fact in facts:
+                self.model.add_rule(table, fact)
+
+    # SELECT implemented by TopDownTheory
+
+    def head_index(self, table, match_literal=None):
+        """Return head index.
+
+        Every table is answered from the model, so this returns only
+        rules with empty bodies, except for literals with modals.
+        """
+        self.compute_model()
+        if match_literal is not None and match_literal.table.modal:
+            return super(BottomUpTheory, self).head_index(table,
+                                                          match_literal)
+        return ruleset.RuleSet.facts_to_rules(
+            table, self._facts(table, match_literal))
+
+
+class _ModelFacts(object):
+    """The facts a join plan reads while the model is computed.
+
+    A table holds the base facts of RULES and the facts of MODEL derived
+    for it, which are disjoint; delta_key(table) gives the facts of
+    DELTA, a dictionary from table name to the set of facts derived in
+    the previous round.
+    """
+
+    def __init__(self, rules, model, delta):
+        self.rules = rules
+        self.model = model
+        self.delta = delta or {}
+        self.deltas = {}
+
+    def get(self, key):
+        if isinstance(key, tuple):
+            table = key[1]
+            facts = self.deltas.get(table)
+            if facts is None and table in self.delta:
+                facts = factset.FactSet(self.delta[table])
+                self.deltas[table] = facts
+            return facts
+        base = self.rules.get(key)
+        derived = self.model.get(key)
+        if not derived:
+            return base
+        if not base:
+            return derived
+        return _UnionFactSet(base, derived)
+
+
+class _UnionFactSet(object):
+    """The facts of two disjoint FactSets, for lookups only."""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def __contains__(self, fact):
+        return fact in self.first or fact in self.second
+
+    def lookup(self, columns, key):
+        facts = list(self.first.lookup(columns, key))
+        facts.extend(self.second.lookup(columns, key))
+        return facts
+
+
+def cycles_outside_bottomup(theories, cycles):
+    """Return the CYCLES not contained in a single BottomUpTheory.
+
+    Cycles, or strongly connected components, are represented by lists
+    of qualified table names.
+    """
+    acceptables = set(th.name for th in six.itervalues(theories)
+                      if isinstance(th, BottomUpTheory))
+    results = []
+    for cycle in cycles:
+        policies = set(fullname[:fullname.index(':')] for fullname in cycle)
+        if len(policies) != 1 or not policies <= acceptables:
+            results.append(cycle)
+    return results
@@ -20,8 +20,12 @@ import argparse
 import collections
 import copy
 import functools
+import re
+import threading
+import types
 
 import six
+from six.moves import intern
 from six.moves import range
 
 from oslo_log import log as logging
@@ -83,6 +87,13 @@ class Schema(object):
     def __contains__(self, tablename):
         return tablename in self.map
 
+    def copy(self):
+        """Return a copy of this schema that changes independently of it."""
+        schema = Schema(dict(self.map), complete=self.complete)
+        if self.count is not None:
+            schema.count = dict(self.count)
+        return schema
+
     @staticmethod
     def _col(cols):
         # For Datasource tables, columns would be in the format -
@@ -326,6 +337,8 @@ class ObjectConstant (Term):
 
     def __init__(self, name, type, location=None):
         assert(type in [self.STRING, self.FLOAT, self.INTEGER])
+        if type == self.STRING:
+            name = intern_value(name)
         self.name = name
         self.type = type
         self.location = location
@@ -370,6 +383,26 @@ class ObjectConstant (Term):
         return True
 
 
+def intern_value(value):
+    """Return the interned copy of VALUE, or VALUE if it is not a str.
+
+    Datasources repeat the same strings (ids, names, states) across many
+    rows.  Interned, each distinct string is stored once, and every fact,
+    index key and constant holding it refers to that one object, so
+    equal strings also compare by identity.  Interned strings are
+    released once nothing refers to them.
+    """
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+def intern_row(values):
+    """Return the tuple of VALUES, with its strings interned."""
+    return tuple([intern(value) if type(value) is str else value
+                  for value in values])
+
+
 @functools.total_ordering
 class Fact (tuple):
     """Represent a Fact (a ground literal)
@@ -565,14 +598,25 @@ class Tablename(object):
 
     def drop_service(self):
         self.service = None
+        self._hash = None
+
+
+# named_arguments of the literals without any; read-only since it is shared
+_NO_NAMED_ARGUMENTS = types.MappingProxyType(collections.OrderedDict())
 
 
 @functools.total_ordering
 class Literal (object):
-    """Represents a possibly negated atomic statement, e.g. p(a, 17, b)."""
+    """Represents a possibly negated atomic statement, e.g. p(a, 17, b).
+
+    ARGUMENTS is a tuple of Terms, shared by the copies of the literal
+    made by plug, complement and the like.  Named arguments only exist
+    between parsing and eliminate_column_references_and_pad_positional,
+    so a literal without any keeps none.
+    """
     SORT_RANK = 5
     __slots__ = ['table', 'arguments', 'location', 'negated', '_hash',
-                 'id', 'name', 'comment', 'original_str', 'named_arguments']
+                 'id', 'name', 'comment', 'original_str', '_named']
 
     def __init__(self, table, arguments, location=None, negated=False,
                  use_modules=True, id_=None, name=None, comment=None,
@@ -582,7 +626,7 @@ class Literal (object):
         else:
             self.table = Tablename.create_from_tablename(
                 table, use_modules=use_modules)
-        self.arguments = arguments
+        self.arguments = tuple(arguments)
         self.location = location
         self.negated = negated
         self._hash = None
@@ -590,11 +634,11 @@ class Literal (object):
         self.name = name
         self.comment = comment
         self.original_str = original_str
-        if named_arguments is None:
-            self.named_arguments = collections.OrderedDict()
+        if not named_arguments:
+            self._named = None
         else:
             # Python3: explicitly split out the integer names from others
-            self.named_arguments = collections.OrderedDict(
+            self._named = collections.OrderedDict(
                 sorted([(n, o)
                         for n, o in named_arguments.items() if
                         isinstance(n, six.integer_types)])
@@ -604,14 +648,35 @@ class Literal (object):
                         not isinstance(n, six.integer_types)])
             )
 
+    @property
+    def named_arguments(self):
+        if self._named is None:
+            return _NO_NAMED_ARGUMENTS
+        return self._named
+
     def __copy__(self):
-        # use_modules=False so that we get exactly what we started
-        #   with
-        newone = Literal(self.table, self.arguments, self.location,
-                         self.negated, False, self.id,
-                         self.name, self.comment, self.original_str,
-                         self.named_arguments)
-        return newone
+        return self._copy(self.arguments)
+
+    def _copy(self, arguments, table=None, negated=None):
+        """Return a copy of this literal with the tuple ARGUMENTS.
+
+        Skips the constructor, and computes the hash of the copy, which
+        is not modified afterwards.  TABLE and NEGATED replace those of
+        this literal if given.
+        """
+        new = Literal.__new__(Literal)
+        new.table = self.table if table is None else table
+        new.arguments = arguments
+        new.location = self.location
+        new.negated = self.negated if negated is None else negated
+        new.id = self.id
+        new.name = self.name
+        new.comment = self.comment
+        new.original_str = self.original_str
+        new._named = self._named
+        new._hash = None
+        new._hash = new.__hash__()
+        return new
 
     def set_id(self, id):
         self.id = id
@@ -678,13 +743,10 @@ class Literal (object):
         if len(self.named_arguments) != len(other.named_arguments):
             return len(self.named_arguments) < len(other.named_arguments)
         # final case
-        # explicitly convert OrderedDict to list for comparison
+        # explicitly convert the mappings to lists for comparison
 
         def od_list(input):
-            return (
-                list(input.items()) if isinstance(
-                    input, collections.OrderedDict)
-                else input)
+            return list(input.items())
 
         return (self.arguments < other.arguments or
                 od_list(self.named_arguments) < od_list(other.named_arguments))
@@ -695,7 +757,7 @@ class Literal (object):
                 self.negated == other.negated and
                 len(self.arguments) == len(other.arguments) and
                 self.arguments == other.arguments and
-                self.named_arguments == other.named_arguments)
+                self._named == other._named)
 
     def __ne__(self, other):
         return not self == other
@@ -712,14 +774,11 @@ class Literal (object):
 
     def __hash__(self):
         if self._hash is None:
-            args = tuple([hash(a) for a in self.arguments])
-            named = tuple([(hash(key), hash(value))
-                           for key, value in self.named_arguments.items()])
-            self._hash = hash(('Literal',
-                               hash(self.table),
-                               args,
-                               hash(self.negated),
-                               named))
+            named = None
+            if self._named is not None:
+                named = tuple(self._named.items())
+            self._hash = hash(('Literal', self.table, self.arguments,
+                               self.negated, named))
         return self._hash
 
     def is_negated(self):
@@ -744,22 +803,22 @@ class Literal (object):
         return all(not arg.is_variable() for arg in self.arguments)
 
     def plug(self, binding, caller=None):
-        """Assumes domain of BINDING is Terms.  Ignores named_arguments."""
-        new = copy.copy(self)
+        """Assumes domain of BINDING is Terms.  Ignores named_arguments.
+
+        BINDING is a dict or a unify.Frame.  Returns SELF if no argument
+        changes.
+        """
         if isinstance(binding, dict):
-            args = []
-            for arg in self.arguments:
-                if arg in binding:
-                    args.append(Term.create_from_python(binding[arg]))
-                else:
-                    args.append(arg)
-            new.arguments = args
-            return new
+            args = tuple([Term.create_from_python(binding[arg])
+                          if arg in binding else arg
+                          for arg in self.arguments])
         else:
-            args = [Term.create_from_python(binding.apply(arg, caller))
-                    for arg in self.arguments]
-            new.arguments = args
-            return new
+            apply = binding.apply
+            args = tuple([apply(arg, caller) for arg in self.arguments])
+        for old, new in six.moves.zip(self.arguments, args):
+            if old is not new:
+                return self._copy(args)
+        return self
 
     def argument_names(self):
         """Return names of all arguments.  Ignores named_arguments."""
@@ -767,9 +826,7 @@ class Literal (object):
 
     def complement(self):
         """Copies SELF and inverts is_negated."""
-        new = copy.copy(self)
-        new.negated = not new.negated
-        return new
+        return self._copy(self.arguments, negated=not self.negated)
 
     def make_positive(self):
         """Return handle to self or copy of self based on positive check.
@@ -778,9 +835,7 @@ class Literal (object):
         returns copy of SELF where is_negated() is set to false.
         """
         if self.negated:
-            new = copy.copy(self)
-            new.negated = False
-            return new
+            return self._copy(self.arguments, negated=False)
         else:
             return self
 
@@ -797,9 +852,7 @@ class Literal (object):
         """Apply func to self.table and return a copy that uses the result."""
         newtable, is_different = func(self.table)
         if is_different:
-            new = copy.copy(self)
-            new.table = newtable
-            return new
+            return self._copy(self.arguments, table=newtable)
         return self
 
     def is_update(self):
@@ -923,10 +976,11 @@ class Literal (object):
             if term is None:
                 term = Variable("%s%s" % (prefix, i))
             position_args.append(term)
-        newlit = self.__copy__()
-        newlit.named_arguments = collections.OrderedDict()
-        newlit.arguments = position_args
-        return newlit
+        # use_modules=False so that we get exactly what we started
+        #   with
+        return Literal(self.table, position_args, self.location,
+                       self.negated, False, self.id, self.name,
+                       self.comment, self.original_str)
 
 
 @functools.total_ordering
@@ -934,8 +988,8 @@ class Rule(object):
     """Represents a rule, e.g. p(x) :- q(x)."""
 
     SORT_RANK = 6
-    __slots__ = ['heads', 'head', 'body', 'location', '_hash', 'id', 'name',
-                 'comment', 'original_str']
+    __slots__ = ['heads', 'head', 'body', 'location', '_hash', '_id', 'name',
+                 'comment', 'original_str', '_slots']
 
     def __init__(self, head, body, location=None, id=None, name=None,
                  comment=None, original_str=None):
@@ -953,16 +1007,29 @@ class Rule(object):
         self.body = body
         self.location = location
         self._hash = None
-        self.id = id or uuidutils.generate_uuid()
+        # generated on first use: most rules, e.g. those made from facts
+        #   during evaluation, never need one
+        self._id = id
         self.name = name
         self.comment = comment
         self.original_str = original_str
+        self._slots = None
 
     def __copy__(self):
-        newone = Rule(self.head, self.body, self.location, self.id,
+        newone = Rule(self.head, self.body, self.location, self._id,
                       self.name, self.comment, self.original_str)
         return newone
 
+    @property
+    def id(self):
+        if not self._id:
+            self._id = uuidutils.generate_uuid()
+        return self._id
+
+    @id.setter
+    def id(self, id):
+        self._id = id
+
     def set_id(self, id):
         self.id = id
 
@@ -1069,6 +1136,16 @@ class Rule(object):
             vs |= lit.variables()
         return vs
 
+    def variable_slots(self):
+        """Return the dict numbering the variables of this rule from 0.
+
+        Computed once per rule; each activation of the rule keeps the
+        value of its variables in that many cells (see unify.Frame).
+        """
+        if self._slots is None:
+            self._slots = variable_slots(self.heads + list(self.body))
+        return self._slots
+
     def variable_names(self):
         vs = set()
         for lit in self.heads:
@@ -1258,23 +1335,29 @@ def is_recursive(x):
     return RuleDependencyGraph(x).has_cycle()
 
 
-def stratification(rules):
+def stratification(x):
     """Stratify the rules.
 
+    X can be either a Graph or a list of rules.
     Returns a dictionary from table names to an integer representing
     the strata to which the table is assigned or None if the rules
     are not stratified.
     """
-    return RuleDependencyGraph(rules).stratification([True])
+    if isinstance(x, utility.Graph):
+        return x.stratification([True])
+    return RuleDependencyGraph(x).stratification([True])
 
 
-def is_stratified(rules):
+def is_stratified(x):
     """Check if rules are stratified.
 
+    X can be either a Graph or a list of rules.
     Returns T iff the list of rules RULES has no table defined in terms
     of its negated self.
     """
-    return stratification(rules) is not None
+    if isinstance(x, utility.Graph):
+        return x.is_stratified([True])
+    return RuleDependencyGraph(x).is_stratified([True])
 
 
 class RuleDependencyGraph(utility.BagGraph):
@@ -1820,6 +1903,16 @@ def rule_errors(rule, theories=None, theory=None):
     return errors
 
 
+def variable_slots(literals):
+    """Number the variables of LITERALS from 0 in order of appearance."""
+    slots = {}
+    for lit in literals:
+        for arg in lit.arguments:
+            if arg.is_variable() and arg not in slots:
+                slots[arg] = len(slots)
+    return slots
+
+
 # Type-checkers
 def is_atom(x):
     """Returns True if object X is an atomic Datalog formula."""
@@ -2311,10 +2404,25 @@ def string_is_servicename(name):
 ##############################################################################
 
 def parse(policy_string, theories=None, use_modules=True):
-    """Run compiler on policy string and return the parsed formulas."""
-    compiler = get_compiler(
-        [policy_string, '--input_string'], theories=theories,
-        use_modules=use_modules)
+    """Run compiler on policy string and return the parsed formulas.
+
+    Strings made only of simple atoms are read by parse_atoms.  The
+    formulas of other strings are kept in parse_cache, and later calls
+    return copies of them.
+    """
+    formulas = parse_atoms(policy_string, use_modules=use_modules)
+    if formulas is not None:
+        return formulas
+    # the formulas do not depend on THEORIES, only on the text
+    key = (policy_string, use_modules)
+    formulas = parse_cache.get(key)
+    if formulas is not None:
+        return [_copy_formula(formula) for formula in formulas]
+    compiler = Compiler()
+    compiler.read_source(policy_string, input_string=True,
+                         theories=theories, use_modules=use_modules)
+    parse_cache.put(key, [_copy_formula(formula)
+                          for formula in compiler.theory])
     return compiler.theory
 
 
@@ -2333,6 +2441,149 @@ def parse_file(filename, theories=None):
     return compiler.theory
 
 
+class ParseCache(object):
+    """Bounded LRU cache of the formulas parsed from policy strings.
+
+    At most SIZE strings are kept, and none longer than MAX_LENGTH.
+    """
+
+    def __init__(self, size=1024, max_length=4096):
+        self.size = size
+        self.max_length = max_length
+        self._formulas = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            formulas = self._formulas.pop(key, None)
+            if formulas is not None:
+                self._formulas[key] = formulas
+            return formulas
+
+    def put(self, key, formulas):
+        if self.size <= 0 or len(key[0]) > self.max_length:
+            return
+        with self._lock:
+            self._formulas.pop(key, None)
+            self._formulas[key] = formulas
+            while len(self._formulas) > self.size:
+                self._formulas.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._formulas.clear()
+
+    def __len__(self):
+        return len(self._formulas)
+
+
+parse_cache = ParseCache()
+
+
+def _copy_formula(formula):
+    """Return a copy of the parsed FORMULA that shares only its terms.
+
+    Rules get a new id, as they would from parsing the text again.
+    """
+    if isinstance(formula, Literal):
+        return Literal(copy.copy(formula.table), list(formula.arguments),
+                       location=formula.location, negated=formula.negated,
+                       use_modules=False,
+                       named_arguments=formula.named_arguments)
+    if isinstance(formula, Rule):
+        return Rule([_copy_formula(head) for head in formula.heads],
+                    [_copy_formula(lit) for lit in formula.body],
+                    location=formula.location)
+    if isinstance(formula, Event):
+        return Event(formula=_copy_formula(formula.formula),
+                     insert=formula.insert, target=formula.target)
+    return copy.deepcopy(formula)
+
+
+# tokens of the atoms parse_atoms reads; anything else, including
+#   identifiers containing '.', is left to the grammar
+_BLANK = re.compile(r'[ \t\r\n]*')
+_SPACE = re.compile(r'[ \t\r]*')
+_TABLENAME = re.compile(
+    r'[A-Za-z_][A-Za-z0-9_]*(?::[A-Za-z_][A-Za-z0-9_]*)*')
+_TERM = re.compile(r'("[^"\\\r\n]*"|\'[^\'\\\r\n]*\')|'
+                   r'([0-9]+\.[0-9]+)|'
+                   r'([1-9][0-9]*|0+)|'
+                   r'([A-Za-z_][A-Za-z0-9_]*)')
+_KEYWORDS = frozenset(['not', 'NOT', 'execute', 'insert', 'delete'])
+
+
+def parse_atoms(policy_string, use_modules=True):
+    """Parse POLICY_STRING if it only holds atoms, without the grammar.
+
+    Covers ground facts and simple atom queries: unnegated atoms without
+    modals, update signs or named arguments, whose arguments are
+    variables, integers, floats without exponent and strings without
+    escapes.  Atoms may be split by whitespace, but each must fit on
+    one line.  Returns the formulas the grammar would give, or None if
+    POLICY_STRING is anything else.
+    """
+    formulas = []
+    line = 1
+    line_start = 0
+    pos = 0
+    while True:
+        blank = _BLANK.match(policy_string, pos)
+        pos = blank.end()
+        newline = policy_string.rfind('\n', blank.start(), pos)
+        if newline >= 0:
+            line += policy_string.count('\n', blank.start(), pos)
+            line_start = newline + 1
+        if pos == len(policy_string):
+            break
+        match = _TABLENAME.match(policy_string, pos)
+        if match is None or not _KEYWORDS.isdisjoint(
+                match.group().split(':')):
+            return None
+        table = Tablename.create_from_tablename(
+            match.group(), use_modules=use_modules)
+        # the grammar places atoms at the imaginary token of their name
+        loc = utils.Location(line=0, col=-1)
+        args = []
+        after = _SPACE.match(policy_string, match.end()).end()
+        if policy_string.startswith('(', after):
+            pos = _SPACE.match(policy_string, after + 1).end()
+            while not policy_string.startswith(')', pos):
+                if args:
+                    if not policy_string.startswith(',', pos):
+                        return None
+                    pos = _SPACE.match(policy_string, pos + 1).end()
+                match = _TERM.match(policy_string, pos)
+                if match is None:
+                    return None
+                arg_loc = utils.Location(line=line, col=pos - line_start)
+                quoted, real, integer, variable = match.groups()
+                if quoted is not None:
+                    arg = ObjectConstant(quoted[1:-1], ObjectConstant.STRING,
+                                         location=arg_loc)
+                elif real is not None:
+                    arg = ObjectConstant(float(real), ObjectConstant.FLOAT,
+                                         location=arg_loc)
+                elif integer is not None:
+                    arg = ObjectConstant(int(integer),
+                                         ObjectConstant.INTEGER,
+                                         location=arg_loc)
+                elif variable in _KEYWORDS:
+                    return None
+                else:
+                    arg = Variable(variable, location=arg_loc)
+                args.append(arg)
+                pos = _SPACE.match(policy_string, match.end()).end()
+            pos += 1
+        else:
+            pos = match.end()
+        formulas.append(Literal(table, args, location=loc,
+                                named_arguments={}))
+    if not formulas:
+        return None
+    return formulas
+
+
 def get_compiler(args, theories=None, use_modules=True):
     """Run compiler as per ARGS and return the compiler object."""
     # assumes script name is not passed
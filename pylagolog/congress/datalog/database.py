@@ -17,8 +17,6 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
 
-from six.moves import range
-
 from pylagolog.congress.datalog import base
 from pylagolog.congress.datalog import compile
 from pylagolog.congress.datalog import topdown
@@ -108,12 +106,49 @@ class Database(topdown.TopDownTheory):
         def __ne__(self, other):
             return not self.__eq__(other)
 
+    class ProofCount(object):
+        """The number of derivations of a tuple, in place of its proofs.
+
+        Supports the operations on ProofCollection that insert_actual
+        and delete_actual use, adding and subtracting counts.
+        """
+        def __init__(self, count=1):
+            self.count = count
+
+        def __str__(self):
+            return '{%d}' % self.count
+
+        def __isub__(self, other):
+            if other is None:
+                return self
+            self.count -= len(other)
+            return self
+
+        def __ior__(self, other):
+            if other is None:
+                return self
+            self.count += len(other)
+            return self
+
+        def __len__(self):
+            return self.count
+
+        def __eq__(self, other):
+            return (isinstance(other, Database.ProofCount) and
+                    self.count == other.count)
+
+        def __ne__(self, other):
+            return not self.__eq__(other)
+
     class DBTuple(object):
         def __init__(self, iterable, proofs=None):
             self.tuple = tuple(iterable)
             if proofs is None:
                 proofs = []
-            self.proofs = Database.ProofCollection(proofs)
+            if isinstance(proofs, Database.ProofCount):
+                self.proofs = Database.ProofCount(proofs.count)
+            else:
+                self.proofs = Database.ProofCollection(proofs)
 
         def __eq__(self, other):
             return self.tuple == other.tuple
@@ -136,29 +171,17 @@ class Database(topdown.TopDownTheory):
         def match(self, atom, unifier):
             # LOG.debug("DBTuple matching %s against atom %s in %s",
             #     self, iterstr(atom.arguments), unifier)
-            if len(self.tuple) != len(atom.arguments):
-                return None
-            changes = []
-            for i in range(0, len(atom.arguments)):
-                val, binding = unifier.apply_full(atom.arguments[i])
-                # LOG.debug("val(%s)=%s at %s; comparing to object %s",
-                #     atom.arguments[i], val, binding, self.tuple[i])
-                if val.is_variable():
-                    changes.append(binding.add(
-                        val, compile.Term.create_from_python(self.tuple[i]),
-                        None))
-                else:
-                    if val.name != self.tuple[i]:
-                        unify.undo_all(changes)
-                        return None
-            return changes
+            return unify.match_values(atom, unifier, self.tuple)
 
     def __init__(self, name=None, abbr=None, theories=None, schema=None,
                  desc=None, owner=None):
         super(Database, self).__init__(
             name=name, abbr=abbr, theories=theories, schema=schema,
             desc=desc, owner=owner)
+        # {table: {raw tuple: DBTuple}}
         self.data = {}
+        # {table: {columns: {key: {raw tuple: DBTuple}}}}
+        self._indexes = {}
         self.kind = base.DATABASE_POLICY_TYPE
 
     def str2(self):
@@ -173,7 +196,7 @@ class Database(topdown.TopDownTheory):
             for key in h:
                 s = "{} : ".format(key)
                 s += '['
-                s += ', '.join([str(val) for val in h[key]])
+                s += ', '.join([str(val) for val in h[key].values()])
                 s += ']'
                 strings.append(s)
             return '{' + ", ".join(strings) + '}'
@@ -195,18 +218,18 @@ class Database(topdown.TopDownTheory):
         results = []
         for table in self.data:
             if table not in other.data:
-                for dbtuple in self.data[table]:
+                for dbtuple in self.data[table].values():
                     add_tuple(table, dbtuple)
             else:
-                for dbtuple in self.data[table]:
-                    if dbtuple not in other.data[table]:
+                for raw_tuple, dbtuple in self.data[table].items():
+                    if raw_tuple not in other.data[table]:
                         add_tuple(table, dbtuple)
         return results
 
     def __or__(self, other):
         def add_db(db):
             for table in db.data:
-                for dbtuple in db.data[table]:
+                for dbtuple in db.data[table].values():
                     result.insert(compile.Literal.create_from_table_tuple(
                         table, dbtuple.tuple), proofs=dbtuple.proofs)
         result = Database()
@@ -216,7 +239,7 @@ class Database(topdown.TopDownTheory):
 
     def __getitem__(self, key):
         # KEY must be a tablename
-        return self.data[key]
+        return list(self.data[key].values())
 
     def content(self, tablenames=None):
         """Return a sequence of Literals representing all the table data."""
@@ -226,7 +249,7 @@ class Database(topdown.TopDownTheory):
         for table in tablenames:
             if table not in self.data:
                 continue
-            for dbtuple in self.data[table]:
+            for dbtuple in self.data[table].values():
                 results.append(compile.Literal.create_from_table_tuple(
                     table, dbtuple.tuple))
         return results
@@ -241,12 +264,10 @@ class Database(topdown.TopDownTheory):
             noop = False
         if event.formula.table.table not in self.data:
             return not noop
-        event_data = self.data[event.formula.table.table]
         raw_tuple = tuple(event.formula.argument_names())
-        for dbtuple in event_data:
-            if dbtuple.tuple == raw_tuple:
-                if event.proofs <= dbtuple.proofs:
-                    return noop
+        dbtuple = self.data[event.formula.table.table].get(raw_tuple)
+        if dbtuple is not None and event.proofs <= dbtuple.proofs:
+            return noop
         return not noop
 
     def __contains__(self, formula):
@@ -254,17 +275,17 @@ class Database(topdown.TopDownTheory):
             return False
         if formula.table.table not in self.data:
             return False
-        event_data = self.data[formula.table.table]
         raw_tuple = tuple(formula.argument_names())
-        return any((dbtuple.tuple == raw_tuple for dbtuple in event_data))
+        return raw_tuple in self.data[formula.table.table]
 
     def explain(self, atom):
         if atom.table.table not in self.data or not atom.is_ground():
             return self.ProofCollection([])
         args = tuple([x.name for x in atom.arguments])
-        for dbtuple in self.data[atom.table.table]:
-            if dbtuple.tuple == args:
-                return dbtuple.proofs
+        dbtuple = self.data[atom.table.table].get(args)
+        if dbtuple is None:
+            return None
+        return dbtuple.proofs
 
     def tablenames(self, body_only=False, include_builtin=False,
                    include_modal=True):
@@ -279,9 +300,74 @@ class Database(topdown.TopDownTheory):
         return self.data.keys()
 
     def head_index(self, table, match_literal=None):
+        """Return the DBTuples in TABLE that may unify with MATCH_LITERAL.
+
+        Only the columns of MATCH_LITERAL bound to constants are used to
+        narrow the result, via an index on those columns created on demand.
+        """
         if table not in self.data:
             return []
-        return self.data[table]
+        partial = ()
+        if match_literal is not None:
+            partial = tuple((i, arg.name)
+                            for i, arg in enumerate(match_literal.arguments)
+                            if arg.is_object())
+        if not partial:
+            result = list(self.data[table].values())
+        else:
+            columns = tuple(i for i, _ in partial)
+            key = tuple(value for _, value in partial)
+            index = self._indexes.setdefault(table, {})
+            if columns not in index:
+                self._create_index(table, columns)
+            result = list(index[columns].get(key, {}).values())
+        if self.profiler is not None:
+            counts = self.profiler.table(self.name, table)
+            if partial:
+                counts['index_hits'] += 1
+            counts['facts_scanned'] += len(result)
+            counts['facts_returned'] += len(result)
+        return result
+
+    def estimate_rows(self, table, columns):
+        if table not in self.data:
+            return 0
+        data = self.data[table]
+        if not data:
+            return 0
+        width = len(next(iter(data)))
+        return utility.estimate_matches(len(data), width, columns,
+                                        self._indexes.get(table, {}))
+
+    def _create_index(self, table, columns):
+        """Index the tuples of TABLE on the column positions COLUMNS."""
+        index = {}
+        for raw_tuple, dbtuple in self.data[table].items():
+            key = self._compute_key(columns, raw_tuple)
+            if key is not None:
+                index.setdefault(key, {})[raw_tuple] = dbtuple
+        self._indexes.setdefault(table, {})[columns] = index
+
+    @staticmethod
+    def _compute_key(columns, raw_tuple):
+        if columns and columns[-1] >= len(raw_tuple):
+            return None
+        return tuple(raw_tuple[i] for i in columns)
+
+    def _add_to_indexes(self, table, dbtuple):
+        for columns, index in self._indexes.get(table, {}).items():
+            key = self._compute_key(columns, dbtuple.tuple)
+            if key is not None:
+                index.setdefault(key, {})[dbtuple.tuple] = dbtuple
+
+    def _remove_from_indexes(self, table, dbtuple):
+        for columns, index in self._indexes.get(table, {}).items():
+            key = self._compute_key(columns, dbtuple.tuple)
+            if key is None or key not in index:
+                continue
+            index[key].pop(dbtuple.tuple, None)
+            if not index[key]:
+                del index[key]
 
     def head(self, thing):
         return thing
@@ -289,6 +375,9 @@ class Database(topdown.TopDownTheory):
     def body(self, thing):
         return []
 
+    def variable_slots(self, thing):
+        return {}
+
     def bi_unify(self, dbtuple, unifier1, atom, unifier2, theoryname):
         """THING1 is always a ground DBTuple and THING2 is always an ATOM."""
         return dbtuple.match(atom, unifier2)
@@ -342,14 +431,17 @@ class Database(topdown.TopDownTheory):
         """
         assert compile.is_atom(event.formula), "Modify requires Atom"
         atom = event.formula
-        self.log(atom.table.table, "Modify: %s", atom)
+        if self.tracer.enabled:
+            self.log(atom.table.table, "Modify: %s", atom)
         if self.is_noop(event):
-            self.log(atom.table.table, "Event %s is a noop", event)
+            if self.tracer.enabled:
+                self.log(atom.table.table, "Event %s is a noop", event)
             return []
         if event.insert:
             self.insert_actual(atom, proofs=event.proofs)
         else:
             self.delete_actual(atom, proofs=event.proofs)
+        self.clear_answer_tables()
         return [event]
 
     def insert_actual(self, atom, proofs=None):
@@ -359,20 +451,21 @@ class Database(topdown.TopDownTheory):
         """
         assert compile.is_atom(atom), "Insert requires Atom"
         table, dbtuple = self.atom_to_internal(atom, proofs)
-        self.log(table, "Insert: %s", atom)
+        if self.tracer.enabled:
+            self.log(table, "Insert: %s", atom)
         if table not in self.data:
-            self.data[table] = [dbtuple]
-            self.log(atom.table.table, "First tuple in table %s", table)
+            self.data[table] = {dbtuple.tuple: dbtuple}
+            if self.tracer.enabled:
+                self.log(atom.table.table, "First tuple in table %s", table)
             return
-        else:
-            for existingtuple in self.data[table]:
-                assert existingtuple.proofs is not None
-                if existingtuple.tuple == dbtuple.tuple:
-                    assert existingtuple.proofs is not None
-                    existingtuple.proofs |= dbtuple.proofs
-                    assert existingtuple.proofs is not None
-                    return
-            self.data[table].append(dbtuple)
+        existingtuple = self.data[table].get(dbtuple.tuple)
+        if existingtuple is not None:
+            assert existingtuple.proofs is not None
+            existingtuple.proofs |= dbtuple.proofs
+            assert existingtuple.proofs is not None
+            return
+        self.data[table][dbtuple.tuple] = dbtuple
+        self._add_to_indexes(table, dbtuple)
 
     def delete_actual(self, atom, proofs=None):
         """Workhorse for deleting ATOM from the DB.
@@ -380,17 +473,18 @@ class Database(topdown.TopDownTheory):
         Along with the proofs that are no longer true.
         """
         assert compile.is_atom(atom), "Delete requires Atom"
-        self.log(atom.table.table, "Delete: %s", atom)
+        if self.tracer.enabled:
+            self.log(atom.table.table, "Delete: %s", atom)
         table, dbtuple = self.atom_to_internal(atom, proofs)
         if table not in self.data:
             return
-        for i in range(0, len(self.data[table])):
-            existingtuple = self.data[table][i]
-            if existingtuple.tuple == dbtuple.tuple:
-                existingtuple.proofs -= dbtuple.proofs
-                if len(existingtuple.proofs) == 0:
-                    del self.data[table][i]
-                return
+        existingtuple = self.data[table].get(dbtuple.tuple)
+        if existingtuple is None:
+            return
+        existingtuple.proofs -= dbtuple.proofs
+        if len(existingtuple.proofs) == 0:
+            del self.data[table][dbtuple.tuple]
+            self._remove_from_indexes(table, existingtuple)
 
     def policy(self):
         """Return the policy for this theory.
@@ -404,7 +498,7 @@ class Database(topdown.TopDownTheory):
             return None
         if len(self.data[tablename]) == 0:
             return None
-        return len(self.data[tablename][0].tuple)
+        return len(next(iter(self.data[tablename])))
 
     def content_string(self):
         s = ""
@@ -17,6 +17,11 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
 
+import array
+
+from six.moves import range
+
+from pylagolog.congress.datalog import compile
 from pylagolog.congress.datalog import utility
 
 
@@ -27,12 +32,15 @@ class FactSet(object):
     given a partial or full match.  Expects that all facts are the same width.
     """
 
-    def __init__(self):
+    def __init__(self, facts=None):
         self._facts = utility.OrderedSet()
 
         # key is a sorted tuple of column indices, values are dict mapping a
         # specific value for the key to a set of Facts.
         self._indicies = {}
+        if facts is not None:
+            for fact in facts:
+                self.add(fact)
 
     def __contains__(self, fact):
         return fact in self._facts
@@ -92,8 +100,12 @@ class FactSet(object):
         if columns in self._indicies:
             return
 
+        # only published once complete, as queries running concurrently
+        #   may look the index up
+        index = {}
         for f in self._facts:
-            self._add_fact_to_index(f, columns)
+            index.setdefault(self._compute_key(columns, f), set()).add(f)
+        self._indicies[columns] = index
 
     def remove_index(self, columns):
         """Remove an index
@@ -111,7 +123,11 @@ class FactSet(object):
         """Returns True if the index exists."""
         return columns in self._indicies
 
-    def find(self, partial_fact, iterations=None):
+    def indexes(self):
+        """Returns the column tuples of the indexes that exist."""
+        return list(self._indicies)
+
+    def find(self, partial_fact, iterations=None, counts=None):
         """Find Facts given a partial fact
 
         @partial_fact is a tuple of pair tuples.  The first item in each
@@ -123,6 +139,10 @@ class FactSet(object):
         empty list, then find() will append the number of iterations find()
         used to compute the return value(this is useful for testing indexing).
 
+        @counts is either None or a collections.Counter to which find() adds
+        the number of facts it scanned and returned, and whether it used an
+        index (see base.Profiler).
+
         Returns matching Facts.
         """
         index = tuple([i for i, v in partial_fact])
@@ -130,10 +150,12 @@ class FactSet(object):
         if index in self._indicies:
             if iterations is not None:
                 iterations.append(1)
-            if k in self._indicies[index]:
-                return self._indicies[index][k]
-            else:
-                return set()
+            matches = self._indicies[index].get(k, set())
+            if counts is not None:
+                counts['index_hits'] += 1
+                counts['facts_scanned'] += len(matches)
+                counts['facts_returned'] += len(matches)
+            return matches
 
         # There is no index, so iterate.
         matches = set()
@@ -148,8 +170,38 @@ class FactSet(object):
 
         if iterations is not None:
             iterations.append(len(self._facts))
+        if counts is not None:
+            counts['facts_scanned'] += len(self._facts)
+            counts['facts_returned'] += len(matches)
         return matches
 
+    def lookup(self, columns, key):
+        """Find Facts given the values of some columns
+
+        @columns is a sorted tuple of column indicies and @key is the tuple
+        of values those columns must have.  Unlike find(), the index on
+        @columns is created if it does not exist yet.
+
+        Returns an iterable over the matching Facts that must not be
+        modified.
+        """
+        if not columns:
+            return self._facts.map
+        if columns not in self._indicies:
+            self.create_index(columns)
+        return self._indicies.get(columns, {}).get(key, ())
+
+    def estimate(self, columns):
+        """Estimate the number of Facts sharing one value for @columns
+
+        @columns is a sorted tuple of column indicies.
+        """
+        if not self._facts:
+            return 0
+        width = len(next(iter(self._facts)))
+        return utility.estimate_matches(len(self._facts), width, columns,
+                                        self._indicies)
+
     def _compute_key(self, columns, fact):
         # assumes that @columns is sorted in ascending order.
         return tuple([fact[i] for i in columns])
@@ -169,3 +221,484 @@ class FactSet(object):
         self._indicies[index][k].remove(fact)
         if not len(self._indicies[index][k]):
             del self._indicies[index][k]
+
+
+# typecode of the arrays of integer columns and row ids: 64 bits if the
+#   array module has a typecode for it
+try:
+    array.array('q')
+    _INTEGER = 'q'
+except ValueError:
+    _INTEGER = 'l'
+
+
+class ColumnarFactSet(object):
+    """ColumnarFactSet
+
+    A FactSet that stores its facts column by column, for large base
+    tables such as those of datasources.  Columns of ints or floats are
+    arrays of machine numbers, and other columns lists of references to
+    the (interned) values, so a row costs 8 bytes per column rather than
+    a tuple and the links of an OrderedSet.  Removed rows are marked
+    dead and left in place until they outnumber the live ones.  Rows
+    are found by hash in an open-addressing table of row ids, and
+    indexes map keys to row ids.
+
+    Provides the methods of FactSet, but builds the Facts it returns on
+    demand: they are equal to the Facts added, not the same objects.
+    Facts whose width differs from the first one added are kept in a
+    FactSet on the side.
+    """
+
+    # dead rows are compacted away once there are at least this many and
+    #   more than live ones
+    COMPACT_MIN = 64
+
+    def __init__(self, facts=None):
+        self.table = None
+        self._clear()
+        # Facts of another width than the first one, or None
+        self._others = None
+        if facts is not None:
+            for fact in facts:
+                self.add(fact)
+
+    @classmethod
+    def from_columns(cls, table, columns):
+        """Return a ColumnarFactSet of TABLE holding the rows of COLUMNS.
+
+        COLUMNS is a non-empty list of columns of equal length, each an
+        array.array of ints or floats or a list, which the new
+        ColumnarFactSet takes over.  The rows must be distinct.  Only
+        the hash table of rows is built, so this is much faster than
+        adding the rows one by one.
+        """
+        facts = cls()
+        facts.table = table
+        if len(columns[0]):
+            facts._width = len(columns)
+            facts._columns = list(columns)
+            facts._live = bytearray(b'\x01') * len(columns[0])
+            facts._count = len(columns[0])
+            facts._rehash()
+        return facts
+
+    def _clear(self):
+        self._width = None
+        # an array while all the values of the column are of its type,
+        #   otherwise a list
+        self._columns = []
+        # 1 for live rows, 0 for dead ones
+        self._live = bytearray()
+        self._count = 0
+        # hash table of row ids plus one, 0 marking empty slots.  Holds
+        #   dead rows too, which never match.
+        self._slots = array.array(_INTEGER, [0]) * 8
+        # key is a sorted tuple of column indices, values are dict mapping a
+        # specific value for the key to row id(s).  Keys on one column are
+        # the bare value.  Row ids may be of dead rows.
+        self._indicies = {}
+
+    def __contains__(self, fact):
+        if self._width is not None and len(fact) == self._width:
+            return self._find_row(fact) is not None
+        return self._others is not None and fact in self._others
+
+    def __len__(self):
+        if self._others is None:
+            return self._count
+        return self._count + len(self._others)
+
+    def __iter__(self):
+        live = self._live
+        for row in range(len(live)):
+            if live[row]:
+                yield self._fact(row)
+        if self._others is not None:
+            for fact in list(self._others):
+                yield fact
+
+    def add(self, fact):
+        """Add a fact to the ColumnarFactSet
+
+        Returns True if the fact is absent from this ColumnarFactSet and
+        adds the fact, otherwise returns False.
+        """
+        assert isinstance(fact, tuple)
+        if self._width is None:
+            self._width = len(fact)
+            self._columns = [self._new_column(value) for value in fact]
+            if self.table is None:
+                self.table = getattr(fact, 'table', None)
+        elif len(fact) != self._width:
+            if self._others is None:
+                self._others = FactSet()
+            return self._others.add(fact)
+        if self._find_row(fact) is not None:
+            return False
+
+        row = len(self._live)
+        columns = self._columns
+        for i, value in enumerate(fact):
+            column = columns[i]
+            if type(column) is not list:
+                if type(value) is self._column_type(column):
+                    try:
+                        column.append(value)
+                        continue
+                    except OverflowError:
+                        pass
+                # the column takes values other than its numbers
+                column = columns[i] = list(column)
+            column.append(value)
+        self._live.append(1)
+        self._count += 1
+        if 3 * (row + 1) > 2 * len(self._slots):
+            self._rehash()
+        else:
+            self._insert_slot(tuple.__hash__(fact), row)
+        for columns, index in self._indicies.items():
+            self._link(index, self._compute_key(columns, fact), row)
+        return True
+
+    def remove(self, fact):
+        """Remove a fact from the ColumnarFactSet
+
+        Returns True if the fact is in this ColumnarFactSet and removes the
+        fact, otherwise returns False.
+        """
+        if self._width is None or len(fact) != self._width:
+            return self._others is not None and self._others.remove(fact)
+        row = self._find_row(fact)
+        if row is None:
+            return False
+
+        self._live[row] = 0
+        self._count -= 1
+        # other row ids are dropped from the indexes when compacting
+        for columns, index in self._indicies.items():
+            key = self._compute_key(columns, fact)
+            if index.get(key) == row:
+                del index[key]
+        dead = len(self._live) - self._count
+        if dead >= self.COMPACT_MIN and dead > self._count:
+            self._compact()
+        return True
+
+    def create_index(self, columns):
+        """Create an index
+
+        @columns is a tuple of column indicies that index into the facts in
+        self.  @columns must be sorted in ascending order, and each column
+        index must be less than the width of a fact in self.  If the index
+        exists, do nothing.
+        """
+        assert sorted(columns) == list(columns)
+        assert len(columns)
+
+        if columns in self._indicies:
+            return
+        if self._others is not None:
+            self._others.create_index(columns)
+
+        # only published once complete, as queries running concurrently
+        #   may look the index up
+        index = {}
+        live = self._live
+        if self._count and len(columns) == 1:
+            column = self._columns[columns[0]]
+            for row in range(len(live)):
+                if live[row]:
+                    self._link(index, column[row], row)
+        elif self._count:
+            selected = [self._columns[i] for i in columns]
+            for row in range(len(live)):
+                if live[row]:
+                    self._link(index, tuple([c[row] for c in selected]),
+                               row)
+        self._indicies[columns] = index
+
+    def remove_index(self, columns):
+        """Remove an index
+
+        @columns is a tuple of column indicies that index into the facts in
+        self.  @columns must be sorted in ascending order, and each column
+        index must be less than the width of a fact in self.  If the index
+        does not exists, raise KeyError.
+        """
+        assert sorted(columns) == list(columns)
+        if columns in self._indicies:
+            del self._indicies[columns]
+        if self._others is not None:
+            self._others.remove_index(columns)
+
+    def has_index(self, columns):
+        """Returns True if the index exists."""
+        return columns in self._indicies
+
+    def indexes(self):
+        """Returns the column tuples of the indexes that exist."""
+        return list(self._indicies)
+
+    def find(self, partial_fact, iterations=None, counts=None):
+        """Find Facts given a partial fact
+
+        Takes the same arguments as FactSet.find.  Returns a list of the
+        matching Facts.
+        """
+        columns = tuple([i for i, v in partial_fact])
+        k = tuple([v for i, v in partial_fact])
+        if columns in self._indicies:
+            if iterations is not None:
+                iterations.append(1)
+            matches = self._matches(columns, k)
+            if counts is not None:
+                counts['index_hits'] += 1
+                counts['facts_scanned'] += len(matches)
+                counts['facts_returned'] += len(matches)
+        else:
+            # There is no index, so scan the columns.
+            matches = []
+            if self._count:
+                pairs = [(self._columns[i], v) for i, v in partial_fact]
+                live = self._live
+                for row in range(len(live)):
+                    if live[row]:
+                        for column, v in pairs:
+                            if column[row] != v:
+                                break
+                        else:
+                            matches.append(self._fact(row))
+            if iterations is not None:
+                iterations.append(self._count)
+            if counts is not None:
+                counts['facts_scanned'] += self._count
+                counts['facts_returned'] += len(matches)
+        if self._others is not None:
+            matches.extend(self._others.find(partial_fact, counts=counts))
+        return matches
+
+    def lookup(self, columns, key):
+        """Find Facts given the values of some columns
+
+        Takes the same arguments as FactSet.lookup.  Returns a list of the
+        matching Facts.
+        """
+        if not columns:
+            return list(self)
+        if columns not in self._indicies:
+            self.create_index(columns)
+        matches = self._matches(columns, key)
+        if self._others is not None:
+            matches.extend(self._others.lookup(columns, key))
+        return matches
+
+    def raw_columns(self):
+        """Return the storage of the facts, or None if of several widths.
+
+        Returns a pair: the bytearray flagging live rows with 1, and the
+        list of columns, each an array.array or a list indexed by row.
+        Neither must be modified.
+        """
+        if self._others is not None:
+            return None
+        return self._live, self._columns
+
+    def estimate(self, columns):
+        """Estimate the number of Facts sharing one value for @columns
+
+        @columns is a sorted tuple of column indicies.
+        """
+        if not self._count:
+            return 0
+        return utility.estimate_matches(self._count, self._width, columns,
+                                        self._indicies)
+
+    @staticmethod
+    def _new_column(value):
+        if type(value) is int:
+            return array.array(_INTEGER)
+        if type(value) is float:
+            return array.array('d')
+        return []
+
+    @staticmethod
+    def _column_type(column):
+        """Return the type of the values in the array COLUMN."""
+        if column.typecode == 'd':
+            return float
+        return int
+
+    def _fact(self, row):
+        return compile.Fact(self.table,
+                            [column[row] for column in self._columns])
+
+    def _find_row(self, fact):
+        """Return the row id of the live row equal to FACT, or None."""
+        slots = self._slots
+        mask = len(slots) - 1
+        i = tuple.__hash__(fact) & mask
+        live = self._live
+        columns = self._columns
+        while True:
+            row = slots[i] - 1
+            if row < 0:
+                return None
+            if live[row]:
+                for column, value in zip(columns, fact):
+                    if column[row] != value:
+                        break
+                else:
+                    return row
+            i = (i + 1) & mask
+
+    def _insert_slot(self, hash, row):
+        slots = self._slots
+        mask = len(slots) - 1
+        i = hash & mask
+        while slots[i]:
+            i = (i + 1) & mask
+        slots[i] = row + 1
+
+    def _rehash(self):
+        """Grow the hash table of rows, leaving out the dead ones."""
+        size = len(self._slots)
+        while 3 * len(self._live) > size:
+            size *= 2
+        self._slots = array.array(_INTEGER, [0]) * size
+        live = self._live
+        columns = self._columns
+        for row in range(len(live)):
+            if live[row]:
+                self._insert_slot(
+                    hash(tuple([column[row] for column in columns])), row)
+
+    def _matches(self, columns, key):
+        if len(key) == 1:
+            key = key[0]
+        rows = self._indicies[columns].get(key)
+        if rows is None:
+            return []
+        if isinstance(rows, int):
+            return [self._fact(rows)]
+        live = self._live
+        return [self._fact(row) for row in rows if live[row]]
+
+    def _compute_key(self, columns, fact):
+        # assumes that @columns is sorted in ascending order.
+        if len(columns) == 1:
+            return fact[columns[0]]
+        return tuple([fact[i] for i in columns])
+
+    def _link(self, index, key, row):
+        rows = index.get(key)
+        if rows is None:
+            index[key] = row
+        elif isinstance(rows, int):
+            index[key] = array.array(_INTEGER, (rows, row))
+        else:
+            rows.append(row)
+
+    def _compact(self):
+        """Drop the dead rows."""
+        live = self._live
+        facts = [self._fact(row) for row in range(len(live)) if live[row]]
+        indexes = list(self._indicies)
+        self._clear()
+        for fact in facts:
+            self.add(fact)
+        for columns in indexes:
+            self.create_index(columns)
+
+
+class OverlayFactSet(object):
+    """OverlayFactSet
+
+    Changes to a FactSet, layered over it without modifying it.  Facts
+    added are kept in a FactSet of their own and facts removed from
+    BASE in a set, and every lookup combines them with the facts of
+    BASE.  Only indexes are created on BASE, as by any query reading
+    it, so overlays of one FactSet may be used concurrently.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self._added = FactSet()
+        self._removed = set()
+
+    def __contains__(self, fact):
+        if fact in self._added:
+            return True
+        return fact not in self._removed and fact in self.base
+
+    def __len__(self):
+        return len(self.base) - len(self._removed) + len(self._added)
+
+    def __iter__(self):
+        removed = self._removed
+        for fact in self.base:
+            if fact not in removed:
+                yield fact
+        for fact in self._added:
+            yield fact
+
+    def add(self, fact):
+        """Add a fact, returning True if it was absent."""
+        if fact in self._removed:
+            self._removed.discard(fact)
+            return True
+        if fact in self.base:
+            return False
+        return self._added.add(fact)
+
+    def remove(self, fact):
+        """Remove a fact, returning True if it was present."""
+        if self._added.remove(fact):
+            return True
+        if fact in self._removed or fact not in self.base:
+            return False
+        self._removed.add(fact)
+        return True
+
+    def create_index(self, columns):
+        self.base.create_index(columns)
+        self._added.create_index(columns)
+
+    def remove_index(self, columns):
+        # the indexes of BASE are left to the queries reading it
+        self._added.remove_index(columns)
+
+    def has_index(self, columns):
+        return self.base.has_index(columns) and self._added.has_index(columns)
+
+    def indexes(self):
+        return [columns for columns in self.base.indexes()
+                if self._added.has_index(columns)]
+
+    def find(self, partial_fact, iterations=None, counts=None):
+        """Find Facts given a partial fact, as FactSet.find."""
+        matches = self.base.find(partial_fact, iterations, counts)
+        if self._removed:
+            matches = set(fact for fact in matches
+                          if fact not in self._removed)
+        if len(self._added):
+            matches = set(matches)
+            matches.update(self._added.find(partial_fact, counts=counts))
+        return matches
+
+    def lookup(self, columns, key):
+        """Find Facts given the values of some columns, as FactSet.lookup."""
+        facts = self.base.lookup(columns, key)
+        if self._removed:
+            facts = [fact for fact in facts if fact not in self._removed]
+        if len(self._added):
+            facts = list(facts)
+            facts.extend(self._added.lookup(columns, key))
+        return facts
+
+    def estimate(self, columns):
+        """Estimate the number of Facts sharing one value for @columns."""
+        if not len(self._added):
+            return self.base.estimate(columns)
+        return max(self.base.estimate(columns),
+                   self._added.estimate(columns))
@@ -0,0 +1,444 @@
+# Copyright (c) 2019 Nippon Telegraph and Telephone Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import six
+
+from pylagolog.congress.datalog import builtin
+from pylagolog.congress.datalog import compile
+
+
+# A plan is ordered again once a table it reads grows or shrinks by more
+#   than REPLAN_FACTOR; tables below REPLAN_MIN_ROWS count as that size.
+REPLAN_FACTOR = 2
+REPLAN_MIN_ROWS = 16
+
+
+class JoinPlan(object):
+    """A rule body compiled into joins over native fact tuples.
+
+    BODY holds the literals of the rule in the order they are evaluated.
+    Every variable of the rule is given a slot in a flat list of values.
+    BOUND tells, for each argument of the rule head, whether the caller
+    supplies the value of its variable; those values are copied into the
+    slots before the body runs.  Each step of the plan then only reads
+    slots filled by the steps before it, so the columns every lookup
+    probes are fixed when the plan is compiled.
+    """
+
+    def __init__(self, rule, bound, body):
+        self.rule = rule
+        self.bound = bound
+        self.body = body
+        # dictionary from variable to its slot
+        self.slots = {}
+        # (slot, first occurrence) for each value supplied by the caller
+        self.inputs = []
+        # None if the body cannot be evaluated natively
+        self.steps = []
+        # dictionary from each table read by the plan to its arity
+        self.tables = {}
+        # (slot, value) for each head argument; slot is None for constants
+        self.output = []
+        # True if the caller supplies every variable of the head
+        self.determined = False
+        # (literal, estimated size of its table) the order was based on
+        self.statistics = []
+
+    def drifted(self, estimate):
+        """Return True if table sizes changed enough to order BODY again.
+
+        ESTIMATE is the function that was given to compile_plan.
+        """
+        for lit, planned in self.statistics:
+            current = estimate(lit, ())
+            if planned is None or current is None:
+                if planned is not current:
+                    return True
+                continue
+            low, high = sorted((planned, current))
+            if high > REPLAN_FACTOR * max(low, REPLAN_MIN_ROWS):
+                return True
+        return False
+
+    def usable(self, rules):
+        """Return True if the plan can run against the RuleSet RULES.
+
+        The plan only reads facts, so none of its tables may be defined
+        by rules.  Tables cleared by RuleSet.clear_table keep an empty
+        set of rules.
+        """
+        for table, arity in self.tables.items():
+            if rules.rules.get(table):
+                return False
+            facts = rules.facts.get(table)
+            if facts and len(next(iter(facts))) != arity:
+                return False
+        return True
+
+    def execute(self, facts, values, counts=None):
+        """Return the set of head tuples proven by the body.
+
+        FACTS is a dictionary from table name to FactSet, and VALUES
+        lists the values of the bound head arguments, in order.  COUNTS,
+        if given, is a function from a table name to the
+        collections.Counter the work on that table is counted in (see
+        base.Profiler).
+        """
+        slots = [None] * len(self.slots)
+        for (slot, first), value in zip(self.inputs, values):
+            if first:
+                slots[slot] = value
+            elif slots[slot] != value:
+                return set()
+        results = set()
+        self._execute(0, facts, slots, results, counts)
+        return results
+
+    def _execute(self, index, facts, slots, results, counts):
+        """Run the steps from INDEX on and add the answers to RESULTS.
+
+        Returns True if done searching and False otherwise.
+        """
+        if index == len(self.steps):
+            results.add(tuple([value if slot is None else slots[slot]
+                               for slot, value in self.output]))
+            # with the head fully bound, there is only one answer to find
+            return self.determined
+        return self.steps[index].execute(self, index, facts, slots, results,
+                                         counts)
+
+
+class Scan(object):
+    """Join the slots with the facts of TABLE.
+
+    COLUMNS are the columns known before the lookup and KEY says where
+    their values come from; BINDS fills slots from the other columns,
+    and CHECKS compares columns against slots filled by the same row.
+    SOURCE is the key of the facts read, TABLE unless the scan reads the
+    delta of TABLE (see delta_key).
+    """
+
+    def __init__(self, table, columns, key, binds, checks):
+        self.table = table
+        self.source = table
+        self.columns = columns
+        self.key = key
+        self.binds = binds
+        self.checks = checks
+
+    def execute(self, plan, index, facts, slots, results, counts):
+        factset = facts.get(self.source)
+        if factset is None:
+            return False
+        key = tuple([value if slot is None else slots[slot]
+                     for slot, value in self.key])
+        rows = factset.lookup(self.columns, key)
+        if counts is not None:
+            table_counts = counts(self.table)
+            if self.columns:
+                table_counts['index_hits'] += 1
+            table_counts['facts_scanned'] += len(rows)
+        for row in rows:
+            for column, slot in self.binds:
+                slots[slot] = row[column]
+            for column, slot in self.checks:
+                if row[column] != slots[slot]:
+                    break
+            else:
+                if counts is not None:
+                    table_counts['facts_returned'] += 1
+                if plan._execute(index + 1, facts, slots, results, counts):
+                    return True
+        return False
+
+
+class Negation(object):
+    """Succeed if the ground instance of TABLE given by KEY is absent."""
+
+    def __init__(self, table, key):
+        self.table = table
+        self.key = key
+
+    def execute(self, plan, index, facts, slots, results, counts):
+        if counts is not None:
+            counts(self.table)['negations'] += 1
+        factset = facts.get(self.table)
+        if factset is not None:
+            fact = compile.Fact(self.table,
+                                [value if slot is None else slots[slot]
+                                 for slot, value in self.key])
+            if fact in factset:
+                return False
+        return plan._execute(index + 1, facts, slots, results, counts)
+
+
+class Builtin(object):
+    """Call CODE, the builtin TABLE, on the values given by INPUTS.
+
+    OUTPUTS is None for builtins that only test their inputs, and
+    otherwise holds a (slot, value, bind) triple per output argument.
+    """
+
+    def __init__(self, table, code, inputs, outputs):
+        self.table = table
+        self.code = code
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def execute(self, plan, index, facts, slots, results, counts):
+        if counts is not None:
+            counts(self.table)['builtin_calls'] += 1
+        args = [value if slot is None else slots[slot]
+                for slot, value in self.inputs]
+        try:
+            result = self.code(*args)
+        except Exception:
+            return False
+        if self.outputs is None:
+            if not result:
+                return False
+            return plan._execute(index + 1, facts, slots, results, counts)
+        if isinstance(result, (six.integer_types, float, six.string_types)):
+            result = [result]
+        else:
+            result = list(result)
+        if len(result) != len(self.outputs):
+            return False
+        for (slot, value, bind), answer in zip(self.outputs, result):
+            if bind:
+                slots[slot] = answer
+            elif answer != (value if slot is None else slots[slot]):
+                return False
+        return plan._execute(index + 1, facts, slots, results, counts)
+
+
+def adorn(head, goal):
+    """Match the arguments of HEAD against the ones of GOAL.
+
+    Returns a pair: a tuple telling for each argument of HEAD whether
+    GOAL gives its variable a value, and the list of those values.
+    Returns None if HEAD cannot match GOAL.
+    """
+    bound = []
+    values = []
+    for head_arg, goal_arg in zip(head.arguments, goal.arguments):
+        if not goal_arg.is_object():
+            bound.append(False)
+        elif head_arg.is_variable():
+            bound.append(True)
+            values.append(goal_arg.name)
+        elif head_arg != goal_arg:
+            return None
+        else:
+            bound.append(False)
+    return tuple(bound), values
+
+
+def compile_plan(rule, bound, theoryname, estimate=None, delta=None):
+    """Return a JoinPlan for RULE in theory THEORYNAME.
+
+    BOUND is the first half of the result of adorn.  If ESTIMATE is given,
+    the body is first ordered by order_body.  The steps of the plan are
+    None when the body uses something they do not handle: tables of other
+    theories, modals, negated builtins or unbound builtin inputs.  The
+    ordered body is still useful for evaluating the rule literal by
+    literal.
+
+    For semi-naive evaluation, DELTA is the position of a positive literal
+    of the body to evaluate first, reading the facts found under
+    delta_key(table) instead of those of its table.
+    """
+    known = set(arg for arg, is_bound in zip(rule.head.arguments, bound)
+                if is_bound)
+    body = rule.body
+    if delta is not None:
+        first = body[delta]
+        body = body[:delta] + body[delta + 1:]
+        known.update(first.variables())
+    if estimate is not None:
+        body = order_body(body, known, estimate)
+    if delta is not None:
+        body = [first] + list(body)
+    plan = JoinPlan(rule, bound, body)
+    if estimate is not None:
+        plan.statistics = [(lit, estimate(lit, ())) for lit in body
+                           if not _is_filter(lit)]
+    if not _compile_steps(plan, theoryname):
+        plan.steps = None
+    elif delta is not None:
+        plan.steps[0].source = delta_key(first.table.table)
+    return plan
+
+
+def delta_key(table):
+    """Return the key of the delta of TABLE in the facts of a JoinPlan."""
+    return ('delta', table)
+
+
+def order_body(body, known, estimate):
+    """Return the literals of BODY in the order to evaluate them.
+
+    KNOWN is the set of variables bound before BODY is evaluated.
+    ESTIMATE is a function from a positive literal and the sorted tuple
+    of its argument positions known beforehand to the expected number of
+    matching rows, or None if that number is unknown.
+
+    Builtins and negated literals run as soon as their inputs are known,
+    which preserves the safety reorder_for_safety establishes.  Among the
+    other literals, those with a known argument come first and then the
+    cheapest is evaluated next, except that a literal with an unknown
+    estimate is never moved after a literal that follows it.  If no safe
+    order is found, BODY is returned unchanged.
+    """
+    known = set(known)
+    pending = list(body)
+    ordered = []
+
+    def choose(lit):
+        pending.remove(lit)
+        ordered.append(lit)
+        known.update(lit.variables())
+
+    while pending:
+        ready = [lit for lit in pending
+                 if _is_filter(lit) and _filter_inputs(lit) <= known]
+        if ready:
+            choose(ready[0])
+            continue
+        best = None
+        best_cost = None
+        for lit in pending:
+            if _is_filter(lit):
+                continue
+            columns = tuple(i for i, arg in enumerate(lit.arguments)
+                            if not arg.is_variable() or arg in known)
+            cost = estimate(lit, columns)
+            if cost is None:
+                if best is None:
+                    best = lit
+                break
+            # literals joining on nothing known make cross products
+            cost = (not columns, cost)
+            if best_cost is None or cost < best_cost:
+                best = lit
+                best_cost = cost
+        if best is None:
+            return list(body)
+        choose(best)
+    return ordered
+
+
+def _is_filter(lit):
+    return lit.is_negated() or lit.is_builtin()
+
+
+def _filter_inputs(lit):
+    if lit.is_negated():
+        return lit.variables()
+    built = builtin.builtin_registry.builtin(lit.table)
+    return set(arg for arg in lit.arguments[:built.num_inputs]
+               if arg.is_variable())
+
+
+def _compile_steps(plan, theoryname):
+    """Fill in the steps of PLAN and return True if possible."""
+    rule = plan.rule
+
+    def slot(var):
+        return plan.slots.setdefault(var, len(plan.slots))
+
+    def source(arg):
+        if arg.is_variable():
+            return (plan.slots[arg], None)
+        return (None, arg.name)
+
+    def is_known(arg):
+        return not arg.is_variable() or arg in plan.slots
+
+    for arg, is_bound in zip(rule.head.arguments, plan.bound):
+        if is_bound:
+            first = arg not in plan.slots
+            plan.inputs.append((slot(arg), first))
+
+    for lit in plan.body:
+        if lit.is_negated():
+            if (not _is_local(lit, theoryname) or lit.is_builtin() or
+                    not all(is_known(arg) for arg in lit.arguments)):
+                return False
+            plan.tables[lit.table.table] = len(lit.arguments)
+            plan.steps.append(Negation(
+                lit.table.table, [source(arg) for arg in lit.arguments]))
+        elif lit.is_builtin():
+            built = builtin.builtin_registry.builtin(lit.table)
+            inputs = lit.arguments[:built.num_inputs]
+            if not all(is_known(arg) for arg in inputs):
+                return False
+            outputs = None
+            if built.num_outputs > 0:
+                outputs = []
+                for arg in lit.arguments[built.num_inputs:]:
+                    if is_known(arg):
+                        outputs.append(source(arg) + (False,))
+                    else:
+                        outputs.append((slot(arg), None, True))
+            plan.steps.append(Builtin(
+                lit.tablename(), built.code, [source(arg) for arg in inputs],
+                outputs))
+        elif _is_local(lit, theoryname):
+            columns = []
+            key = []
+            unknown = []
+            for column, arg in enumerate(lit.arguments):
+                if is_known(arg):
+                    columns.append(column)
+                    key.append(source(arg))
+                else:
+                    unknown.append((column, arg))
+            # a variable repeated in the literal is bound by its first
+            #   column and checked against the others
+            binds = []
+            checks = []
+            for column, arg in unknown:
+                if arg in plan.slots:
+                    checks.append((column, plan.slots[arg]))
+                else:
+                    binds.append((column, slot(arg)))
+            plan.tables[lit.table.table] = len(lit.arguments)
+            plan.steps.append(Scan(lit.table.table, tuple(columns), key,
+                                   binds, checks))
+        else:
+            return False
+
+    for arg in rule.head.arguments:
+        if arg.is_variable():
+            if arg not in plan.slots:
+                return False
+            plan.output.append((plan.slots[arg], None))
+        else:
+            plan.output.append((None, arg.name))
+    plan.determined = all(
+        is_bound or not arg.is_variable()
+        for arg, is_bound in zip(rule.head.arguments, plan.bound))
+    return True
+
+
+def _is_local(lit, theoryname):
+    return (lit.table.modal is None and
+            lit.table.service in (None, theoryname) and
+            lit.table.table not in ('true', 'false'))
@@ -0,0 +1,124 @@
+# Copyright (c) 2019 Nippon Telegraph and Telephone Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Read the rows of a table from CSV, TSV or JSON Lines files.
+
+Rows are read one at a time, so that files much larger than memory can
+be loaded into a policy (see agnostic.Runtime.load_facts) without going
+through the Datalog parser.
+"""
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import csv
+import io
+import json
+import os
+import re
+
+import six
+
+from pylagolog.congress import exception
+from pylagolog.congress import utils
+
+
+FORMATS = ('csv', 'tsv', 'jsonl')
+
+_EXTENSIONS = {
+    '.csv': 'csv',
+    '.tsv': 'tsv',
+    '.tab': 'tsv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+}
+
+_NUMBER_START = frozenset('0123456789+-.')
+_INTEGER = re.compile(r'[-+]?[0-9]+\Z')
+_FLOAT = re.compile(r'[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\Z')
+
+
+def file_format(path):
+    """Return the format of the file PATH, guessed from its extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in _EXTENSIONS:
+        raise exception.PolicyException(
+            "Cannot tell the format of %s; expected one of %s" %
+            (path, ", ".join(sorted(_EXTENSIONS))))
+    return _EXTENSIONS[ext]
+
+
+def file_table(path):
+    """Return the table the file PATH holds: its name without extension."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def parse_value(value):
+    """Return the int or float written as VALUE, or else VALUE itself.
+
+    Fields of CSV and TSV files are all strings, so that numbers are
+    told from strings the way the Datalog parser does, by their syntax.
+    """
+    if value[:1] in _NUMBER_START:
+        if _INTEGER.match(value):
+            return int(value)
+        if _FLOAT.match(value):
+            return float(value)
+    return value
+
+
+def read_rows(path, format=None):
+    """Yield the rows of the file PATH as tuples.
+
+    FORMAT is one of FORMATS and defaults to the one of the extension of
+    PATH.  CSV and TSV files have no header; their fields are parsed by
+    parse_value.  Each line of a JSON Lines file is an array of the
+    values of a row.  Blank lines are skipped.
+    """
+    if format is None:
+        format = file_format(path)
+    if format not in FORMATS:
+        raise exception.PolicyException(
+            "Unknown format %s of %s; expected one of %s" %
+            (format, path, ", ".join(FORMATS)))
+    if format == 'jsonl':
+        return _read_json_lines(path)
+    return _read_delimited(path, ',' if format == 'csv' else '\t')
+
+
+def _read_delimited(path, delimiter):
+    with io.open(path, 'r', newline='') as f:
+        for row in csv.reader(f, delimiter=delimiter):
+            if row:
+                yield tuple([parse_value(value) for value in row])
+
+
+def _read_json_lines(path):
+    with io.open(path, 'r') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise exception.PolicyException(
+                    "%s:%d: %s" % (path, number, e))
+            if not isinstance(row, list):
+                raise exception.PolicyException(
+                    "%s:%d: expected an array of values" % (path, number))
+            yield tuple([value if isinstance(value, six.string_types)
+                         else utils.value_to_congress(value)
+                         for value in row])
@@ -24,6 +24,7 @@ from pylagolog.congress.datalog import base
 from pylagolog.congress.datalog import compile
 from pylagolog.congress.datalog import database
 from pylagolog.congress.datalog import topdown
+from pylagolog.congress.datalog import unify
 from pylagolog.congress.datalog import utility
 
 
@@ -41,6 +42,9 @@ class DeltaRule(object):
             sorted([lit for lit in body if not lit.is_builtin()]) +
             sorted([lit for lit in body if lit.is_builtin()]))
         self.original = original  # Rule from which SELF was derived
+        # numbering of the variables, for unify.Frame
+        self.slots = compile.variable_slots(
+            [self.trigger, self.head] + self.body)
 
     def __str__(self):
         return "<trigger: {}, head: {}, body: {}>".format(
@@ -102,8 +106,9 @@ class DeltaRuleTheory (base.Theory):
         Return list of changes (either the empty list or
         a list including just RULE).
         """
-        self.log(None, "DeltaRuleTheory.modify %s", event.formula)
-        self.log(None, "originals: %s", utility.iterstr(self.originals))
+        if self.tracer.enabled:
+            self.log(None, "DeltaRuleTheory.modify %s", event.formula)
+            self.log(None, "originals: %s", utility.iterstr(self.originals))
         if event.insert:
             if self.insert(event.formula):
                 return [event]
@@ -119,11 +124,14 @@ class DeltaRuleTheory (base.Theory):
         """
         assert compile.is_regular_rule(rule), (
             "DeltaRuleTheory only takes rules")
-        self.log(rule.tablename(), "Insert: %s", rule)
+        if self.tracer.enabled:
+            self.log(rule.tablename(), "Insert: %s", rule)
         if rule in self.originals:
-            self.log(None, utility.iterstr(self.originals))
+            if self.tracer.enabled:
+                self.log(None, utility.iterstr(self.originals))
             return False
-        self.log(rule.tablename(), "Insert 2: %s", rule)
+        if self.tracer.enabled:
+            self.log(rule.tablename(), "Insert 2: %s", rule)
         for delta in self.compute_delta_rules([rule]):
             self.insert_delta(delta)
         self.originals.add(rule)
@@ -131,7 +139,8 @@ class DeltaRuleTheory (base.Theory):
 
     def insert_delta(self, delta):
         """Insert a delta rule."""
-        self.log(None, "Inserting delta rule %s", delta)
+        if self.tracer.enabled:
+            self.log(None, "Inserting delta rule %s", delta)
         # views (tables occurring in head)
         if delta.head.table.table in self.views:
             self.views[delta.head.table.table] += 1
@@ -156,7 +165,8 @@ class DeltaRuleTheory (base.Theory):
         Assumes that COMPUTE_DELTA_RULES is deterministic.
         Returns True iff the theory changed.
         """
-        self.log(rule.tablename(), "Delete: %s", rule)
+        if self.tracer.enabled:
+            self.log(rule.tablename(), "Delete: %s", rule)
         if rule not in self.originals:
             return False
         for delta in self.compute_delta_rules([rule]):
@@ -310,6 +320,12 @@ class MaterializedViewTheory(topdown.TopDownTheory):
     Relies on included theories to define the contents of those
     tables not defined by the rules of the theory.
     Recursive rules are allowed.
+
+    By default every derived row keeps the proofs, i.e. the rule and
+    binding, of each of its derivations.  With set_counting, a derived
+    row keeps just the number of its derivations instead, and rows of
+    recursive tables are maintained by deleting and rederiving them
+    (DRed), since their derivations may support each other.
     """
 
     def __init__(self, name=None, abbr=None, theories=None, schema=None,
@@ -334,6 +350,14 @@ class MaterializedViewTheory(topdown.TopDownTheory):
         # rules that dictate how database changes in response to events
         self.delta_rules = DeltaRuleTheory(name=delta_name, abbr=delta_abbr)
         self.kind = base.MATERIALIZED_POLICY_TYPE
+        # whether derived rows keep counts instead of proofs
+        self.counting = False
+        # tables defined in terms of themselves; None when out of date
+        self._recursive = None
+        # rows of recursive tables deleted since they were last rederived
+        self._overdeleted = set()
+        # tables that were recursive before the rules last changed
+        self._was_recursive = set()
 
     def set_tracer(self, tracer):
         if isinstance(tracer, base.Tracer):
@@ -350,6 +374,37 @@ class MaterializedViewTheory(topdown.TopDownTheory):
                 'database': self.database.tracer,
                 'delta_rules': self.delta_rules.tracer}
 
+    def set_profiler(self, profiler):
+        self.profiler = profiler
+        self.database.set_profiler(profiler)
+        self.delta_rules.set_profiler(profiler)
+
+    def set_counting(self, enabled=True):
+        """Keep the number of derivations of derived rows or their proofs.
+
+        With ENABLED, inserting and deleting a derivation of a row only
+        changes its count, which is far cheaper than comparing proofs
+        when rows have many derivations; rows of recursive tables are
+        deleted and rederived instead.  Explanations are then recomputed
+        on demand.  The rows already derived are recomputed.
+        """
+        if enabled == self.counting:
+            return
+        rules = list(self.delta_rules.originals)
+        facts = [atom for atom in self.database.content()
+                 if not len(self.database.explain(atom))]
+        tracer = self.get_tracer()
+        self.database = database.Database(
+            name=self.database.name, abbr=self.database.abbr)
+        self.delta_rules = DeltaRuleTheory(
+            name=self.delta_rules.name, abbr=self.delta_rules.abbr)
+        self.set_tracer(tracer)
+        self.set_profiler(self.profiler)
+        self._recursive = None
+        self.counting = enabled
+        self.update([compile.Event(formula=formula, insert=True)
+                     for formula in facts + rules])
+
     # External Interface
 
     # SELECT is handled by TopDownTheory
@@ -370,6 +425,8 @@ class MaterializedViewTheory(topdown.TopDownTheory):
                 "Non-formula not allowed: {}".format(str(event.formula)))
             self.enqueue_any(event)
         changes = self.process_queue()
+        if changes:
+            self.clear_answer_tables()
         return changes
 
     def update_would_cause_errors(self, events):
@@ -384,7 +441,8 @@ class MaterializedViewTheory(topdown.TopDownTheory):
         for event in events:
             assert compile.is_datalog(event.formula), (
                 "update_would_cause_errors operates only on objects")
-            self.log(None, "Updating %s", event.formula)
+            if self.tracer.enabled:
+                self.log(None, "Updating %s", event.formula)
             if event.formula.is_atom():
                 errors.extend(compile.fact_errors(
                     event.formula, self.theories, self.name))
@@ -415,12 +473,15 @@ class MaterializedViewTheory(topdown.TopDownTheory):
 
     # Interface implementation
 
-    def explain_aux(self, query, depth):
-        self.log(query.table.table, "Explaining %s", query, depth=depth)
+    def explain_aux(self, query, depth, path=frozenset()):
+        if self.tracer.enabled:
+            self.log(query.table.table, "Explaining %s", query, depth=depth)
         # Bail out on negated literals.  Need different
         #   algorithm b/c we need to introduce quantifiers.
         if query.is_negated():
             return base.Proof(query, [])
+        if self.counting:
+            return self._explain_counted(query, depth, path)
         # grab first local proof, since they're all equally good
         localproofs = self.database.explain(query)
         if localproofs is None:
@@ -437,16 +498,67 @@ class MaterializedViewTheory(topdown.TopDownTheory):
             subproofs.append(subproof)
         return base.Proof(query, subproofs)
 
+    def _explain_counted(self, query, depth, path):
+        """Explain QUERY by recomputing the derivations of its row.
+
+        PATH is the set of the rows being explained by the callers; a
+        derivation using any of them is skipped, as it would explain a
+        row of a recursive table in terms of itself.
+        """
+        if not self.is_view(query.table.table):
+            if self.database.explain(query) is None:
+                return None
+            return base.Proof(query, [])
+        if query not in self.database:
+            return None
+        path = path | set([query])
+        for rule_instance in self._derivations(query):
+            if any(lit in path for lit in rule_instance.body):
+                continue
+            subproofs = []
+            for lit in rule_instance.body:
+                subproof = self.explain_aux(lit, depth + 1, path)
+                if subproof is None:
+                    break
+                subproofs.append(subproof)
+            else:
+                return base.Proof(query, subproofs)
+        return None
+
+    def _derivations(self, atom, find_all=True):
+        """Return the instances of the rules that derive the ground ATOM.
+
+        Their bodies are evaluated against the rows currently stored.
+        If FIND_ALL is False, returns at most one instance.
+        """
+        instances = utility.OrderedSet()
+        for rule in self.delta_rules.originals:
+            if rule.head.table.table != atom.table.table:
+                continue
+            binding = self.new_bi_unifier(slots=rule.variable_slots())
+            if unify.match_atoms(rule.head, binding, atom) is None:
+                continue
+            for answer in self.top_down_evaluation(
+                    rule.variables(), rule.body, binding, find_all=find_all):
+                instances.add(rule.plug(answer))
+                if not find_all:
+                    return list(instances)
+        return list(instances)
+
     def modify(self, event):
         """Modifies contents of theory to insert/delete FORMULA.
 
         Returns True iff the theory changed.
         """
-        self.log(None, "Materialized.modify")
+        if self.tracer.enabled:
+            self.log(None, "Materialized.modify")
         self.enqueue_any(event)
         changes = self.process_queue()
-        self.log(event.formula.tablename(),
-                 "modify returns %s", utility.iterstr(changes))
+        if changes:
+            self.clear_answer_tables()
+        if self.tracer.enabled:
+            self.log(event.formula.tablename(),
+                     "modify returns %s", utility.iterstr(changes))
         return changes
 
     def enqueue_any(self, event):
@@ -462,7 +574,8 @@ class MaterializedViewTheory(topdown.TopDownTheory):
         # Note: all included theories must define MODIFY
         formula = event.formula
         if formula.is_atom():
-            self.log(formula.tablename(), "compute/enq: atom %s", formula)
+            if self.tracer.enabled:
+                self.log(formula.tablename(), "compute/enq: atom %s", formula)
             assert not self.is_view(formula.table.table), (
                 "Cannot directly modify tables" +
                 " computed from other tables")
@@ -481,7 +594,8 @@ class MaterializedViewTheory(topdown.TopDownTheory):
             return []
 
     def enqueue(self, event):
-        self.log(event.tablename(), "Enqueueing: %s", event)
+        if self.tracer.enabled:
+            self.log(event.tablename(), "Enqueueing: %s", event)
         self.queue.enqueue(event)
 
     def process_queue(self):
@@ -489,39 +603,141 @@ class MaterializedViewTheory(topdown.TopDownTheory):
 
         Returns list of events that were not noops
         """
-        self.log(None, "Processing queue")
+        if self.tracer.enabled:
+            self.log(None, "Processing queue")
         history = []
         while len(self.queue) > 0:
             event = self.queue.dequeue()
-            self.log(event.tablename(), "Dequeued %s", event)
+            if self.tracer.enabled:
+                self.log(event.tablename(), "Dequeued %s", event)
             if compile.is_regular_rule(event.formula):
                 changes = self.delta_rules.modify(event)
                 if len(changes) > 0:
+                    if self._recursive is not None:
+                        self._was_recursive |= self._recursive
+                        self._recursive = None
                     history.extend(changes)
                     bindings = self.top_down_evaluation(
                         event.formula.variables(), event.formula.body)
-                    self.log(event.formula.tablename(),
-                             "new bindings after top-down: %s",
-                             utility.iterstr(bindings))
+                    if self.tracer.enabled:
+                        self.log(event.formula.tablename(),
+                                 "new bindings after top-down: %s",
+                                 utility.iterstr(bindings))
                     self.process_new_bindings(bindings, event.formula.head,
                                               event.insert, event.formula)
+            elif self.counting:
+                history.extend(self.apply_counted(event))
             else:
                 self.propagate(event)
                 history.extend(self.database.modify(event))
-            self.log(event.tablename(), "History: %s",
-                     utility.iterstr(history))
+            if self.tracer.enabled:
+                self.log(event.tablename(), "History: %s",
+                         utility.iterstr(history))
+            if not len(self.queue):
+                if self._overdeleted:
+                    self.rederive()
+                elif self._was_recursive:
+                    self.recount()
         return history
 
+    def apply_counted(self, event):
+        """Apply the atom EVENT to the database, counting derivations.
+
+        The event is propagated only if it inserts a row that was not
+        stored or deletes the last derivation of a row; otherwise it
+        just changes the count of the row.  A delete of a row of a
+        recursive table deletes the row whatever its count (see
+        rederive).  Returns the list of changes.
+        """
+        atom = event.formula
+        table = atom.table.table
+        if not isinstance(event.proofs, database.Database.ProofCount):
+            if self.database.is_noop(event):
+                return []
+            self.propagate(event)
+            return self.database.modify(event)
+        proofs = self.database.explain(atom)
+        if isinstance(proofs, database.Database.ProofCount):
+            count = len(proofs)
+        elif atom in self.database:
+            # a fact inserted before the rules defining its table
+            return []
+        else:
+            count = 0
+        recursive = (table in self.recursive_tables() or
+                     table in self._was_recursive)
+        if event.insert:
+            if count:
+                if not recursive:
+                    self.database.insert_actual(atom, proofs=event.proofs)
+                return []
+            self.propagate(event)
+            if recursive:
+                proofs = database.Database.ProofCount()
+            else:
+                proofs = event.proofs
+            self.database.insert_actual(atom, proofs=proofs)
+        else:
+            if not count:
+                return []
+            if recursive:
+                self._overdeleted.add(atom)
+            elif count > len(event.proofs):
+                self.database.delete_actual(atom, proofs=event.proofs)
+                return []
+            self.propagate(event)
+            self.database.delete_actual(atom, proofs=proofs)
+        self.database.clear_answer_tables()
+        return [event]
+
+    def rederive(self):
+        """Enqueue the deleted rows of recursive tables still derivable.
+
+        Deleting a row of a recursive table deletes every row derived
+        from it, even those with other derivations.  Once those deletes
+        are done, the rows that can be derived from the remaining ones
+        are inserted again, and the rows derived from them in turn.
+        """
+        atoms, self._overdeleted = self._overdeleted, set()
+        for atom in atoms:
+            if atom not in self.database and self._derivations(atom, False):
+                self.enqueue(compile.Event(
+                    formula=atom, proofs=database.Database.ProofCount(),
+                    insert=True))
+
+    def recount(self):
+        """Count the derivations of the rows of formerly recursive tables.
+
+        The rows of recursive tables are counted once, whatever their
+        derivations, so they are counted again when the rules no longer
+        define their tables in terms of themselves.
+        """
+        tables = self._was_recursive - self.recursive_tables()
+        self._was_recursive = set()
+        for atom in self.database.content(tables):
+            self.database.explain(atom).count = len(self._derivations(atom))
+
+    def recursive_tables(self):
+        """Return the set of the tables defined in terms of themselves."""
+        if self._recursive is None:
+            graph = compile.RuleDependencyGraph(self.delta_rules.originals)
+            self._recursive = set(
+                node for nodes in graph.recursive_components()
+                for node in nodes)
+        return self._recursive
+
     def propagate(self, event):
         """Propagate event.
 
         Computes and enqueue events generated by EVENT and the DELTA_RULES.
         """
-        self.log(event.formula.table.table, "Processing event: %s", event)
+        if self.tracer.enabled:
+            self.log(event.formula.table.table, "Processing event: %s", event)
         applicable_rules = self.delta_rules.rules_with_trigger(
             event.formula.table.table)
         if len(applicable_rules) == 0:
-            self.log(event.formula.table.table, "No applicable delta rule")
+            if self.tracer.enabled:
+                self.log(event.formula.table.table, "No applicable delta rule")
         for delta_rule in applicable_rules:
             self.propagate_rule(event, delta_rule)
 
@@ -530,8 +746,9 @@ class MaterializedViewTheory(topdown.TopDownTheory):
 
         Compute and enqueue new events generated by EVENT and DELTA_RULE.
         """
-        self.log(event.formula.table.table, "Processing event %s with rule %s",
-                 event, delta_rule)
+        if self.tracer.enabled:
+            self.log(event.formula.table.table,
+                     "Processing event %s with rule %s", event, delta_rule)
 
         # compute tuples generated by event (either for insert or delete)
         # print "event: {}, event.tuple: {},
@@ -539,21 +756,31 @@ class MaterializedViewTheory(topdown.TopDownTheory):
         #     str(event), str(event.tuple), str(event.tuple.raw_tuple()))
         # binding_list is dictionary
 
-        # Save binding for delta_rule.trigger; throw away binding for event
-        #   since event is ground.
-        binding = self.new_bi_unifier()
+        # Save binding for delta_rule.trigger; event is ground, so it
+        #   needs no binding of its own.
+        binding = self.new_bi_unifier(slots=delta_rule.slots)
         assert compile.is_literal(delta_rule.trigger)
         assert compile.is_literal(event.formula)
-        undo = self.bi_unify(delta_rule.trigger, binding,
-                             event.formula, self.new_bi_unifier(), self.name)
-        if undo is None:
+        if unify.match_atoms(delta_rule.trigger, binding,
+                             event.formula) is None:
             return
-        self.log(event.formula.table.table,
-                 "binding list for event and delta-rule trigger: %s", binding)
+        if self.tracer.enabled:
+            self.log(event.formula.table.table,
+                     "binding list for event and delta-rule trigger: %s",
+                     binding)
+        profiler = self.profiler
+        if profiler is not None:
+            counts = profiler.rule(self.name, delta_rule.original)
+            counts['delta_firings'] += 1
+            start = profiler.start()
         bindings = self.top_down_evaluation(
             delta_rule.variables(), delta_rule.body, binding)
-        self.log(event.formula.table.table, "new bindings after top-down: %s",
-                 ",".join([str(x) for x in bindings]))
+        if profiler is not None:
+            profiler.stop(counts, start)
+        if self.tracer.enabled:
+            self.log(event.formula.table.table,
+                     "new bindings after top-down: %s",
+                     ",".join([str(x) for x in bindings]))
 
         if delta_rule.trigger.is_negated():
             insert_delete = not event.insert
@@ -568,6 +795,9 @@ class MaterializedViewTheory(topdown.TopDownTheory):
         For each of BINDINGS, apply to ATOM, and enqueue it as an insert if
         INSERT is True and as a delete otherwise.
         """
+        if self.counting:
+            self.process_new_counts(bindings, atom, insert)
+            return
         # for each binding, compute generated tuple and group bindings
         #    by the tuple they generated
         new_atoms = {}
@@ -577,8 +807,9 @@ class MaterializedViewTheory(topdown.TopDownTheory):
                 new_atoms[new_atom] = []
             new_atoms[new_atom].append(database.Database.Proof(
                 binding, original_rule))
-        self.log(atom.table.table, "new tuples generated: %s",
-                 utility.iterstr(new_atoms))
+        if self.tracer.enabled:
+            self.log(atom.table.table, "new tuples generated: %s",
+                     utility.iterstr(new_atoms))
 
         # enqueue each distinct generated tuple, recording appropriate bindings
         for new_atom in new_atoms:
@@ -590,6 +821,25 @@ class MaterializedViewTheory(topdown.TopDownTheory):
                          proofs=new_atoms[new_atom],
                          insert=insert))
 
+    def process_new_counts(self, bindings, atom, insert):
+        """Process new bindings, counting derivations.
+
+        For each of the distinct BINDINGS, apply to ATOM, and enqueue
+        each atom generated as an insert if INSERT is True and as a
+        delete otherwise, with the number of bindings generating it.
+        """
+        counts = {}
+        for binding in set(frozenset(b.items()) for b in bindings):
+            new_atom = atom.plug(dict(binding))
+            counts[new_atom] = counts.get(new_atom, 0) + 1
+        if self.tracer.enabled:
+            self.log(atom.table.table, "new tuples generated: %s",
+                     utility.iterstr(counts))
+        for new_atom, count in counts.items():
+            self.enqueue(compile.Event(
+                formula=new_atom, proofs=database.Database.ProofCount(count),
+                insert=insert))
+
     def is_view(self, x):
         """Return True if the table X is defined by the theory."""
         return self.delta_rules.is_view(x)
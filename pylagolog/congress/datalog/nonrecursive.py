@@ -17,13 +17,19 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
 
+import copy
+import itertools
+
 from oslo_log import log as logging
 
 from pylagolog.congress.datalog import base
 from pylagolog.congress.datalog import compile
+from pylagolog.congress.datalog import factset
+from pylagolog.congress.datalog import joinplan
 from pylagolog.congress.datalog import ruleset
 from pylagolog.congress.datalog import topdown
 from pylagolog.congress.datalog import utility
+from pylagolog.congress.datalog import vectorized
 from pylagolog.congress import exception
 
 
@@ -32,12 +38,17 @@ LOG = logging.getLogger(__name__)
 
 class RuleHandlingMixin(object):
 
+    # number of facts initialize_tables takes from its iterable at a time
+    INITIALIZE_CHUNK_SIZE = 10000
+
     # External Interface
 
     def initialize_tables(self, tablenames, facts):
         """Event handler for (re)initializing a collection of tables
 
-        @facts must be an iterable containing compile.Fact objects.
+        @facts must be an iterable containing compile.Fact objects.  It
+        is consumed in chunks, so a generator of facts is never held in
+        memory all at once.
         """
         LOG.info("initialize_tables")
         cleared_tables = set(tablenames)
@@ -47,21 +58,31 @@ class RuleHandlingMixin(object):
         count = 0
         extra_tables = set()
         ignored_facts = 0
-        for f in facts:
-            if f.table not in cleared_tables:
-                extra_tables.add(f.table)
-                ignored_facts += 1
-            else:
-                self.rules.add_rule(f.table, f)
-                count += 1
+        facts = iter(facts)
+        while True:
+            chunk = list(itertools.islice(facts, self.INITIALIZE_CHUNK_SIZE))
+            if not chunk:
+                break
+            by_table = {}
+            for f in chunk:
+                if f.table not in cleared_tables:
+                    extra_tables.add(f.table)
+                    ignored_facts += 1
+                else:
+                    by_table.setdefault(f.table, []).append(f)
+            for table, table_facts in by_table.items():
+                self.rules.add_facts(table, table_facts)
+                count += len(table_facts)
                 if self.schema:
-                    self.schema.update(f, True)
+                    for f in table_facts:
+                        self.schema.update(f, True)
         if ignored_facts > 0:
             LOG.error("initialize_tables ignored %d facts for tables "
                       "%s not included in the list of tablenames %s",
                       ignored_facts, extra_tables, cleared_tables)
         LOG.info("initialized %d tables with %d facts",
                  len(cleared_tables), count)
+        self.clear_answer_tables()
 
     def insert(self, rule):
         changes = self.update([compile.Event(formula=rule, insert=True)])
@@ -213,6 +234,7 @@ class RuleHandlingMixin(object):
     def _insert_actual(self, rule):
         """Insert RULE and return True if there was a change."""
         self.dirty = True
+        self.clear_answer_tables()
         if compile.is_atom(rule):
             rule = compile.Rule(rule, [], rule.location)
         self.log(rule.head.table.table, "Insert: %s", repr(rule))
@@ -221,6 +243,7 @@ class RuleHandlingMixin(object):
     def _delete_actual(self, rule):
         """Delete RULE and return True if there was a change."""
         self.dirty = True
+        self.clear_answer_tables()
         if compile.is_atom(rule):
             rule = compile.Rule(rule, [], rule.location)
         self.log(rule.head.table.table, "Delete: %s", rule)
@@ -252,6 +275,10 @@ class NonrecursiveRuleTheory(RuleHandlingMixin, topdown.TopDownTheory):
         # Indicates that a rule was added/removed
         # Used by the compiler to know if a theory should be recompiled.
         self.dirty = False
+        # dictionary from (rule, bound head arguments) to JoinPlan
+        self.join_plans = {}
+        # whether join plans run a column at a time (see set_vectorized)
+        self.vectorized = False
 
     # SELECT implemented by TopDownTheory
 
@@ -263,9 +290,82 @@ class NonrecursiveRuleTheory(RuleHandlingMixin, topdown.TopDownTheory):
         of the stack.
         """
         if table in self.rules:
-            return self.rules.get_rules(table, match_literal)
+            return self.rules.get_rules(table, match_literal,
+                                        self.table_counts(table))
         return []
 
+    def rules_defining(self, table):
+        return list(self.rules.rules.get(table, ()))
+
+    def overlay(self, theories):
+        th = copy.copy(self)
+        th.rules = ruleset.OverlayRuleSet(self.rules)
+        # update_rule_schema changes the schema of the copy in place
+        if self.schema is not None:
+            th.schema = self.schema.copy()
+        th.theories = theories
+        th.includes = list(self.includes)
+        th.join_plans = dict(self.join_plans)
+        th.answer_tables = {}
+        return th
+
+    def set_columnar(self, enabled=True):
+        """Store the facts of this theory column by column or not.
+
+        With ENABLED, facts are kept in ColumnarFactSets, which take a
+        fraction of the memory of FactSets for large tables, but build
+        the facts they return on demand.
+        """
+        if enabled:
+            self.rules.set_factset_class(factset.ColumnarFactSet)
+        else:
+            self.rules.set_factset_class(factset.FactSet)
+
+    def set_vectorized(self, enabled=True):
+        """Run the join plans of rules a column at a time or not.
+
+        With ENABLED, rules over facts only, evaluated with none of their
+        head arguments bound, join and filter all their answers at once
+        with NumPy.  Enabling it also stores the facts column by column
+        (see set_columnar).  Rules the vectorized evaluation cannot
+        handle run a tuple at a time as before.
+        """
+        if enabled and not vectorized.NUMPY_AVAILABLE:
+            raise exception.PolicyException(
+                "NumPy not available. Please install it")
+        if enabled:
+            self.set_columnar()
+        self.vectorized = enabled
+
+    def join_plan(self, rule, bound):
+        key = (rule, bound)
+        plan = self.join_plans.get(key)
+        if plan is None or plan.drifted(self.estimate_literal):
+            plan = joinplan.compile_plan(rule, bound, self.name,
+                                         self.estimate_literal)
+            self.join_plans[key] = plan
+        return plan
+
+    def evaluate_join_plan(self, plan, values):
+        if plan.steps is None or not plan.usable(self.rules):
+            return None
+        counts = None
+        if self.profiler is not None:
+            counts = self.table_counts
+        if self.vectorized and not plan.inputs:
+            results = vectorized.execute(plan, self.rules.facts, values,
+                                         counts)
+            if results is not None:
+                return results
+        return plan.execute(self.rules.facts, values, counts)
+
+    def estimate_rows(self, table, columns):
+        if self.rules.rules.get(table):
+            return None
+        if table not in self.rules.facts:
+            return 0
+        return self.rules.facts[table].estimate(columns)
+
     def arity(self, table, modal=None):
         """Return the number of arguments TABLENAME takes.
 
@@ -320,6 +420,20 @@ class NonrecursiveRuleTheory(RuleHandlingMixin, topdown.TopDownTheory):
         """
         return formula.body
 
+    def empty(self, tablenames=None, invert=False):
+        super(NonrecursiveRuleTheory, self).empty(tablenames=tablenames,
+                                                  invert=invert)
+        self.join_plans = {}
+
+    # Internal Interface
+
+    def _delete_actual(self, rule):
+        changed = super(NonrecursiveRuleTheory, self)._delete_actual(rule)
+        if changed and not compile.is_atom(rule) and len(rule.body) > 0:
+            # forget the plans of rules no longer in the theory
+            self.join_plans = {}
+        return changed
+
 
 class ActionTheory(NonrecursiveRuleTheory):
     """ActionTheory object.
@@ -34,9 +34,18 @@ class RuleSet(object):
     #
     #  An index_key looks like this: (p, (2, 'abc'), (4, 'def'))
 
-    def __init__(self):
+    def __init__(self, factset_class=factset.FactSet):
         self.rules = {}
         self.facts = {}
+        # class of the FactSets holding the facts of each table
+        self.factset_class = factset_class
+
+    def set_factset_class(self, factset_class):
+        """Store the facts of every table in FACTSET_CLASS FactSets."""
+        self.factset_class = factset_class
+        for key, facts in self.facts.items():
+            if not isinstance(facts, factset_class):
+                self.facts[key] = factset_class(facts)
 
     def __str__(self):
         return str(self.rules) + " " + str(self.facts)
@@ -48,17 +57,20 @@ class RuleSet(object):
         RuleSet.
         """
         if isinstance(rule, compile.Fact):
-            # If the rule is a Fact, then add it to self.facts.
+            # If the rule is a Fact, then add it to self.facts.  Facts
+            # from datasources carry their own copies of the strings, so
+            # store them interned.
             if key not in self.facts:
-                self.facts[key] = factset.FactSet()
-            return self.facts[key].add(rule)
+                self.facts[key] = self.factset_class()
+            return self.facts[key].add(
+                compile.Fact(rule.table, compile.intern_row(rule)))
 
         elif len(rule.body) == 0 and not rule.head.is_negated():
             # If the rule is a Rule, with no body, then it's a Fact, so
             # convert the Rule to a Fact to a Fact and add to self.facts.
             f = compile.Fact(key, (a.name for a in rule.head.arguments))
             if key not in self.facts:
-                self.facts[key] = factset.FactSet()
+                self.facts[key] = self.factset_class()
             return self.facts[key].add(f)
 
         else:
@@ -69,6 +81,22 @@ class RuleSet(object):
                 self.rules[key] = utility.OrderedSet([rule])
                 return True
 
+    def add_facts(self, key, facts):
+        """Add the Facts FACTS to table KEY
+
+        Same as add_rule on each of FACTS, for loading many facts at once.
+        Returns the number of facts absent from the RuleSet and added.
+        """
+        if key not in self.facts:
+            self.facts[key] = self.factset_class()
+        add = self.facts[key].add
+        intern_row = compile.intern_row
+        count = 0
+        for fact in facts:
+            if add(compile.Fact(key, intern_row(fact))):
+                count += 1
+        return count
+
     def discard_rule(self, key, rule):
         """Remove a rule from the Ruleset
 
@@ -125,9 +153,12 @@ class RuleSet(object):
         else:
             return key in self.rules and rule in self.rules[key]
 
-    def get_rules(self, key, match_literal=None):
-        facts = []
+    def get_facts(self, key, match_literal=None, counts=None):
+        """Return the native facts for KEY that may match MATCH_LITERAL.
 
+        COUNTS is None or a collections.Counter the lookup is counted in,
+        as by FactSet.find.
+        """
         if (match_literal and not match_literal.is_negated() and
                 key in self.facts):
             # If the caller supplies a literal to match against, then use an
@@ -144,14 +175,22 @@ class RuleSet(object):
                 [(i, arg.name)
                  for i, arg in enumerate(match_literal.arguments)
                  if not arg.is_variable()])
-            facts = list(self.facts[key].find(partial_fact))
-        else:
-            # There is no usable match_literal, so get all facts for the
-            # table.
-            facts = list(self.facts.get(key, ()))
+            return list(self.facts[key].find(partial_fact, counts=counts))
+        # There is no usable match_literal, so get all facts for the
+        # table.
+        facts = list(self.facts.get(key, ()))
+        if counts is not None and facts:
+            counts['facts_scanned'] += len(facts)
+            counts['facts_returned'] += len(facts)
+        return facts
 
-        # Convert native tuples to Rule objects.
+    def get_rules(self, key, match_literal=None, counts=None):
+        facts = self.get_facts(key, match_literal, counts)
+        return self.facts_to_rules(key, facts) + list(self.rules.get(key, ()))
 
+    @staticmethod
+    def facts_to_rules(key, facts):
+        """Convert native FACTS for table KEY to Rule objects."""
         # TODO(alex): This is inefficient because it creates Literal and Rule
         # objects.  It would be more efficient to change the TopDownTheory and
         # unifier to handle Facts natively.
@@ -164,8 +203,7 @@ class RuleSet(object):
                 key, [compile.Term.create_from_python(x) for x in fact],
                 use_modules=False)
             fact_rules.append(compile.Rule(literal, ()))
-
-        return fact_rules + list(self.rules.get(key, ()))
+        return fact_rules
 
     def clear(self):
         self.rules = {}
@@ -173,4 +211,51 @@ class RuleSet(object):
 
     def clear_table(self, table):
         self.rules[table] = utility.OrderedSet()
-        self.facts[table] = factset.FactSet()
+        self.facts[table] = self.factset_class()
+
+
+class OverlayRuleSet(RuleSet):
+    """OverlayRuleSet
+
+    A RuleSet whose changes leave the RuleSet BASE it starts from
+    untouched.  The tables of BASE are shared until first changed: the
+    rules of a table are then copied, and the changes to its facts kept
+    in an OverlayFactSet.
+    """
+
+    def __init__(self, base):
+        super(OverlayRuleSet, self).__init__(base.factset_class)
+        self.base = base
+        self.rules = dict(base.rules)
+        self.facts = dict(base.facts)
+        # tables whose rules and facts belong to this RuleSet
+        self._owned = set()
+
+    def set_factset_class(self, factset_class):
+        # the facts of BASE stay as they are
+        self.factset_class = factset_class
+
+    def add_rule(self, key, rule):
+        self._own(key)
+        return super(OverlayRuleSet, self).add_rule(key, rule)
+
+    def add_facts(self, key, facts):
+        self._own(key)
+        return super(OverlayRuleSet, self).add_facts(key, facts)
+
+    def discard_rule(self, key, rule):
+        self._own(key)
+        return super(OverlayRuleSet, self).discard_rule(key, rule)
+
+    def clear_table(self, table):
+        self._owned.add(table)
+        super(OverlayRuleSet, self).clear_table(table)
+
+    def _own(self, key):
+        if key in self._owned:
+            return
+        self._owned.add(key)
+        if key in self.rules:
+            self.rules[key] = utility.OrderedSet(self.rules[key])
+        if key in self.facts:
+            self.facts[key] = factset.OverlayFactSet(self.facts[key])
@@ -0,0 +1,222 @@
+# Copyright (c) 2019 Nippon Telegraph and Telephone Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Binary snapshots of the state of a runtime.
+
+A snapshot file starts with a fixed prelude: the MAGIC bytes, the
+format VERSION, and the offset and length of the header.  The header, a
+JSON object written last, describes the policies and refers to the
+columns of their fact tables, which are stored as blocks aligned on 8
+bytes.  Columns of ints and floats are little-endian arrays of int64 or
+doubles that are read straight from a memory map of the file; other
+columns are JSON arrays.  What the header holds besides the tables is up
+to the writer (see agnostic.Runtime.save_snapshot).
+"""
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+from pylagolog.congress.datalog import compile
+from pylagolog.congress.datalog import factset
+from pylagolog.congress import exception
+
+
+MAGIC = b'LAGOSNAP'
+# incremented whenever snapshots of the previous version cannot be read
+VERSION = 1
+
+# magic, version, header offset and header length
+_PRELUDE = struct.Struct('<8sIQQ')
+_ALIGNMENT = 8
+
+
+class SnapshotWriter(object):
+    """Write a snapshot to PATH.
+
+    The snapshot is written next to PATH and only replaces it once
+    closed, so an interrupted write leaves the previous snapshot intact.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._temp = path + '.tmp'
+        self._file = open(self._temp, 'wb')
+        self._file.write(_PRELUDE.pack(MAGIC, VERSION, 0, 0))
+
+    def add_column(self, values):
+        """Write the column VALUES and return its descriptor."""
+        kind = _column_kind(values)
+        if kind == 'values':
+            try:
+                data = json.dumps(list(values)).encode('utf-8')
+            except (TypeError, ValueError) as e:
+                raise exception.PolicyException(
+                    "Cannot write values to snapshot: %s" % e)
+        else:
+            data = array.array('q' if kind == 'int' else 'd', values)
+            if sys.byteorder != 'little':
+                data.byteswap()
+        offset, length = self._write(data)
+        return {'type': kind, 'offset': offset, 'length': length}
+
+    def close(self, header):
+        """Write HEADER and put the snapshot in place."""
+        data = json.dumps(header, sort_keys=True).encode('utf-8')
+        offset, length = self._write(data)
+        self._file.seek(0)
+        self._file.write(_PRELUDE.pack(MAGIC, VERSION, offset, length))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.rename(self._temp, self.path)
+
+    def abort(self):
+        """Discard the snapshot being written."""
+        self._file.close()
+        os.remove(self._temp)
+
+    def _write(self, data):
+        offset = self._file.tell()
+        if offset % _ALIGNMENT:
+            self._file.write(b'\0' * (_ALIGNMENT - offset % _ALIGNMENT))
+            offset = self._file.tell()
+        if isinstance(data, array.array):
+            data = data.tobytes()
+        self._file.write(data)
+        return offset, len(data)
+
+
+class SnapshotReader(object):
+    """Read the snapshot at PATH through a memory map."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._mmap) < _PRELUDE.size:
+                raise exception.PolicyException(
+                    "%s is not a snapshot" % path)
+            magic, version, offset, length = _PRELUDE.unpack_from(
+                self._mmap)
+            if magic != MAGIC:
+                raise exception.PolicyException(
+                    "%s is not a snapshot" % path)
+            if version != VERSION:
+                raise exception.PolicyException(
+                    "Snapshot %s has version %d; expected %d" %
+                    (path, version, VERSION))
+            self.header = json.loads(
+                self._mmap[offset:offset + length].decode('utf-8'))
+        except Exception:
+            self._mmap.close()
+            raise
+
+    def column(self, descriptor):
+        """Return the column of DESCRIPTOR as an array.array or list."""
+        offset = descriptor['offset']
+        end = offset + descriptor['length']
+        if descriptor['type'] == 'values':
+            return [compile.intern_value(value) for value in
+                    json.loads(self._mmap[offset:end].decode('utf-8'))]
+        column = array.array('q' if descriptor['type'] == 'int' else 'd')
+        with memoryview(self._mmap) as view:
+            with view[offset:end] as data:
+                column.frombytes(data)
+        if sys.byteorder != 'little':
+            column.byteswap()
+        return column
+
+    def close(self):
+        self._mmap.close()
+
+
+def write_tables(writer, rules):
+    """Write the facts of the RuleSet RULES with WRITER.
+
+    Returns the list of table descriptors for the header.  Facts of a
+    table are written as blocks of columns, one per width.
+    """
+    tables = []
+    for table in sorted(rules.facts):
+        facts = rules.facts[table]
+        blocks = []
+        for width, columns in _table_columns(facts):
+            blocks.append({
+                'width': width,
+                'rows': len(columns[0]) if columns else 1,
+                'columns': [writer.add_column(column)
+                            for column in columns]})
+        tables.append({'table': table, 'blocks': blocks,
+                       'indexes': sorted(facts.indexes())})
+    return tables
+
+
+def read_tables(reader, tables, rules):
+    """Add the facts of the table descriptors TABLES to the RuleSet RULES.
+
+    Tables of a columnar RuleSet are rebuilt straight from their columns.
+    """
+    columnar = rules.factset_class is factset.ColumnarFactSet
+    for entry in tables:
+        table = entry['table']
+        for block in entry['blocks']:
+            columns = [reader.column(descriptor)
+                       for descriptor in block['columns']]
+            if not columns:
+                rules.add_facts(table, [()])
+            elif columnar and table not in rules.facts:
+                rules.facts[table] = factset.ColumnarFactSet.from_columns(
+                    table, columns)
+            else:
+                rules.add_facts(table, zip(*columns))
+        if table in rules.facts:
+            for columns in entry['indexes']:
+                rules.facts[table].create_index(tuple(columns))
+
+
+def _table_columns(facts):
+    """Return pairs (width, columns) holding the facts FACTS."""
+    raw = getattr(facts, 'raw_columns', None)
+    if raw is not None and raw() is not None:
+        live, columns = raw()
+        if len(live) == len(facts):
+            return [(len(columns), columns)] if len(facts) else []
+    by_width = {}
+    for fact in facts:
+        if len(fact) not in by_width:
+            by_width[len(fact)] = [[] for value in fact]
+        for column, value in zip(by_width[len(fact)], fact):
+            column.append(value)
+    return sorted(by_width.items())
+
+
+def _column_kind(values):
+    if isinstance(values, array.array):
+        return 'float' if values.typecode == 'd' else 'int'
+    if all(type(value) is int for value in values):
+        if all(-(1 << 63) <= value < (1 << 63) for value in values):
+            return 'int'
+    elif all(type(value) is float for value in values):
+        return 'float'
+    return 'values'
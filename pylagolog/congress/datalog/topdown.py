@@ -24,6 +24,7 @@ from six.moves import range
 from pylagolog.congress.datalog import base
 from pylagolog.congress.datalog import builtin
 from pylagolog.congress.datalog import compile
+from pylagolog.congress.datalog import joinplan
 from pylagolog.congress.datalog import unify
 from pylagolog.congress.datalog import utility
 
@@ -71,7 +72,7 @@ class TopDownTheory(base.Theory):
         VARIABLES is the list of variables (from the initial query)
         that we want bindings for.
 
-        BINDING is the initially empty BiUnifier.
+        BINDING is the initially empty unify.Frame.
 
         FIND_ALL controls whether just the first or all answers are found.
 
@@ -83,7 +84,7 @@ class TopDownTheory(base.Theory):
                      find_all=True, save=None):
             # an iterable of variable objects
             self.variables = variables
-            # a bi-unifier
+            # a unify.Frame
             self.binding = binding
             # the top-level theory (for included theories)
             self.theory = theory
@@ -97,6 +98,10 @@ class TopDownTheory(base.Theory):
             self.save = save
             # A variable used to store explanations as they are constructed
             self.support = []
+            # Answer tables for tabled subgoals: dict from call variant to
+            #   the list of ground instances of that call.  Shared by
+            #   all the callers of a single query.
+            self.answers = {}
 
         def __str__(self):
             return (
@@ -115,6 +120,42 @@ class TopDownTheory(base.Theory):
             name=name, abbr=abbr, theories=theories, schema=schema,
             desc=desc, owner=owner)
         self.includes = []
+        # whether answers to subgoals are memoized (see set_tabling)
+        self.tabling = False
+        self.persistent_tabling = False
+        # answers kept across queries when persistent_tabling is set:
+        #   dict from call variant to the list of its ground instances
+        self.answer_tables = {}
+
+    def set_tabling(self, enabled=True, persistent=False):
+        """Turn memoization of subgoal answers on or off.
+
+        With ENABLED, each distinct call (up to variable renaming) of a
+        table is proven once per query and its answers are reused for
+        every repetition of that call.  With PERSISTENT, the answers are
+        also kept across queries until a change to one of the tables they
+        depend on is reported through tables_changed, or this theory is
+        modified.
+        """
+        self.tabling = enabled
+        self.persistent_tabling = enabled and persistent
+        self.clear_answer_tables()
+
+    def clear_answer_tables(self):
+        """Discard the answers kept across queries."""
+        if self.answer_tables:
+            self.answer_tables = {}
+
+    def has_cached_results(self):
+        return bool(self.answer_tables)
+
+    def tables_changed(self, tablenames):
+        if not self.answer_tables:
+            return
+        for key in list(self.answer_tables):
+            if (compile.Tablename.build_service_table(self.name, key[0]) in
+                    tablenames):
+                del self.answer_tables[key]
 
     def select(self, query, find_all=True):
         """Return list of instances of QUERY that are true.
@@ -131,7 +172,7 @@ class TopDownTheory(base.Theory):
         bindings = self.top_down_evaluation(query.variables(), literals,
                                             find_all=find_all)
         # LOG.debug("Top_down_evaluation returned: %s", bindings)
-        if len(bindings) > 0:
+        if len(bindings) > 0 and self.tracer.enabled:
             self.log(query.tablename(), "Found answer %s",
                      "[" + ",".join([str(query.plug(x))
                                     for x in bindings]) + "]")
@@ -182,8 +223,9 @@ class TopDownTheory(base.Theory):
             save=lambda lit, binding: lit.tablename() in tablenames)
         results = [compile.Rule(output.plug(abd.binding), abd.support)
                    for abd in abductions]
-        self.log(query.tablename(), "abduction result:")
-        self.log(query.tablename(), "\n".join([str(x) for x in results]))
+        if self.tracer.enabled:
+            self.log(query.tablename(), "abduction result:")
+            self.log(query.tablename(), "\n".join([str(x) for x in results]))
         return results
 
     def consequences(self, filter=None, table_theories=None):
@@ -249,7 +291,8 @@ class TopDownTheory(base.Theory):
         would not make sense.  Returns a list of TopDownResults.
         """
         if binding is None:
-            binding = self.new_bi_unifier()
+            binding = self.new_bi_unifier(
+                slots=compile.variable_slots(literals))
         caller = self.TopDownCaller(variables, binding, self,
                                     find_all=find_all, save=save)
         if len(literals) == 0:
@@ -278,17 +321,20 @@ class TopDownTheory(base.Theory):
 
         # abduction
         if caller.save is not None and caller.save(lit, context.binding):
-            self._print_call(lit, context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_call(lit, context.binding, context.depth)
             # save lit and binding--binding may not be fully flushed out
             #   when we save (or ever for that matter)
             caller.support.append((lit, context.binding))
-            self._print_save(lit, context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_save(lit, context.binding, context.depth)
             success = self._top_down_finish(context, caller)
             caller.support.pop()  # pop in either case
             if success:
                 return True
             else:
-                self._print_fail(lit, context.binding, context.depth)
+                if self.tracer.enabled:
+                    self._print_fail(lit, context.binding, context.depth)
                 return False
 
         # regular processing
@@ -299,29 +345,36 @@ class TopDownTheory(base.Theory):
             assert plugged.is_ground(), (
                 "Negated literal not ground when evaluated: " +
                 str(plugged))
-            self._print_call(lit, context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_call(lit, context.binding, context.depth)
+            if self.profiler is not None:
+                self.table_counts(lit.tablename())['negations'] += 1
             new_context = self.TopDownContext(
                 [lit.complement()], 0, context.binding, None,
                 self, context.depth + 1)
             new_caller = self.TopDownCaller(caller.variables, caller.binding,
                                             caller.theory, find_all=False,
                                             save=None)
+            new_caller.answers = caller.answers
             # Make sure new_caller has find_all=False, so we stop as soon
             #    as we can.
             # Ensure save=None so that abduction does not save anything.
             #    Saving while performing NAF makes no sense.
             self._top_down_eval(new_context, new_caller)
             if len(new_caller.results) > 0:
-                self._print_fail(lit, context.binding, context.depth)
+                if self.tracer.enabled:
+                    self._print_fail(lit, context.binding, context.depth)
                 return False   # not done searching, b/c we failed
             else:
                 # don't need bindings b/c LIT must be ground
                 return self._top_down_finish(context, caller, redo=False)
         elif lit.tablename() == 'true':
-            self._print_call(lit, context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_call(lit, context.binding, context.depth)
             return self._top_down_finish(context, caller, redo=False)
         elif lit.tablename() == 'false':
-            self._print_fail(lit, context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_fail(lit, context.binding, context.depth)
             return False
         elif lit.is_builtin():
             return self._top_down_builtin(context, caller)
@@ -331,6 +384,8 @@ class TopDownTheory(base.Theory):
               lit.table.service != self.name and
               not lit.is_update()):  # not a pseudo-modal
             return self._top_down_module(context, caller)
+        elif self.tabling and caller.save is None:
+            return self._top_down_tabled(context, caller)
         else:
             return self._top_down_truth(context, caller)
 
@@ -340,7 +395,8 @@ class TopDownTheory(base.Theory):
         Returns True if done searching and False otherwise.
         """
         lit = context.literals[context.literal_index]
-        self._print_call(lit, context.binding, context.depth)
+        if self.tracer.enabled:
+            self._print_call(lit, context.binding, context.depth)
         built = builtin.builtin_registry.builtin(lit.table)
         # copy arguments into variables
         # PLUGGED is an instance of compile.Literal
@@ -354,13 +410,15 @@ class TopDownTheory(base.Theory):
                 # save lit and binding--binding may not be fully flushed out
                 #   when we save (or ever for that matter)
                 caller.support.append((lit, context.binding))
-                self._print_save(lit, context.binding, context.depth)
+                if self.tracer.enabled:
+                    self._print_save(lit, context.binding, context.depth)
                 success = self._top_down_finish(context, caller)
                 caller.support.pop()  # pop in either case
                 if success:
                     return True
                 else:
-                    self._print_fail(lit, context.binding, context.depth)
+                    if self.tracer.enabled:
+                        self._print_fail(lit, context.binding, context.depth)
                     return False
             assert plugged.arguments[i].is_object(), (
                 ("Builtins must be evaluated only after their "
@@ -369,18 +427,21 @@ class TopDownTheory(base.Theory):
             args.append(plugged.arguments[i].name)
         # evaluate builtin: must return number, string, or iterable
         #    of numbers/strings
+        if self.profiler is not None:
+            self.table_counts(lit.tablename())['builtin_calls'] += 1
         try:
             result = built.code(*args)
         except Exception as e:
             errmsg = "Error in builtin: " + str(e)
-            self._print_note(lit, context.binding, context.depth, errmsg)
-            self._print_fail(lit, context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_note(lit, context.binding, context.depth, errmsg)
+                self._print_fail(lit, context.binding, context.depth)
             return False
 
         # self._print_note(lit, context.binding, context.depth,
         #                 "Result: " + str(result))
         success = None
-        undo = []
+        undo = None
         if built.num_outputs > 0:
             # with return values, local success means we can bind
             #  the results to the return value arguments
@@ -390,9 +451,8 @@ class TopDownTheory(base.Theory):
             # Turn result into normal objects
             result = [compile.Term.create_from_python(x) for x in result]
             # adjust binding list
-            unifier = self.new_bi_unifier()
             undo = unify.bi_unify_lists(result,
-                                        unifier,
+                                        context.binding,
                                         lit.arguments[built.num_inputs:],
                                         context.binding)
             success = undo is not None
@@ -402,18 +462,20 @@ class TopDownTheory(base.Theory):
             success = bool(result)
 
         if not success:
-            self._print_fail(lit, context.binding, context.depth)
-            unify.undo_all(undo)
+            if self.tracer.enabled:
+                self._print_fail(lit, context.binding, context.depth)
             return False
 
         # otherwise, try to finish proof.  If success, return True
-        if self._top_down_finish(context, caller, redo=False):
-            unify.undo_all(undo)
+        finished = self._top_down_finish(context, caller, redo=False)
+        if undo is not None:
+            context.binding.undo(undo)
+        if finished:
             return True
         # if fail, return False.
         else:
-            unify.undo_all(undo)
-            self._print_fail(lit, context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_fail(lit, context.binding, context.depth)
             return False
 
     def _top_down_module(self, context, caller):
@@ -421,13 +483,96 @@ class TopDownTheory(base.Theory):
         # LOG.debug("%s._top_down_module(%s)", self.name, context)
         lit = context.literals[context.literal_index]
         if lit.table.service not in self.theories:
-            self._print_call(lit, context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_call(lit, context.binding, context.depth)
             errmsg = "No such policy: %s" % lit.table.service
-            self._print_note(lit, context.binding, context.depth, errmsg)
-            self._print_fail(lit, context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_note(lit, context.binding, context.depth, errmsg)
+                self._print_fail(lit, context.binding, context.depth)
             return False
         return self.theories[lit.table.service]._top_down_eval(context, caller)
 
+    def _top_down_tabled(self, context, caller):
+        """Evaluate a literal using the answer table for its call.
+
+        The first time a call is seen, all its answers are computed and
+        stored; afterwards, those answers are used instead of proving the
+        literal again.
+        """
+        lit = context.literals[context.literal_index]
+        plugged = self._plug_apart(lit, context.binding)
+        key = self._call_variant(plugged)
+        answers = caller.answers.get(key)
+        if answers is None and self.persistent_tabling and not self.includes:
+            answers = self.answer_tables.get(key)
+        if answers is None:
+            answers = self._table_answers(plugged, context, caller)
+            if answers is None:
+                # answers not ground; evaluate the literal directly
+                return self._top_down_truth(context, caller)
+            caller.answers[key] = answers
+            if self.persistent_tabling and not self.includes:
+                self.answer_tables[key] = answers
+        if self.tracer.enabled:
+            self._print_call(lit, context.binding, context.depth)
+        for answer in answers:
+            undo = unify.match_atoms(lit, context.binding, answer)
+            if undo is None:  # no unifier
+                continue
+            if self._top_down_finish(context, caller):
+                context.binding.undo(undo)
+                if not caller.find_all:
+                    return True
+            else:
+                context.binding.undo(undo)
+        if self.tracer.enabled:
+            self._print_fail(lit, context.binding, context.depth)
+        return False
+
+    def _table_answers(self, plugged, context, caller):
+        """Return all the ground instances of PLUGGED or None."""
+        binding = self.new_bi_unifier()
+        new_caller = self.TopDownCaller(plugged.variables(), binding, self,
+                                        find_all=True, save=None)
+        new_caller.answers = caller.answers
+        new_context = self.TopDownContext([plugged], 0, binding, None, self,
+                                          context.depth + 1)
+        self._top_down_truth(new_context, new_caller)
+        answers = set(plugged.plug(result.binding)
+                      for result in new_caller.results)
+        if not all(answer.is_ground() for answer in answers):
+            return None
+        return list(answers)
+
+    @staticmethod
+    def _call_variant(literal):
+        """Return a key identifying LITERAL up to variable renaming."""
+        variables = {}
+        args = []
+        for arg in literal.arguments:
+            if arg.is_variable():
+                args.append((True, variables.setdefault(arg, len(variables))))
+            else:
+                args.append((False, arg.name))
+        return (literal.table.table, literal.table.modal, tuple(args))
+
+    @staticmethod
+    def _plug_apart(literal, binding):
+        """Plug BINDING into LITERAL, keeping distinct variables distinct.
+
+        Unbound variables are renamed after the cell they end up at, so
+        two variables with the same name from different rules never
+        collapse into one.
+        """
+        values = {}
+        for arg in literal.arguments:
+            value = binding.apply(arg)
+            if value.is_variable():
+                value = compile.Variable(
+                    "%s_%s" % (value.name, binding.resolve(arg)))
+            values[arg] = value
+        return literal.plug(values)
+
     def _top_down_truth(self, context, caller):
         """Top down evaluation.
 
@@ -452,34 +597,114 @@ class TopDownTheory(base.Theory):
         """Top-down evaluation for the rules in self."""
         # LOG.debug("%s._top_down_th(%s)", self.name, context)
         lit = context.literals[context.literal_index]
-        self._print_call(lit, context.binding, context.depth)
-        for rule in self.head_index(lit.table.table,
-                                    lit.plug(context.binding)):
-            unifier = self.new_bi_unifier()
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.start()
+        if self.tracer.enabled:
+            self._print_call(lit, context.binding, context.depth)
+        plugged = lit.plug(context.binding)
+        finished = False
+        for rule in self.head_index(lit.table.table, plugged):
+            if self._top_down_rule(rule, plugged, context, caller):
+                if not caller.find_all:
+                    finished = True
+                    break
+        else:
+            if self.tracer.enabled:
+                self._print_fail(lit, context.binding, context.depth)
+        if profiler is not None:
+            counts = profiler.table(self.name, lit.table.table)
+            counts['calls'] += 1
+            profiler.stop(counts, start)
+        return finished
+
+    def _top_down_rule(self, rule, plugged, context, caller):
+        """Top-down evaluation of the literal in CONTEXT using RULE.
+
+        PLUGGED is that literal with the bindings of CONTEXT applied.
+        Rules with a body are evaluated with their join plan, if any:
+        natively when the plan allows it, and otherwise literal by
+        literal in the order chosen by the plan.
+        Returns True if done searching and False otherwise.
+        """
+        lit = context.literals[context.literal_index]
+        body = self.body(rule)
+        # facts are counted with their table, rules on their own
+        profiler = self.profiler
+        counts = None
+        if profiler is not None:
+            if len(body) > 0:
+                counts = profiler.rule(self.name, rule)
+                counts['invocations'] += 1
+                start = profiler.start()
+            else:
+                counts = profiler.table(self.name, lit.table.table)
+            counts['unify_attempts'] += 1
+        if (len(body) > 0 and caller.save is None and
+                unify.same_schema(self.head(rule), plugged, self.name)):
+            adornment = joinplan.adorn(self.head(rule), plugged)
+            if adornment is None:
+                return False
+            bound, values = adornment
+            plan = self.join_plan(rule, bound)
+            if plan is not None:
+                if not self.includes and not self.tracer.enabled:
+                    rows = self.evaluate_join_plan(plan, values)
+                    if rows is not None:
+                        if counts is not None:
+                            counts['unify_successes'] += 1
+                            counts['plan_runs'] += 1
+                        finished = self._top_down_rows(rows, context, caller)
+                        if counts is not None:
+                            profiler.stop(counts, start)
+                        return finished
+                body = plan.body
+        # the cells of the variables of RULE; a rule without variables
+        #   needs none
+        slots = self.variable_slots(rule)
+        if slots:
+            unifier = context.binding.activation(slots)
+        else:
+            unifier = context.binding
+        if self.tracer.enabled:
             self._print_note(lit, context.binding, context.depth,
                              "Trying %s" % rule)
-            # Prefer to bind vars in rule head
-            undo = self.bi_unify(self.head(rule), unifier, lit,
-                                 context.binding, self.name)
+        # Prefer to bind vars in rule head
+        undo = self.bi_unify(self.head(rule), unifier, lit,
+                             context.binding, self.name)
+        if undo is None:  # no unifier
+            if slots:
+                unifier.release()
+            return False
+        if counts is not None:
+            counts['unify_successes'] += 1
+        if len(body) == 0:
+            finished = self._top_down_finish(context, caller)
+        else:
+            new_context = self.TopDownContext(
+                body, 0, unifier, context, self, context.depth + 1)
+            finished = self._top_down_eval(new_context, caller)
+            if counts is not None:
+                profiler.stop(counts, start)
+        context.binding.undo(undo)
+        if slots:
+            unifier.release()
+        return finished
+
+    def _top_down_rows(self, rows, context, caller):
+        """Continue the search with each of the head tuples ROWS.
+
+        Returns True if done searching and False otherwise.
+        """
+        lit = context.literals[context.literal_index]
+        for row in rows:
+            undo = unify.match_values(lit, context.binding, row)
             if undo is None:  # no unifier
                 continue
-            if len(self.body(rule)) == 0:
-                if self._top_down_finish(context, caller):
-                    unify.undo_all(undo)
-                    if not caller.find_all:
-                        return True
-                else:
-                    unify.undo_all(undo)
-            else:
-                new_context = self.TopDownContext(
-                    rule.body, 0, unifier, context, self, context.depth + 1)
-                if self._top_down_eval(new_context, caller):
-                    unify.undo_all(undo)
-                    if not caller.find_all:
-                        return True
-                else:
-                    unify.undo_all(undo)
-        self._print_fail(lit, context.binding, context.depth)
+            finished = self._top_down_finish(context, caller)
+            context.binding.undo(undo)
+            if finished and not caller.find_all:
+                return True
         return False
 
     def _top_down_finish(self, context, caller, redo=True):
@@ -507,8 +732,9 @@ class TopDownTheory(base.Theory):
                 caller.results.append(result)
             return True
         else:
-            self._print_exit(context.literals[context.literal_index],
-                             context.binding, context.depth)
+            if self.tracer.enabled:
+                self._print_exit(context.literals[context.literal_index],
+                                 context.binding, context.depth)
             # continue the search
             if context.literal_index < len(context.literals) - 1:
                 context.literal_index += 1
@@ -518,8 +744,9 @@ class TopDownTheory(base.Theory):
                 finished = self._top_down_finish(context.previous, caller)
             # return search result (after printing a Redo if failure)
             if redo and (not finished or caller.find_all):
-                self._print_redo(context.literals[context.literal_index],
-                                 context.binding, context.depth)
+                if self.tracer.enabled:
+                    self._print_redo(context.literals[context.literal_index],
+                                     context.binding, context.depth)
             return finished
 
     def _print_call(self, literal, binding, depth):
@@ -552,11 +779,13 @@ class TopDownTheory(base.Theory):
     # Routines for specialization
 
     @classmethod
-    def new_bi_unifier(cls, dictionary=None):
-        """Return a unifier compatible with unify.bi_unify."""
-        return unify.BiUnifier(dictionary=dictionary)
-        # lambda (index):
-        # compile.Variable("x" + str(index)), dictionary=dictionary)
+    def new_bi_unifier(cls, dictionary=None, slots=None):
+        """Return a unifier compatible with unify.bi_unify.
+
+        The unifier starts a new trail, with cells for the variables
+        numbered by SLOTS.
+        """
+        return unify.Frame(slots, dictionary=dictionary)
 
     def defined_tablenames(self):
         """Returns list of table names defined in/written to this theory."""
@@ -588,13 +817,54 @@ class TopDownTheory(base.Theory):
         """
         raise NotImplementedError
 
+    def variable_slots(self, formula):
+        """Return the numbering of the variables of FORMULA.
+
+        Given something returned by HEAD_INDEX, return a dict from each
+        of its variables to the offset of its cell in a unify.Frame.
+        """
+        return formula.variable_slots()
+
+    def join_plan(self, rule, bound):
+        """Return a joinplan.JoinPlan for the body of RULE or None.
+
+        BOUND tells for each argument of the head of RULE whether its
+        value is known before the body is evaluated.
+        """
+        return None
+
+    def evaluate_join_plan(self, plan, values):
+        """Run the steps of PLAN on the facts of this theory.
+
+        VALUES are the values of the head arguments bound beforehand.
+        Returns the set of tuples of head arguments proven by the body,
+        or None if the theory cannot run PLAN, in which case its body is
+        evaluated literal by literal.
+        """
+        return None
+
+    def estimate_literal(self, lit, columns):
+        """Estimate the number of rows matching LIT.
+
+        COLUMNS are the argument positions of LIT known beforehand.
+        Asks the theory holding the table of LIT; returns None if unknown.
+        """
+        if lit.table.modal is not None:
+            return None
+        service = lit.table.service
+        if service is None or service == self.name:
+            return self.estimate_rows(lit.table.table, columns)
+        if self.theories is None or service not in self.theories:
+            return None
+        return self.theories[service].estimate_rows(lit.table.table, columns)
+
     def bi_unify(self, head, unifier1, body_element, unifier2, theoryname):
         """Unify atoms.
 
         Given something returned by self.head HEAD and an element in
         the return of self.body BODY_ELEMENT, modify UNIFIER1 and UNIFIER2
         so that HEAD.plug(UNIFIER1) == BODY_ELEMENT.plug(UNIFIER2).
-        Returns changes that can be undone via unify.undo-all.
+        Returns the mark of the trail to undo the changes to, or None.
         THEORYNAME is the name of the theory for HEAD.
         """
         return unify.bi_unify_atoms(head, unifier1, body_element, unifier2,
@@ -618,7 +888,8 @@ class TopDownTheory(base.Theory):
             results.add(rule.plug(binding))
             return
         lit = rule.body[index]
-        self._print_call(lit, binding, 0)
+        if self.tracer.enabled:
+            self._print_call(lit, binding, 0)
         # if already ground or a builtin, go to the next literal
         if (lit.is_ground() or lit.is_builtin()):
             self._instances(rule, index + 1, binding, results, possibilities)
@@ -629,14 +900,17 @@ class TopDownTheory(base.Theory):
         else:
             options = self.head_index(lit.tablename(), lit.plug(binding))
         for data in options:
-            self._print_note(lit, binding, 0, "Trying: %s" % repr(data))
+            if self.tracer.enabled:
+                self._print_note(lit, binding, 0, "Trying: %s" % repr(data))
             undo = unify.match_atoms(lit, binding, self.head(data))
             if undo is None:  # no unifier
                 continue
-            self._print_exit(lit, binding, 0)
+            if self.tracer.enabled:
+                self._print_exit(lit, binding, 0)
             # recurse on the rest of the literals in the rule
             self._instances(rule, index + 1, binding, results, possibilities)
-            if undo is not None:
-                unify.undo_all(undo)
-            self._print_redo(lit, binding, 0)
-        self._print_fail(lit, binding, 0)
+            binding.undo(undo)
+            if self.tracer.enabled:
+                self._print_redo(lit, binding, 0)
+        if self.tracer.enabled:
+            self._print_fail(lit, binding, 0)
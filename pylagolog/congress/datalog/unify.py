@@ -19,6 +19,7 @@ from __future__ import absolute_import
 
 from oslo_log import log as logging
 from oslo_utils import uuidutils
+import six
 from six.moves import range
 
 from pylagolog.congress.datalog import compile
@@ -26,153 +27,205 @@ from pylagolog.congress.datalog import compile
 LOG = logging.getLogger(__name__)
 
 
-# A unifier designed for the bi_unify_atoms routine
-# which is used by a backward-chaining style datalog implementation.
-# Main goal: minimize memory allocation by manipulating only unifiers
-#   to keep variable namespaces separate.
+# The bindings of a backward-chaining search, laid out as in the WAM.
+# Main goal: no memory allocation per unification step.  Every variable
+#   of every rule activation is a cell of one flat list, found through
+#   a number given to the variable once per rule, and every binding is
+#   undone through a single trail.
 
-class BiUnifier(object):
-    """A unifier designed for bi_unify_atoms.
+UNBOUND = None
 
-    Recursive datastructure. When adding a binding variable u to
-    variable v, keeps a reference to the unifier for v.
-    A variable's identity is its name plus its unification context.
-    This enables a variable with the same name but from two
-    different atoms to be treated as different variables.
-    """
-    class Value(object):
-        def __init__(self, value, unifier):
-            # actual value
-            self.value = value
-            # unifier context
-            self.unifier = unifier
-
-        def __str__(self):
-            return "<{},{}>".format(
-                str(self.value), repr(self.unifier))
-
-        def recur_str(self):
-            if self.unifier is None:
-                recur = str(self.unifier)
-            else:
-                recur = self.unifier.recur_str()
-            return "<{},{}>".format(
-                str(self.value), recur)
-
-        def __eq__(self, other):
-            return self.value == other.value and self.unifer == other.unifier
-
-        def __ne__(self, other):
-            return not self.__eq__(other)
-
-        def __repr__(self):
-            return "Value(value={}, unifier={})".format(
-                repr(self.value), repr(self.unifier))
-
-    class Undo(object):
-        def __init__(self, var, unifier):
-            self.var = var
-            self.unifier = unifier
 
-        def __str__(self):
-            return "<var: {}, unifier: {}>".format(
-                str(self.var), str(self.unifier))
+class Trail(object):
+    """The variable cells of a search and the trail of their bindings.
 
-        def __eq__(self, other):
-            return self.var == other.var and self.unifier == other.unifier
-
-        def __ne__(self, other):
-            return not self.__eq__(other)
-
-    def __init__(self, dictionary=None):
-        # each value is a Value
-        self.contents = {}
+    CELLS holds one cell per variable of each activation: UNBOUND, the
+    compile.Term the variable is bound to, or the index of the cell of
+    the variable it is bound to.  VARIABLES holds the variable of each
+    cell.  TRAIL is the stack of the cells bound so far, so backtracking
+    to a mark taken earlier unbinds everything bound since.
+    """
+    __slots__ = ['cells', 'variables', 'trail', 'pinned']
+
+    def __init__(self):
+        self.cells = []
+        self.variables = []
+        self.trail = []
+        # cells below this index are never released (see release)
+        self.pinned = 0
+
+    def allocate(self, variables):
+        """Add a cell for each of VARIABLES; return the index of the first."""
+        base = len(self.cells)
+        self.variables.extend(variables)
+        self.cells.extend([UNBOUND] * (len(self.variables) - base))
+        return base
+
+    def release(self, frame):
+        """Free the cells of FRAME and of the frames allocated after it.
+
+        Only safe once the bindings made since FRAME was allocated are
+        undone.
+        """
+        base = max(frame.base, self.pinned)
+        del self.cells[base:]
+        del self.variables[base:]
+
+    def mark(self):
+        return len(self.trail)
+
+    def bind(self, cell, value):
+        """Bind CELL to a compile.Term or to the index of another cell."""
+        self.cells[cell] = value
+        self.trail.append(cell)
+
+    def undo(self, mark):
+        """Unbind the cells bound since MARK was taken."""
+        cells = self.cells
+        trail = self.trail
+        while len(trail) > mark:
+            cells[trail.pop()] = UNBOUND
+
+    def walk(self, cell):
+        """Return the cell at the end of the chain of bindings from CELL."""
+        cells = self.cells
+        value = cells[cell]
+        while value.__class__ is int:
+            cell = value
+            value = cells[cell]
+        return cell
+
+
+class Frame(object):
+    """The bindings of the variables of one rule activation.
+
+    SLOTS maps each variable of the rule to its offset from BASE, the
+    first of the cells allocated for the activation in TRAIL.  SLOTS
+    is computed once per rule (see compile.Rule.variable_slots) and
+    shared by all its activations.  A variable missing from SLOTS gets
+    a cell of its own the first time it is looked up.
+    """
+    __slots__ = ['trail', 'base', 'slots', 'extra']
+
+    def __init__(self, slots=None, trail=None, dictionary=None):
+        if trail is None:
+            trail = Trail()
+        if slots is None:
+            slots = {}
+        self.trail = trail
+        self.slots = slots
+        self.extra = None
+        self.base = trail.allocate(slots)
         if dictionary is not None:
             for var, value in dictionary.items():
-                self.add(var, value, None)
+                self.bind(var, compile.Term.create_from_python(value))
+
+    def activation(self, slots):
+        """Return a new Frame for a rule with SLOTS in the same trail."""
+        return Frame(slots, self.trail)
+
+    def cell(self, var):
+        """Return the index of the cell of the variable VAR."""
+        offset = self.slots.get(var)
+        if offset is not None:
+            return self.base + offset
+        if self.extra is None:
+            self.extra = {}
+        cell = self.extra.get(var)
+        if cell is None:
+            trail = self.trail
+            cell = trail.allocate((var,))
+            trail.pinned = cell + 1
+            self.extra[var] = cell
+        return cell
+
+    def resolve(self, term):
+        """Return the cell TERM is bound through, or None for a constant."""
+        if not term.is_variable():
+            return None
+        return self.trail.walk(self.cell(term))
 
-    def add(self, var, value, unifier):
-        value = self.Value(value, unifier)
-        # LOG.debug("Adding %s -> %s to unifier %s", var, value, self)
-        self.contents[var] = value
-        return self.Undo(var, self)
+    def value(self, term):
+        """Return the compile.Term TERM is bound to, or None if unbound."""
+        if not term.is_variable():
+            return term
+        return self.trail.cells[self.trail.walk(self.cell(term))]
 
-    def delete(self, var):
-        if var in self.contents:
-            del self.contents[var]
+    def bind(self, var, value):
+        """Bind the variable VAR to the compile.Term VALUE.
 
-    def value(self, term):
-        if term in self.contents:
-            return self.contents[term]
-        else:
+        Returns the mark to undo the binding with, or None if VAR is
+        already bound to something else.
+        """
+        mark = len(self.trail.trail)
+        cell = self.trail.walk(self.cell(var))
+        current = self.trail.cells[cell]
+        if current is UNBOUND:
+            self.trail.bind(cell, value)
+        elif current != value:
             return None
+        return mark
 
-    def apply(self, term, caller=None):
-        return self.apply_full(term, caller=caller)[0]
+    def mark(self):
+        return len(self.trail.trail)
+
+    def undo(self, mark):
+        """Unbind all the cells of the trail bound since MARK."""
+        self.trail.undo(mark)
 
-    def apply_full(self, term, caller=None):
-        """Recursively apply unifiers to TERM.
+    def release(self):
+        """Free the cells of this frame once it is no longer used."""
+        self.trail.release(self)
 
-        Return (i) the final value and (ii) the final unifier.
-        If the final value is a variable, instantiate
-        with a new variable if not in KEEP_VARS
+    def apply(self, term, caller=None):
+        """Return the value of TERM under this frame.
+
+        An unbound variable is returned as the variable of the cell it
+        ends up at.  If CALLER is given, that variable is renamed after
+        its cell unless it is one of the variables of CALLER, so that
+        outputting variables of different activations never captures
+        one with another.
         """
-        # LOG.debug("apply_full(%s, %s)", term, self)
-        val = self.value(term)
-        if val is None:
-            # If result is a variable and this variable is not one of those
-            #   in the top-most calling context, then create a new variable
-            #   name based on this Binding.
-            # This process avoids improper variable capture.
-            #   Outputting the same variable with the same binding twice will
-            #   generate the same output, but outputting the same variable with
-            #   different bindings will generate different outputs.
-            # Note that this variable name mangling
-            #   is not done for the top-most variables,
-            #   which makes output a bit easier to read.
-            # Unfortunately, the process is non-deterministic from one run
-            #   to the next, which makes testing difficult.
-            if (caller is not None and term.is_variable() and
-                    not (term in caller.variables and caller.binding is self)):
-                return (compile.Variable(term.name + str(id(self))), self)
-            else:
-                return (term, self)
-        elif val.unifier is None or not val.value.is_variable():
-            return (val.value, val.unifier)
-        else:
-            return val.unifier.apply_full(val.value)
+        if not term.is_variable():
+            return term
+        trail = self.trail
+        cell = trail.walk(self.cell(term))
+        value = trail.cells[cell]
+        if value is not UNBOUND:
+            return value
+        var = trail.variables[cell]
+        if (caller is not None and
+                not (var in caller.variables and
+                     caller.binding.trail is trail and
+                     caller.binding.cell(var) == cell)):
+            return compile.Variable(var.name + str(cell))
+        return var
 
     def is_one_to_one(self):
         image = set()  # set of all things mapped TO
-        for x in self.contents:
-            val = self.apply(x)
+        for var in self._variables():
+            val = self.apply(var)
             if val in image:
                 return False
             image.add(val)
         return True
 
-    def __str__(self):
-        s = repr(self)
-        s += "={"
-        s += ",".join(["{}:{}".format(str(var), str(val))
-                       for var, val in self.contents.items()])
-        s += "}"
-        return s
+    def _variables(self):
+        variables = list(self.slots)
+        if self.extra:
+            variables.extend(self.extra)
+        return variables
 
-    def recur_str(self):
+    def __str__(self):
         s = repr(self)
         s += "={"
-        s += ",".join(["{}:{}".format(var, val.recur_str())
-                       for var, val in self.contents.items()])
+        cells = self.trail.cells
+        s += ",".join(["{}:{}".format(str(var), str(self.apply(var)))
+                       for var in self._variables()
+                       if cells[self.cell(var)] is not UNBOUND])
         s += "}"
         return s
 
-    def __eq__(self, other):
-        return self.contents == other.contents
-
-    def __ne__(self, other):
-        return not self.__eq__(other)
-
 
 def binding_str(binding):
     """Handles string conversion of either dictionary or Unifier."""
@@ -184,17 +237,6 @@ def binding_str(binding):
         return str(binding)
 
 
-def undo_all(changes):
-    """Undo all the changes in CHANGES."""
-    # LOG.debug("undo_all(%s)",
-    #     "[" + ",".join([str(x) for x in changes]) + "]")
-    if changes is None:
-        return
-    for change in changes:
-        if change.unifier is not None:
-            change.unifier.delete(change.var)
-
-
 def same_schema(atom1, atom2, theoryname=None):
     """Return True if ATOM1 and ATOM2 have the same schema.
 
@@ -210,15 +252,13 @@ def same_schema(atom1, atom2, theoryname=None):
 def bi_unify_atoms(atom1, unifier1, atom2, unifier2, theoryname=None):
     """Unify atoms.
 
-    If possible, modify BiUnifier UNIFIER1 and BiUnifier UNIFIER2 so that
+    If possible, modify Frame UNIFIER1 and Frame UNIFIER2 so that
     ATOM1.plug(UNIFIER1) == ATOM2.plug(UNIFIER2).
-    Returns None if not possible; otherwise, returns
-    a list of changes to unifiers that can be undone
-    with undo-all. May alter unifiers besides UNIFIER1 and UNIFIER2.
+    Returns None if not possible; otherwise, returns the mark of the
+    trail the changes can be undone to.  Both frames must share a trail.
+    May alter cells besides those of UNIFIER1 and UNIFIER2.
     THEORYNAME is the default theory name.
     """
-    # logging.debug("Unifying %s under %s and %s under %s",
-    #      atom1, unifier1, atom2, unifier2)
     if not same_schema(atom1, atom2, theoryname):
         return None
     return bi_unify_lists(atom1.arguments, unifier1,
@@ -228,44 +268,35 @@ def bi_unify_atoms(atom1, unifier1, atom2, unifier2, theoryname=None):
 def bi_unify_lists(iter1, unifier1, iter2, unifier2):
     """Unify lists.
 
-    If possible, modify BiUnifier UNIFIER1 and BiUnifier UNIFIER2 such that
+    If possible, modify Frame UNIFIER1 and Frame UNIFIER2 such that
     iter1.plug(UNIFIER1) == iter2.plug(UNIFIER2), assuming PLUG is defined
-    over lists.  Returns None if not possible; otherwise, returns
-    a list of changes to unifiers that can be undone
-    with undo-all. May alter unifiers besides UNIFIER1 and UNIFIER2.
+    over lists.  Returns None if not possible; otherwise, returns the
+    mark of the trail the changes can be undone to.
     """
     if len(iter1) != len(iter2):
         return None
-    changes = []
-    for i in range(0, len(iter1)):
-        assert isinstance(iter1[i], compile.Term)
-        assert isinstance(iter2[i], compile.Term)
-        # grab values for args
-        val1, binding1 = unifier1.apply_full(iter1[i])
-        val2, binding2 = unifier2.apply_full(iter2[i])
-        # logging.debug("val(%s)=%s at %s, val(%s)=%s at %s",
-        #     atom1.arguments[i], val1, binding1,
-        #     atom2.arguments[i], val2, binding2)
+    trail = unifier1.trail
+    cells = trail.cells
+    mark = len(trail.trail)
+    for term1, term2 in six.moves.zip(iter1, iter2):
+        cell1 = unifier1.resolve(term1)
+        val1 = term1 if cell1 is None else cells[cell1]
+        cell2 = unifier2.resolve(term2)
+        val2 = term2 if cell2 is None else cells[cell2]
         # assign variable (if necessary) or fail
-        if val1.is_variable() and val2.is_variable():
-            # logging.debug("1 and 2 are variables")
-            if bi_var_equal(val1, binding1, val2, binding2):
-                continue
+        if val1 is UNBOUND:
+            if val2 is UNBOUND:
+                # bind the variable of the rule head to the one called
+                if cell1 != cell2:
+                    trail.bind(cell1, cell2)
             else:
-                changes.append(binding1.add(val1, val2, binding2))
-        elif val1.is_variable() and not val2.is_variable():
-            # logging.debug("Left arg is a variable")
-            changes.append(binding1.add(val1, val2, binding2))
-        elif not val1.is_variable() and val2.is_variable():
-            # logging.debug("Right arg is a variable")
-            changes.append(binding2.add(val2, val1, binding1))
-        elif val1 == val2:
-            continue
-        else:
-            # logging.debug("Unify failure: undoing")
-            undo_all(changes)
+                trail.bind(cell1, val2)
+        elif val2 is UNBOUND:
+            trail.bind(cell2, val1)
+        elif val1 != val2:
+            trail.undo(mark)
             return None
-    return changes
+    return mark
 
 # def plug(atom, binding, withtable=False):
 #     """ Returns a tuple representing the arguments to ATOM after having
@@ -308,8 +339,9 @@ def match_atoms(atom1, unifier, atom2):
     """Modify UNIFIER so that ATOM1.plug(UNIFIER) == ATOM2.
 
     ATOM2 is assumed to be ground.
-    UNIFIER is assumed to be a BiUnifier.
-    Return the changes to UNIFIER or None if matching is impossible.
+    UNIFIER is assumed to be a Frame.
+    Return the mark of the trail to undo the changes to, or None if
+    matching is impossible.
 
     Matching is a special case of instance-checking since ATOM2
     in this case must be ground, whereas there is no such limitation
@@ -318,27 +350,42 @@ def match_atoms(atom1, unifier, atom2):
     """
     if not same_schema(atom1, atom2):
         return None
-    changes = []
-    for i in range(0, len(atom1.arguments)):
-        val, binding = unifier.apply_full(atom1.arguments[i])
-        # LOG.debug("val(%s)=%s at %s; comparing to object %s",
-        #     atom1.arguments[i], val, binding, atom2.arguments[i])
-        if val.is_variable():
-            changes.append(binding.add(val, atom2.arguments[i], None))
-        else:
-            if val.name != atom2.arguments[i].name:
-                undo_all(changes)
-                return None
-    return changes
+    trail = unifier.trail
+    cells = trail.cells
+    mark = len(trail.trail)
+    for arg, value in six.moves.zip(atom1.arguments, atom2.arguments):
+        cell = unifier.resolve(arg)
+        val = arg if cell is None else cells[cell]
+        if val is UNBOUND:
+            trail.bind(cell, value)
+        elif val.name != value.name:
+            trail.undo(mark)
+            return None
+    return mark
 
 
-def bi_var_equal(var1, unifier1, var2, unifier2):
-    """Check var equality.
+def match_values(atom, unifier, values):
+    """Modify UNIFIER so that ATOM.plug(UNIFIER) has arguments VALUES.
 
-    Returns True iff variable VAR1 in unifier UNIFIER1 is the same
-    variable as VAR2 in UNIFIER2.
+    VALUES is a tuple of native values, as stored in a FactSet.
+    UNIFIER is assumed to be a Frame.
+    Return the mark of the trail to undo the changes to, or None if
+    matching is impossible.
     """
-    return (var1 == var2 and unifier1 is unifier2)
+    if len(atom.arguments) != len(values):
+        return None
+    trail = unifier.trail
+    cells = trail.cells
+    mark = len(trail.trail)
+    for arg, value in six.moves.zip(atom.arguments, values):
+        cell = unifier.resolve(arg)
+        val = arg if cell is None else cells[cell]
+        if val is UNBOUND:
+            trail.bind(cell, compile.Term.create_from_python(value))
+        elif val.name != value:
+            trail.undo(mark)
+            return None
+    return mark
 
 
 def same(formula1, formula2):
@@ -354,8 +401,8 @@ def same(formula1, formula2):
         elif formula1.is_negated() != formula2.is_negated():
             return None
         else:
-            u1 = BiUnifier()
-            u2 = BiUnifier()
+            u1 = Frame()
+            u2 = Frame(trail=u1.trail)
             if same_atoms(formula1, u1, formula2, u2, set()) is not None:
                 return (u1, u2)
             return None
@@ -365,8 +412,8 @@ def same(formula1, formula2):
         else:
             if len(formula1.body) != len(formula2.body):
                 return None
-            u1 = BiUnifier()
-            u2 = BiUnifier()
+            u1 = Frame()
+            u2 = Frame(trail=u1.trail)
             bound2 = set()
             result = same_atoms(formula1.head, u1, formula2.head, u2, bound2)
             if result is None:
@@ -386,48 +433,43 @@ def same_atoms(atom1, unifier1, atom2, unifier2, bound2):
 
     Modifies UNIFIER1 and UNIFIER2 to demonstrate
     that ATOM1 and ATOM2 are identical up to a variable renaming.
-    Returns None if not possible or the list of changes if it is.
-    BOUND2 is the set of variables already bound in UNIFIER2
+    Returns None if not possible or the mark of the trail to undo the
+    changes to if it is.  BOUND2 is the set of the cells of UNIFIER2
+    already bound to.  Both unifiers must share a trail.
     """
     def die():
-        undo_all(changes)
+        trail.undo(mark)
         return None
     LOG.debug("same_atoms(%s, %s)", atom1, atom2)
     if not same_schema(atom1, atom2):
         return None
-    changes = []
-    # LOG.debug("same_atoms entering loop")
-    for i in range(0, len(atom1.arguments)):
-        val1, binding1 = unifier1.apply_full(atom1.arguments[i])
-        val2, binding2 = unifier2.apply_full(atom2.arguments[i])
-        # LOG.debug("val1: %s at %s; val2: %s at %s",
-        #     val1, binding1, val2, binding2)
-        if val1.is_variable() and val2.is_variable():
-            if bi_var_equal(val1, binding1, val2, binding2):
+    trail = unifier1.trail
+    cells = trail.cells
+    mark = len(trail.trail)
+    for arg1, arg2 in six.moves.zip(atom1.arguments, atom2.arguments):
+        cell1 = unifier1.resolve(arg1)
+        val1 = arg1 if cell1 is None else cells[cell1]
+        cell2 = unifier2.resolve(arg2)
+        val2 = arg2 if cell2 is None else cells[cell2]
+        if val1 is UNBOUND and val2 is UNBOUND:
+            if cell1 == cell2:
                 continue
             # if we already bound either of these variables, not SAME
-            if not bi_var_equal(val1, binding1, atom1.arguments[i], unifier1):
-                # LOG.debug("same_atoms: arg1 already bound")
+            if cell1 != unifier1.cell(arg1):
                 return die()
-            if not bi_var_equal(val2, binding2, atom2.arguments[i], unifier2):
-                # LOG.debug("same_atoms: arg2 already bound")
+            if cell2 != unifier2.cell(arg2):
                 return die()
-            if val2 in bound2:
-                # LOG.debug("same_atoms: binding is not 1-1")
+            if cell2 in bound2:
+                # binding is not 1-1
                 return die()
-            changes.append(binding1.add(val1, val2, binding2))
-            bound2.add(val2)
-        elif val1.is_variable():
-            # LOG.debug("val1 is a variable")
-            return die()
-        elif val2.is_variable():
-            # LOG.debug("val2 is a variable")
+            trail.bind(cell1, cell2)
+            bound2.add(cell2)
+        elif val1 is UNBOUND or val2 is UNBOUND:
             return die()
         elif val1 != val2:
-            # one is a variable and one is not or unmatching object constants
-            # LOG.debug("val1 != val2")
+            # unmatching object constants
             return die()
-    return changes
+    return mark
 
 
 def instance(formula1, formula2):
@@ -443,7 +485,7 @@ def instance(formula1, formula2):
         elif formula1.is_negated() != formula2.is_negated():
             return None
         else:
-            u = BiUnifier()
+            u = Frame()
             if instance_atoms(formula1, formula2, u) is not None:
                 return u
             return None
@@ -453,7 +495,7 @@ def instance(formula1, formula2):
         else:
             if len(formula1.body) != len(formula2.body):
                 return None
-            u = BiUnifier()
+            u = Frame()
             result = instance_atoms(formula1.head, formula2.head, u)
             if result is None:
                 return None
@@ -475,40 +517,38 @@ def instance_atoms(atom1, atom2, unifier2):
     no such bindings make equality hold.
     """
     def die():
-        undo_all(changes)
+        trail.undo(mark)
         return None
     LOG.debug("instance_atoms(%s, %s)", atom1, atom2)
     if not same_schema(atom1, atom2):
         return None
-    unifier1 = BiUnifier()
-    changes = []
-    for i in range(0, len(atom1.arguments)):
-        val1, binding1 = unifier1.apply_full(atom1.arguments[i])
-        val2, binding2 = unifier2.apply_full(atom2.arguments[i])
-        # LOG.debug("val1: %s at %s; val2: %s at %s",
-        #     val1, binding1, val2, binding2)
-        if val1.is_variable() and val2.is_variable():
-            if bi_var_equal(val1, binding1, val2, binding2):
+    trail = unifier2.trail
+    cells = trail.cells
+    unifier1 = Frame(trail=trail)
+    mark = len(trail.trail)
+    for arg1, arg2 in six.moves.zip(atom1.arguments, atom2.arguments):
+        cell1 = unifier1.resolve(arg1)
+        val1 = arg1 if cell1 is None else cells[cell1]
+        cell2 = unifier2.resolve(arg2)
+        val2 = arg2 if cell2 is None else cells[cell2]
+        if val1 is UNBOUND and val2 is UNBOUND:
+            if cell1 == cell2:
                 continue
             # if we already bound either of these variables, not INSTANCE
-            if not bi_var_equal(val1, binding1, atom1.arguments[i], unifier1):
-                # LOG.debug("instance_atoms: arg1 already bound")
+            if cell1 != unifier1.cell(arg1):
                 return die()
-            if not bi_var_equal(val2, binding2, atom2.arguments[i], unifier2):
-                # LOG.debug("instance_atoms: arg2 already bound")
+            if cell2 != unifier2.cell(arg2):
                 return die()
             # add binding to UNIFIER2
-            changes.append(binding2.add(val2, val1, binding1))
-        elif val1.is_variable():
+            trail.bind(cell2, cell1)
+        elif val1 is UNBOUND:
             return die()
-        elif val2.is_variable():
-            changes.append(binding2.add(val2, val1, binding1))
-            # LOG.debug("var2 is a variable")
+        elif val2 is UNBOUND:
+            trail.bind(cell2, val1)
         elif val1 != val2:
             # unmatching object constants
-            # LOG.debug("val1 != val2")
             return die()
-    return changes
+    return mark
 
 
 def skolemize(formulas):
@@ -56,7 +56,8 @@ class Graph(object):
     def __init__(self, graph=None):
         self.edges = {}   # dict from node to list of nodes
         self.nodes = {}   # dict from node to info about node
-        self._cycles = None
+        # strongly connected components, or None until they are needed
+        self._components = None
 
     def __or__(self, other):
         # do this the simple way so that subclasses get this code for free
@@ -78,7 +79,6 @@ class Graph(object):
         if len(other) == 0:
             # no changes if other is empty
             return self
-        self._cycles = None
         for name in other.nodes:
             self.add_node(name)
         for name in other.edges:
@@ -96,11 +96,20 @@ class Graph(object):
         """Add node VAL to graph."""
         if val not in self.nodes:  # preserve old node info
             self.nodes[val] = None
+            if self._components is not None:
+                if val in self._components.dangling:
+                    # edges left over from deleting VAL count again
+                    self._components = None
+                else:
+                    self._components.add_node(val)
             return True
         return False
 
     def delete_node(self, val):
         """Delete node VAL from graph and all edges."""
+        if val in self.nodes and self._components is not None:
+            if not self._components.delete_node(val):
+                self._components = None
         try:
             del self.nodes[val]
             del self.edges[val]
@@ -112,14 +121,14 @@ class Graph(object):
 
         Also adds the nodes.
         """
-        self._cycles = None  # so that has_cycles knows it needs to rerun
         self.add_node(val1)
         self.add_node(val2)
         val = self.edge_data(node=val2, label=label)
-        try:
-            self.edges[val1].add(val)
-        except KeyError:
-            self.edges[val1] = set([val])
+        edges = self.edges.setdefault(val1, set())
+        if val not in edges:
+            edges.add(val)
+            if self._components is not None:
+                self._components.add_edge(val1, val2, label)
 
     def delete_edge(self, val1, val2, label=None):
         """Delete edge from VAL1 to VAL2 with label LABEL.
@@ -132,7 +141,8 @@ class Graph(object):
         except KeyError:
             # KeyError either because val1 or edge
             return
-        self._cycles = None
+        if self._components is not None:
+            self._components.delete_edge(val1, val2, label)
 
     def node_in(self, val):
         return val in self.nodes
@@ -158,19 +168,19 @@ class Graph(object):
             if node in self.nodes and self.nodes[node].begin is None:
                 self.dfs(node)
 
-    def _enumerate_cycles(self):
+    def _enumerate_cycles(self, nodes):
         self.reset()
-        for node in self.nodes.keys():
+        cycles = set()
+        for node in nodes:
             self._reset_dfs_data()
             self.dfs(node, target=node)
             for path in self.__target_paths:
-                self._cycles.add(Cycle(path))
+                cycles.add(Cycle(path))
+        return cycles
 
     def reset(self, roots=None):
         """Return nodes to pristine state."""
         self._reset_dfs_data()
-        roots = roots or self.nodes
-        self._cycles = set()
 
     def _reset_dfs_data(self):
         for node in self.nodes.keys():
@@ -204,28 +214,93 @@ class Graph(object):
 
         Return mapping of node name to integer indicating the
         stratum to which that node is assigned. LABELS is the list
-        of edge labels that dictate a change in strata.
+        of edge labels that dictate a change in strata.  Returns None
+        if an edge with one of LABELS is on a cycle.
         """
-        stratum = {}
-        for node in self.nodes:
-            stratum[node] = 1
-        changes = True
-        while changes:
-            changes = False
-            for node in self.edges:
-                for edge in self.edges[node]:
-                    oldp = stratum[node]
-                    if edge.label in labels:
-                        stratum[node] = max(stratum[node],
-                                            1 + stratum[edge.node])
-                    else:
-                        stratum[node] = max(stratum[node],
-                                            stratum[edge.node])
-                    if oldp != stratum[node]:
-                        changes = True
-                    if stratum[node] > len(self.nodes):
-                        return None
-        return stratum
+        components = self.components(labels)
+        if not components.is_stratified():
+            return None
+        strata = components.strata
+        of = components.of
+        return dict((node, strata.get(of.get(node), 1))
+                    for node in self.nodes)
+
+    def is_stratified(self, labels):
+        """Return True iff no edge with one of LABELS is on a cycle."""
+        return self.components(labels).is_stratified()
+
+    def components(self, labels=None):
+        """Return the strongly connected components of the graph.
+
+        They are computed on the first call, and then kept up to date
+        as the graph changes.  With LABELS, the strata of the
+        components for those LABELS (see stratification) are kept up
+        to date as well.
+        """
+        if self._components is None:
+            self._components = Components(self)
+        if labels is not None:
+            self._components.set_labels(labels)
+        return self._components
+
+    def strongly_connected_components(self, nodes=None):
+        """Return the strongly connected components among NODES.
+
+        Tarjan's algorithm, without recursion.  Only the edges between
+        NODES, all the nodes by default, are followed.  Returns a list
+        of lists of nodes, in which every component comes after the
+        components reachable from it.
+        """
+        if nodes is None:
+            nodes = self.nodes
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        def successors(node):
+            return iter(set(edge.node for edge in self.edges.get(node, ())
+                            if edge.node in nodes))
+
+        for root in nodes:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, successors(root))]
+            while work:
+                node, remaining = work[-1]
+                for succ in remaining:
+                    if succ not in index:
+                        index[succ] = lowlink[succ] = len(index)
+                        stack.append(succ)
+                        on_stack.add(succ)
+                        work.append((succ, successors(succ)))
+                        break
+                    elif succ in on_stack:
+                        lowlink[node] = min(lowlink[node], index[succ])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+        return components
+
+    def recursive_components(self):
+        """Return the components with a cycle, as lists of nodes."""
+        components = self.components()
+        return [list(components.members[c]) for c in components.cyclic]
 
     def roots(self):
         """Return list of nodes with no incoming edges."""
@@ -237,23 +312,52 @@ class Graph(object):
         return possible_roots
 
     def has_cycle(self):
-        """Checks if there are cycles.
+        """Checks if there are cycles."""
+        return len(self.components().cyclic) > 0
+
+    def cycles(self, nodes=None):
+        """Return list of cycles through NODES, all nodes by default.
 
-        Run depth_first_search only if it has not already been run.
+        Enumerating the cycles may take time exponential in the size
+        of the graph; has_cycle and recursive_components do not.
         """
-        if self._cycles is None:
-            self._enumerate_cycles()
-        return len(self._cycles) > 0
-
-    def cycles(self):
-        """Return list of cycles. None indicates unknown. """
-        if self._cycles is None:
-            self._enumerate_cycles()
+        cyclic = set()
+        for component in self.recursive_components():
+            cyclic.update(component)
+        if nodes is not None:
+            cyclic.intersection_update(nodes)
         cycles_list = []
-        for cycle_graph in self._cycles:
+        for cycle_graph in self._enumerate_cycles(cyclic):
             cycles_list.append(cycle_graph.list_repr())
         return cycles_list
 
+    def find_cycle(self, node):
+        """Return a shortest cycle through NODE, or None if there is none.
+
+        The cycle is a list of nodes that starts and ends with NODE.
+        """
+        components = self.components()
+        component = components.of.get(node)
+        if component not in components.cyclic:
+            return None
+        members = components.members[component]
+        parents = {}
+        todo = collections.deque([node])
+        while todo:
+            current = todo.popleft()
+            for edge in self.edges.get(current, ()):
+                if edge.node == node:
+                    path = [node, current]
+                    while current != node:
+                        current = parents[current]
+                        path.append(current)
+                    path.reverse()
+                    return path
+                if edge.node in members and edge.node not in parents:
+                    parents[edge.node] = current
+                    todo.append(edge.node)
+        return None
+
     def dependencies(self, node):
         """Returns collection of node names reachable from NODE.
 
@@ -261,14 +365,7 @@ class Graph(object):
         """
         if node not in self.nodes:
             return None
-        self.reset()
-        node_obj = self.nodes[node]
-
-        if node_obj is None or node_obj.begin is None or node_obj.end is None:
-            self.depth_first_search([node])
-            node_obj = self.nodes[node]
-        return set([n for n, dfs_obj in self.nodes.items()
-                    if dfs_obj.begin is not None])
+        return self.find_reachable_nodes([node])
 
     def next_counter(self):
         """Return next counter value and increment the counter."""
@@ -307,17 +404,290 @@ class Graph(object):
 
         Note that node T is dependent on node T even if T is not in the graph
         """
-        return (self._inverted_edge_graph().find_reachable_nodes(nodes)
-                | set(nodes))
+        components = self.components()
+        return components.reachable(nodes, components.into) | set(nodes)
 
     def find_reachable_nodes(self, roots):
         """Return all nodes reachable from @roots."""
-        if len(roots) == 0:
-            return set()
-        self.depth_first_search(roots)
-        result = [x for x in self.nodes if self.nodes[x].begin is not None]
-        self.reset_nodes()
-        return set(result)
+        components = self.components()
+        return components.reachable(roots, components.out)
+
+
+class Components(object):
+    """The strongly connected components of a Graph.
+
+    Each component has an integer id.  OF maps each node to the id of
+    its component and MEMBERS each id to the set of its nodes.  OUT and
+    INTO map each id to a Counter of the (id, label) pairs of the edges
+    leaving and entering the component, INNER to a Counter of the
+    labels of the edges within it.  CYCLIC is the set of the ids of the
+    components with a cycle.  DANGLING counts the edges still in the
+    graph that enter each deleted node.
+
+    The components are computed once with Tarjan's algorithm and then
+    kept up to date as edges are inserted and deleted: an edge closing
+    a cycle merges the components on that cycle, and deleting an edge
+    within a component computes just that component again.  Once
+    set_labels is called, STRATA maps each id to its stratum for those
+    labels, which is kept up to date too.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.of = {}
+        self.members = {}
+        self.out = {}
+        self.into = {}
+        self.inner = {}
+        self.cyclic = set()
+        self.dangling = collections.Counter()
+        self.counter = 0
+        self.labels = None
+        self.strata = {}
+        for nodes in graph.strongly_connected_components():
+            self._new_component(nodes)
+        for node in graph.nodes:
+            for edge in graph.edges.get(node, ()):
+                if edge.node in graph.nodes:
+                    self._count(node, edge.node, edge.label, 1)
+                else:
+                    self.dangling[edge.node] += 1
+
+    def set_labels(self, labels):
+        """Keep the strata of the components for the edge LABELS."""
+        labels = frozenset(labels)
+        if labels == self.labels:
+            return
+        self.labels = labels
+        self.strata = {}
+        for start in self.members:
+            if start in self.strata:
+                continue
+            work = [(start, iter(self.out[start]))]
+            while work:
+                component, targets = work[-1]
+                for target, label in targets:
+                    if target not in self.strata:
+                        work.append((target, iter(self.out[target])))
+                        break
+                else:
+                    work.pop()
+                    self.strata[component] = self._stratum(component)
+
+    def is_stratified(self):
+        """Return True iff no component has an edge with one of LABELS."""
+        for component in self.cyclic:
+            inner = self.inner[component]
+            if any(inner[label] for label in self.labels):
+                return False
+        return True
+
+    def reachable(self, nodes, edges):
+        """Return the nodes reachable from NODES along EDGES.
+
+        EDGES is either OUT or INTO.  Only the NODES in the graph are
+        included.
+        """
+        todo = [self.of[node] for node in nodes if node in self.of]
+        seen = set(todo)
+        while todo:
+            component = todo.pop()
+            for target, label in edges[component]:
+                if target not in seen:
+                    seen.add(target)
+                    todo.append(target)
+        result = set()
+        for component in seen:
+            result.update(self.members[component])
+        return result
+
+    def add_node(self, node):
+        """Account for the new NODE."""
+        self._component(node)
+
+    def add_edge(self, node1, node2, label):
+        """Account for the new edge from NODE1 to NODE2."""
+        component1 = self._component(node1)
+        component2 = self._component(node2)
+        if component1 != component2:
+            forward = self._search(component2, self.out)
+            if component1 in forward:
+                # the edge closes cycles through the components both
+                #   reachable from NODE2 and reaching NODE1
+                backward = self._search(component1, self.into, forward)
+                component1 = self._merge(backward)
+        self._count(node1, node2, label, 1)
+        self._restratify([component1])
+
+    def delete_edge(self, node1, node2, label):
+        """Account for the deleted edge from NODE1 to NODE2."""
+        component1 = self.of.get(node1)
+        component2 = self.of.get(node2)
+        if component1 is None or component2 is None:
+            if node2 in self.dangling:
+                self._add(self.dangling, node2, -1)
+            return
+        self._count(node1, node2, label, -1)
+        if component1 == component2 and len(self.members[component1]) > 1:
+            self._split(component1)
+        else:
+            self._restratify([component1])
+
+    def delete_node(self, node):
+        """Account for deleting NODE and the edges leaving it.
+
+        Returns False if the components can no longer be kept up to
+        date, because NODE is on a cycle.
+        """
+        if node not in self.of:
+            return True
+        component = self.of[node]
+        if len(self.members[component]) > 1:
+            return False
+        for edge in list(self.graph.edges.get(node, ())):
+            self.delete_edge(node, edge.node, edge.label)
+        sources = set()
+        for (source, label), n in self.into[component].items():
+            sources.add(source)
+            self.dangling[node] += n
+        self._discard(component)
+        del self.of[node]
+        self._restratify(sources)
+        return True
+
+    def _component(self, node):
+        component = self.of.get(node)
+        if component is None:
+            component = self._new_component([node])
+            self._restratify([component])
+        return component
+
+    def _new_component(self, nodes):
+        component = self.counter
+        self.counter += 1
+        self.members[component] = set(nodes)
+        for node in nodes:
+            self.of[node] = component
+        self.out[component] = collections.Counter()
+        self.into[component] = collections.Counter()
+        self.inner[component] = collections.Counter()
+        self._check(component)
+        return component
+
+    def _discard(self, component):
+        """Forget COMPONENT and the edges entering and leaving it."""
+        for target, label in self.out.pop(component):
+            del self.into[target][(component, label)]
+        for source, label in self.into.pop(component):
+            del self.out[source][(component, label)]
+        del self.members[component]
+        del self.inner[component]
+        self.cyclic.discard(component)
+        self.strata.pop(component, None)
+
+    def _check(self, component):
+        if (len(self.members[component]) > 1 or
+                sum(self.inner[component].values())):
+            self.cyclic.add(component)
+        else:
+            self.cyclic.discard(component)
+
+    def _count(self, node1, node2, label, n):
+        """Add N edges from NODE1 to NODE2 with LABEL to the counts."""
+        component1 = self.of.get(node1)
+        component2 = self.of.get(node2)
+        if component1 is None or component2 is None:
+            return
+        if component1 == component2:
+            self._add(self.inner[component1], label, n)
+            self._check(component1)
+        else:
+            self._add(self.out[component1], (component2, label), n)
+            self._add(self.into[component2], (component1, label), n)
+
+    @staticmethod
+    def _add(counter, key, n):
+        counter[key] += n
+        if counter[key] <= 0:
+            del counter[key]
+
+    def _search(self, start, edges, within=None):
+        """Return the components reachable from START along EDGES."""
+        seen = set([start])
+        todo = [start]
+        while todo:
+            component = todo.pop()
+            for target, label in edges[component]:
+                if target not in seen and (within is None or
+                                           target in within):
+                    seen.add(target)
+                    todo.append(target)
+        return seen
+
+    def _merge(self, components):
+        """Merge COMPONENTS into one and return its id."""
+        merged = self._new_component(())
+        for component in components:
+            for node in self.members[component]:
+                self.of[node] = merged
+            self.members[merged] |= self.members[component]
+            self.inner[merged].update(self.inner[component])
+            for (target, label), n in self.out[component].items():
+                if target in components:
+                    self.inner[merged][label] += n
+                else:
+                    self._add(self.out[merged], (target, label), n)
+                    self._add(self.into[target], (merged, label), n)
+            for (source, label), n in self.into[component].items():
+                if source not in components:
+                    self._add(self.into[merged], (source, label), n)
+                    self._add(self.out[source], (merged, label), n)
+        for component in components:
+            self._discard(component)
+        self._check(merged)
+        return merged
+
+    def _split(self, component):
+        """Compute the component COMPONENT again, after an edge deletion."""
+        members = self.members[component]
+        parts = self.graph.strongly_connected_components(members)
+        if len(parts) == 1:
+            self._check(component)
+            self._restratify([component])
+            return
+        sources = set(source for source, label in self.into[component])
+        self._discard(component)
+        new = [self._new_component(part) for part in parts]
+        edges = self.graph.edges
+        for node in members:
+            for edge in edges.get(node, ()):
+                self._count(node, edge.node, edge.label, 1)
+        for source in sources:
+            for node in self.members[source]:
+                for edge in edges.get(node, ()):
+                    if edge.node in members:
+                        self._count(node, edge.node, edge.label, 1)
+        self._restratify(new)
+
+    def _stratum(self, component):
+        stratum = 1
+        for target, label in self.out[component]:
+            stratum = max(stratum, self.strata.get(target, 1) +
+                          (1 if label in self.labels else 0))
+        return stratum
+
+    def _restratify(self, components):
+        """Update the strata of COMPONENTS and of the components above."""
+        if self.labels is None:
+            return
+        todo = list(components)
+        while todo:
+            component = todo.pop()
+            if component not in self.members:
+                continue
+            stratum = self._stratum(component)
+            if self.strata.get(component) != stratum:
+                self.strata[component] = stratum
+                todo.extend(source for source, label in self.into[component])
 
 
 class Cycle(frozenset):
@@ -534,3 +904,23 @@ class iterstr(object):
         if self._repr_interp is None:
             self._repr_interp = "[" + ";".join(map(repr, self.iterable)) + "]"
         return self._repr_interp
+
+
+def estimate_matches(size, width, columns, indexes):
+    """Estimate how many of SIZE rows share one value for COLUMNS.
+
+    WIDTH is the number of columns of the rows and INDEXES is a dictionary
+    from column tuples to the index on those columns, keyed by value.
+    An index on exactly COLUMNS gives the average directly; otherwise
+    indexes on subsets of COLUMNS bound the estimate, and K of WIDTH
+    columns are assumed to take about SIZE ** (K / WIDTH) distinct values.
+    """
+    if not columns or not size:
+        return size
+    if columns in indexes:
+        return size / max(len(indexes[columns]), 1)
+    estimate = size / max(size ** (len(columns) / max(width, 1)), 1)
+    for indexed, index in indexes.items():
+        if set(indexed) <= set(columns):
+            estimate = min(estimate, size / max(len(index), 1))
+    return estimate
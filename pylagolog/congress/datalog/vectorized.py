@@ -0,0 +1,420 @@
+# Copyright (c) 2019 Nippon Telegraph and Telephone Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Evaluation of join plans a column at a time, with NumPy.
+
+A JoinPlan run by execute binds its slots to arrays instead of single
+values: each step joins, filters or extends all the partial answers at
+once.  Scans and negations are sort-merge joins on the key columns, and
+comparison and arithmetic builtins are NumPy operations.  Only plans
+over ColumnarFactSets are run this way.  Whenever the values do not
+allow it, e.g. strings compared with numbers or ints that may overflow
+64 bits, execute returns None and the plan is run a tuple at a time,
+which gives the exact semantics of Python values.
+"""
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+from pylagolog.congress.datalog import builtin
+from pylagolog.congress.datalog import factset
+from pylagolog.congress.datalog import joinplan
+
+try:
+    import numpy
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    numpy = None
+
+# bound of the absolute value of ints added, subtracted or multiplied, so
+#   that the result fits in 64 bits
+_INT_BOUND = 2 ** 31
+# bound of the absolute value of ints that convert exactly to floats
+_FLOAT_BOUND = 2 ** 53
+
+
+class Unsupported(Exception):
+    """The plan cannot be run on these values a column at a time."""
+
+
+def execute(plan, facts, values, counts=None):
+    """Return the set of head tuples proven by the body of PLAN, or None.
+
+    Takes the arguments of JoinPlan.execute.  Returns None if the plan
+    cannot be run a column at a time.
+    """
+    if not NUMPY_AVAILABLE or plan.steps is None:
+        return None
+    try:
+        return _Frame(plan, facts, values, counts).run()
+    except (Unsupported, TypeError, ValueError, ArithmeticError):
+        return None
+
+
+class _Frame(object):
+    """The partial answers of a plan, one array of values per slot."""
+
+    def __init__(self, plan, facts, values, counts):
+        self.plan = plan
+        self.facts = facts
+        self.counts = counts
+        self.size = 1
+        self.slots = [None] * len(plan.slots)
+        for (slot, first), value in zip(plan.inputs, values):
+            if first:
+                self.slots[slot] = _constant(value, 1)
+            elif not _equal(self.slots[slot], _constant(value, 1)).all():
+                self.size = 0
+        # dictionary from table to its live columns
+        self.tables = {}
+
+    def run(self):
+        for step in self.plan.steps:
+            if not self.size:
+                return set()
+            if isinstance(step, joinplan.Scan):
+                self.scan(step)
+            elif isinstance(step, joinplan.Negation):
+                self.negation(step)
+            else:
+                self.builtin(step)
+        if not self.size:
+            return set()
+        columns = []
+        for slot, value in self.plan.output:
+            if slot is None:
+                columns.append([value] * self.size)
+            else:
+                columns.append(self.slots[slot].tolist())
+        return set(zip(*columns))
+
+    def scan(self, step):
+        columns = self.columns(step.table)
+        if not columns:
+            self.select(numpy.arange(0))
+            return
+        rows = self._filter(step, columns, step.checks)
+        keys = [(slot, columns[column])
+                for column, (slot, value) in zip(step.columns, step.key)
+                if slot is not None]
+        if keys:
+            mine, theirs = _join(
+                [self.slots[slot] for slot, column in keys],
+                [column[rows] for slot, column in keys])
+        else:
+            # cross product
+            mine = numpy.repeat(numpy.arange(self.size), len(rows))
+            theirs = numpy.tile(numpy.arange(len(rows)), self.size)
+        rows = rows[theirs]
+        self.select(mine)
+        for column, slot in step.binds:
+            self.slots[slot] = columns[column][rows]
+        if self.counts is not None:
+            table_counts = self.counts(step.table)
+            if step.columns:
+                table_counts['index_hits'] += 1
+            table_counts['facts_scanned'] += len(columns[0])
+            table_counts['facts_returned'] += len(rows)
+
+    def negation(self, step):
+        if self.counts is not None:
+            self.counts(step.table)['negations'] += self.size
+        columns = self.columns(step.table)
+        if not columns:
+            return
+        rows = self._filter(step, columns, ())
+        keys = [(slot, columns[column])
+                for column, (slot, value) in enumerate(step.key)
+                if slot is not None]
+        if not keys:
+            if len(rows):
+                self.select(numpy.arange(0))
+            return
+        mine, theirs = _join([self.slots[slot] for slot, column in keys],
+                             [column[rows] for slot, column in keys])
+        found = numpy.zeros(self.size, dtype=bool)
+        found[mine] = True
+        self.select(numpy.flatnonzero(~found))
+
+    def builtin(self, step):
+        if self.counts is not None:
+            self.counts(step.table)['builtin_calls'] += self.size
+        operation = _operations().get(step.code)
+        if operation is None:
+            raise Unsupported(step.table)
+        args = [_constant(value, self.size) if slot is None
+                else self.slots[slot] for slot, value in step.inputs]
+        result, valid = operation(*args)
+        if step.outputs is None:
+            valid = valid & result
+        else:
+            (slot, value, bind), = step.outputs
+            if not bind:
+                known = (_constant(value, self.size) if slot is None
+                         else self.slots[slot])
+                valid = valid & _equal(known, result)
+        rows = numpy.flatnonzero(valid)
+        if step.outputs is not None and bind:
+            self.slots[slot] = result
+        if len(rows) != self.size:
+            self.select(rows)
+
+    def select(self, rows):
+        """Keep the answers at ROWS, an array of positions."""
+        self.slots = [None if values is None else values[rows]
+                      for values in self.slots]
+        self.size = len(rows)
+
+    def columns(self, table):
+        """Return the columns of the live facts of TABLE, as arrays."""
+        columns = self.tables.get(table)
+        if columns is not None:
+            return columns
+        facts = self.facts.get(table)
+        if facts is None:
+            columns = []
+        elif not isinstance(facts, factset.ColumnarFactSet):
+            raise Unsupported(table)
+        else:
+            storage = facts.raw_columns()
+            if storage is None:
+                raise Unsupported(table)
+            live, raw = storage
+            rows = numpy.flatnonzero(numpy.frombuffer(bytes(live),
+                                                      dtype=numpy.uint8))
+            columns = [_array(column)[rows] for column in raw]
+        self.tables[table] = columns
+        return columns
+
+    def _filter(self, step, columns, checks):
+        """Return the positions of the rows matching the constants of STEP.
+
+        CHECKS are pairs of a column and the slot bound by another column
+        of the same row.
+        """
+        size = len(columns[0]) if columns else 0
+        valid = numpy.ones(size, dtype=bool)
+        if isinstance(step, joinplan.Scan):
+            key = zip(step.columns, step.key)
+            bound = dict((slot, column) for column, slot in step.binds)
+        else:
+            key = enumerate(step.key)
+            bound = {}
+        for column, (slot, value) in key:
+            if slot is None:
+                valid &= _equal(columns[column], _constant(value, size))
+        for column, slot in checks:
+            valid &= _equal(columns[column], columns[bound[slot]])
+        return numpy.flatnonzero(valid)
+
+
+def _array(values):
+    """Return the column VALUES of a ColumnarFactSet as a NumPy array."""
+    if isinstance(values, list):
+        result = numpy.empty(len(values), dtype=object)
+        result[:] = values
+        return result
+    if values.typecode == 'd':
+        return numpy.frombuffer(values, dtype=numpy.float64).copy()
+    return numpy.frombuffer(
+        values, dtype='i%d' % values.itemsize).astype(numpy.int64)
+
+
+def _constant(value, size):
+    """Return an array of SIZE times VALUE, typed as its column would be."""
+    if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+        return numpy.full(size, value, dtype=numpy.int64)
+    if type(value) is float:
+        return numpy.full(size, value, dtype=numpy.float64)
+    result = numpy.empty(size, dtype=object)
+    result.fill(value)
+    return result
+
+
+def _comparable(left, right):
+    """Return LEFT and RIGHT as arrays of one dtype comparing as Python.
+
+    Ints are compared with floats as floats if they convert exactly, and
+    otherwise as Python objects.
+    """
+    if left.dtype == right.dtype:
+        return left, right
+    if right.dtype == numpy.float64 and _exact(left):
+        return left.astype(numpy.float64), right
+    if left.dtype == numpy.float64 and _exact(right):
+        return left, right.astype(numpy.float64)
+    for values in (left, right):
+        # NaNs do not sort among Python objects
+        if values.dtype == numpy.float64 and numpy.isnan(values).any():
+            raise Unsupported("NaN compared with %s" % (
+                right.dtype if values is left else left.dtype))
+    return left.astype(object), right.astype(object)
+
+
+def _exact(values):
+    """Return True if VALUES are ints that convert exactly to floats."""
+    return values.dtype == numpy.int64 and (
+        not len(values) or numpy.abs(values).max() < _FLOAT_BOUND)
+
+
+def _equal(left, right):
+    left, right = _comparable(left, right)
+    result = left == right
+    if not isinstance(result, numpy.ndarray) or result.dtype != bool:
+        raise Unsupported("comparison of %s and %s" % (left.dtype,
+                                                       right.dtype))
+    return result
+
+
+def _codes(left, right):
+    """Return arrays of ints equal where the values of LEFT and RIGHT are.
+
+    NaNs, which equal nothing, get codes of their own.
+    """
+    left, right = _comparable(left, right)
+    values = numpy.concatenate([left, right])
+    if values.dtype == object:
+        # Python objects are numbered by hash rather than sorted, which
+        #   is faster and equates them as == does
+        numbers = {}
+        codes = numpy.fromiter(
+            (numbers.setdefault(value, len(numbers)) for value in values),
+            dtype=numpy.int64, count=len(values))
+        if any(value != value for value in numbers):
+            raise Unsupported("NaN in a key")
+    else:
+        unique, codes = numpy.unique(values, return_inverse=True)
+        codes = codes.reshape(-1)
+        if values.dtype == numpy.float64:
+            nans = numpy.flatnonzero(numpy.isnan(values))
+            codes[nans] = len(unique) + numpy.arange(len(nans))
+    return codes[:len(left)], codes[len(left):]
+
+
+def _join(mine, theirs):
+    """Match the key columns MINE with the key columns THEIRS.
+
+    Returns a pair of arrays of the same length: for each pair of rows
+    with equal keys, the position of the row in MINE and in THEIRS.
+    """
+    left = right = None
+    for mine_column, their_column in zip(mine, theirs):
+        left_codes, right_codes = _codes(mine_column, their_column)
+        if left is None:
+            left, right = left_codes, right_codes
+        else:
+            # combine the codes of the columns, then number them densely
+            width = max(left_codes.max(initial=0),
+                        right_codes.max(initial=0)) + 1
+            left, right = _codes(left * width + left_codes,
+                                 right * width + right_codes)
+    order = numpy.argsort(right, kind='stable')
+    ordered = right[order]
+    low = numpy.searchsorted(ordered, left, side='left')
+    high = numpy.searchsorted(ordered, left, side='right')
+    matches = high - low
+    total = int(matches.sum())
+    mine_rows = numpy.repeat(numpy.arange(len(left)), matches)
+    starts = numpy.repeat(low - (numpy.cumsum(matches) - matches), matches)
+    their_rows = order[starts + numpy.arange(total)]
+    return mine_rows, their_rows
+
+
+def _numeric(*args):
+    """Raise Unsupported unless ARGS are all ints or all floats."""
+    dtypes = set(arg.dtype for arg in args)
+    if len(dtypes) != 1 or dtypes.pop() not in (numpy.int64, numpy.float64):
+        raise Unsupported("arithmetic on %s" % [arg.dtype for arg in args])
+
+
+def _bounded(*args):
+    """Raise Unsupported if the int ARGS may overflow when combined."""
+    for arg in args:
+        if (arg.dtype == numpy.int64 and len(arg) and
+                numpy.abs(arg).max() >= _INT_BOUND):
+            raise Unsupported("ints too large")
+
+
+def _valid(result):
+    return numpy.ones(len(result), dtype=bool)
+
+
+def _comparison(function):
+    def compare(x, y):
+        x, y = _comparable(x, y)
+        result = function(x, y)
+        if result.dtype != bool:
+            result = result.astype(bool)
+        return result, _valid(result)
+    return compare
+
+
+def _arithmetic(function):
+    def compute(x, y):
+        _numeric(x, y)
+        _bounded(x, y)
+        result = function(x, y)
+        return result, _valid(result)
+    return compute
+
+
+def _maximum(x, y):
+    _numeric(x, y)
+    if x.dtype == numpy.float64 and (numpy.isnan(x).any() or
+                                     numpy.isnan(y).any()):
+        raise Unsupported("max of NaN")
+    result = numpy.maximum(x, y)
+    return result, _valid(result)
+
+
+def _divide(x, y):
+    # builtin div divides ints with // and rows dividing by zero fail
+    _numeric(x, y)
+    valid = y != 0
+    divisor = numpy.where(valid, y, 1)
+    if x.dtype == numpy.int64:
+        if len(x) and ((x == -2 ** 63) & (y == -1)).any():
+            raise Unsupported("ints too large")
+        return numpy.floor_divide(x, divisor), valid
+    return numpy.true_divide(x, divisor), valid
+
+
+_OPERATIONS = None
+
+
+def _operations():
+    """Return the dictionary from builtin code to its vectorized form."""
+    global _OPERATIONS
+    if _OPERATIONS is None:
+        vectorized = {
+            'lt': _comparison(numpy.less),
+            'lteq': _comparison(numpy.less_equal),
+            'equal': _comparison(numpy.equal),
+            'gt': _comparison(numpy.greater),
+            'gteq': _comparison(numpy.greater_equal),
+            'max': _maximum,
+            'plus': _arithmetic(numpy.add),
+            'minus': _arithmetic(numpy.subtract),
+            'mul': _arithmetic(numpy.multiply),
+            'div': _divide}
+        operations = {}
+        for name, operation in vectorized.items():
+            pred = builtin.builtin_registry.preddict.get(name)
+            if pred is not None:
+                operations[pred[0].code] = operation
+        _OPERATIONS = operations
+    return _OPERATIONS
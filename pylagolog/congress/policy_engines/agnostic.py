@@ -17,6 +17,11 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
 
+import collections
+import copy
+import hashlib
+import sys
+import threading
 import time
 
 import eventlet
@@ -29,10 +34,14 @@ import six
 from six.moves import range
 
 from pylagolog.congress.datalog import base
+from pylagolog.congress.datalog import bottomup
 from pylagolog.congress.datalog import compile
 from pylagolog.congress.datalog import database as db
+from pylagolog.congress.datalog import factset
+from pylagolog.congress.datalog import loader
 from pylagolog.congress.datalog import materialized
 from pylagolog.congress.datalog import nonrecursive
+from pylagolog.congress.datalog import snapshot
 from pylagolog.congress.datalog import unify
 from pylagolog.congress.datalog import utility
 from pylagolog.congress.db import api as db_api
@@ -90,14 +99,26 @@ def string_to_database(string, theories=None):
 # Runtime
 ##############################################################################
 
+def _row_literal(table, modal, row):
+    """Return the Literal for the tuple ROW of TABLE under MODAL."""
+    return compile.Literal(
+        compile.Tablename(table, modal=modal),
+        [compile.Term.create_from_python(value) for value in row])
+
+
 class Trigger(object):
-    """A chunk of code that should be run when a table's contents changes."""
+    """A chunk of code that should be run when a table's contents changes.
 
-    def __init__(self, tablename, policy, callback, modal=None):
+    The CALLBACK is given the table and either its old and new contents
+    or, if DELTA is True, only the rows added to and removed from it.
+    """
+
+    def __init__(self, tablename, policy, callback, modal=None, delta=False):
         self.tablename = tablename
         self.policy = policy
         self.callback = callback
         self.modal = modal
+        self.delta = delta
 
     def __str__(self):
         return "Trigger on table=%s; policy=%s; modal=%s with callback %s." % (
@@ -117,12 +138,21 @@ class TriggerRegistry(object):
         # map from table to triggers relevant to changes for that table
         self.index = {}
 
-    def register_table(self, tablename, policy, callback, modal=None):
+        # map from each table with triggers to the set of tables it
+        #   depends on, i.e. its transitive closure in dependency_graph
+        self.closures = {}
+
+        # map from each table with triggers to those triggers
+        self.table_triggers = {}
+
+    def register_table(self, tablename, policy, callback, modal=None,
+                       delta=False):
         """Register CALLBACK to run when TABLENAME changes."""
         # TODO(thinrichs): either fix dependency graph to differentiate
         #   between execute[alice:p] and alice:p or reject rules
         #   in which both occur
-        trigger = Trigger(tablename, policy, callback, modal=modal)
+        trigger = Trigger(tablename, policy, callback, modal=modal,
+                          delta=delta)
         self.triggers.add(trigger)
         self._add_indexes(trigger)
         LOG.info("registered trigger: %s", trigger)
@@ -138,35 +168,99 @@ class TriggerRegistry(object):
 
         Changes are accounted for in self.dependency_graph, but
         by giving the list of changes we can avoid recomputing
-        all dependencies from scratch.
+        all dependencies from scratch.  Each change is in the format
+        returned by RuleDependencyGraph.formula_update.
         """
-        # TODO(thinrichs): instead of destroying the index and
-        #   recomputing from scratch, look at the changes and
-        #   figure out the delta.
-        self.index = {}
-        for trigger in self.triggers:
-            self._add_indexes(trigger)
+        if dependency_graph_changes is None:
+            self.index = {}
+            self.closures = {}
+            for trigger in self.triggers:
+                self._add_indexes(trigger)
+            return
+        stale = set()
+        for change in dependency_graph_changes:
+            if change[0] != 'edge':
+                continue
+            src, dst, is_insert = change[1], change[2], change[4]
+            if is_insert:
+                # a new edge only extends the closures reaching its source
+                for table, closure in self.closures.items():
+                    if (table not in stale and src in closure and
+                            dst not in closure):
+                        added = self._reachable([dst], closure)
+                        closure |= added
+                        self._index_tables(added, self.table_triggers[table])
+            elif not any(edge.node == dst for edge in
+                         self.dependency_graph.edges.get(src, ())):
+                # a removed edge may shrink the closures going through it
+                for table, closure in self.closures.items():
+                    if src in closure and dst in closure:
+                        stale.add(table)
+        for table in stale:
+            closure = self.closures[table]
+            current = self._reachable([table])
+            triggers = self.table_triggers[table]
+            self._unindex_tables(closure - current, triggers)
+            self._index_tables(current - closure, triggers)
+            self.closures[table] = current
+
+    def dependencies(self, tables):
+        """Return the tables some table of TABLES depends on.
+
+        TABLES must be global names of tables with registered triggers.
+        """
+        result = set()
+        for table in tables:
+            result |= self.closures[table]
+        return result
 
     def _add_indexes(self, trigger):
         full_table = compile.Tablename.build_service_table(
             trigger.policy, trigger.tablename)
-        deps = self.dependency_graph.dependencies(full_table)
-        if deps is None:
-            deps = set([full_table])
-        for table in deps:
-            if table in self.index:
-                self.index[table].add(trigger)
-            else:
-                self.index[table] = set([trigger])
+        if full_table not in self.closures:
+            self.closures[full_table] = self._reachable([full_table])
+            self.table_triggers[full_table] = set()
+        self.table_triggers[full_table].add(trigger)
+        self._index_tables(self.closures[full_table], [trigger])
 
     def _delete_indexes(self, trigger):
         full_table = compile.Tablename.build_service_table(
             trigger.policy, trigger.tablename)
-        deps = self.dependency_graph.dependencies(full_table)
-        if deps is None:
-            deps = set([full_table])
-        for table in deps:
-            self.index[table].discard(trigger)
+        self._unindex_tables(self.closures[full_table], [trigger])
+        self.table_triggers[full_table].discard(trigger)
+        if not self.table_triggers[full_table]:
+            del self.table_triggers[full_table]
+            del self.closures[full_table]
+
+    def _index_tables(self, tables, triggers):
+        for table in tables:
+            if table in self.index:
+                self.index[table] |= set(triggers)
+            else:
+                self.index[table] = set(triggers)
+
+    def _unindex_tables(self, tables, triggers):
+        for table in tables:
+            self.index[table] -= set(triggers)
+            if not self.index[table]:
+                del self.index[table]
+
+    def _reachable(self, tables, known=()):
+        """Return the tables reachable from TABLES but not through KNOWN.
+
+        Unlike Graph.dependencies, only the nodes reached are visited.
+        """
+        reached = set()
+        stack = [table for table in tables if table not in known]
+        while stack:
+            table = stack.pop()
+            if table in reached:
+                continue
+            reached.add(table)
+            for edge in self.dependency_graph.edges.get(table, ()):
+                if edge.node not in reached and edge.node not in known:
+                    stack.append(edge.node)
+        return reached
 
     def relevant_triggers(self, events):
         """Return the set of triggers that are relevant to the EVENTS.
@@ -212,6 +306,126 @@ class TriggerRegistry(object):
         return d
 
 
+class ResultCache(object):
+    """Bounded LRU cache of the answers to queries.
+
+    Each entry is keyed by the name of the policy queried and the text
+    of the query, and remembers the tables the answers were computed
+    from: the tables of the query and every table they depend on
+    through rules.  Changing any of those tables drops the entry.
+    Entries are kept within MEMORY bytes, as estimated by answers_size,
+    and the least recently used ones are dropped first.
+
+    VERSION counts the invalidations, so that answers computed while a
+    table they depend on changed are not kept.
+    """
+
+    def __init__(self, memory=64 * 1024 * 1024):
+        self.memory = memory
+        self.version = 0
+        # dict from key to (answers, tables, size)
+        self._entries = collections.OrderedDict()
+        # dict from table to the keys of the entries depending on it
+        self._by_table = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the answers cached for KEY, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, answers, tables, version):
+        """Cache ANSWERS for KEY, computed from TABLES.
+
+        Nothing is cached if the cache was invalidated since VERSION.
+        """
+        size = self.answers_size(answers)
+        if size > self.memory:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._remove(key)
+            self._entries[key] = (answers, tables, size)
+            self._size += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while self._size > self.memory:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tables):
+        """Drop the entries depending on any of TABLES."""
+        with self._lock:
+            self.version += 1
+            for table in tables:
+                for key in list(self._by_table.get(table, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._by_table.clear()
+            self._size = 0
+
+    def stats(self):
+        """Return a dictionary of the counts of the cache."""
+        return {'entries': len(self._entries), 'size': self._size,
+                'memory': self.memory, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        answers, tables, size = entry
+        self._size -= size
+        for table in tables:
+            keys = self._by_table[table]
+            keys.discard(key)
+            if not keys:
+                del self._by_table[table]
+
+    @staticmethod
+    def answers_size(answers):
+        """Estimate the bytes taken by ANSWERS.
+
+        ANSWERS is a string or a collection of formulas, whose size is
+        estimated from one of them.
+        """
+        if isinstance(answers, six.string_types):
+            return sys.getsizeof(answers)
+        size = sys.getsizeof(answers)
+        for answer in answers:
+            if isinstance(answer, compile.Literal):
+                each = (sys.getsizeof(answer) +
+                        sys.getsizeof(answer.arguments) +
+                        sum(sys.getsizeof(arg) + sys.getsizeof(arg.name)
+                            for arg in answer.arguments))
+            else:
+                each = 3 * sys.getsizeof(str(answer))
+            size += each * len(answers)
+            break
+        return size
+
+
 class Runtime (object):
     """Runtime for the Congress policy language.
 
@@ -225,6 +439,8 @@ class Runtime (object):
     def __init__(self):
         # tracer object
         self.tracer = base.Tracer()
+        # profiler shared by all theories, or None (see profile)
+        self.profiler = None
         # record execution
         self.logger = ExecutionLogger()
         # collection of theories
@@ -243,6 +459,8 @@ class Runtime (object):
         # rules with errors (because of schema inconsistencies)
         self.error_events = []
         self.synchronizer = None
+        # answers to queries, or None (see set_result_cache)
+        self.result_cache = None
 
     ###############################################
     # Persistence layer
@@ -576,6 +794,159 @@ class Runtime (object):
                 [parsed_rule],
                 rule.policy_name)
 
+    def save_snapshot(self, path, db=False):
+        """Write the state of all the policies to the snapshot file PATH.
+
+        The snapshot holds the policies, their rules, the facts of their
+        tables, the indexes on those and the dependency graph, in the
+        format of datalog.snapshot.  Only policies keeping their facts in
+        a RuleSet, i.e. of the nonrecursive kinds and bottom-up, can be
+        saved.  With DB, it also records a digest of the policies and
+        rules in the database, for load_snapshot to check.
+        """
+        for th in self.theory.values():
+            if not isinstance(th, nonrecursive.NonrecursiveRuleTheory):
+                raise exception.PolicyException(
+                    "Cannot snapshot policy %s of kind %s" %
+                    (th.name, th.kind))
+        header = {'policies': [],
+                  'dependency_graph': self._graph_snapshot()}
+        if db:
+            header['db_digest'] = self._db_digest()
+        writer = snapshot.SnapshotWriter(path)
+        try:
+            for name in sorted(self.theory):
+                th = self.theory[name]
+                header['policies'].append({
+                    'name': name, 'abbr': th.abbr, 'kind': th.kind,
+                    'id': th.id, 'desc': th.desc, 'owner': th.owner,
+                    'columnar': (th.rules.factset_class is
+                                 factset.ColumnarFactSet),
+                    'vectorized': th.vectorized,
+                    'tabling': [th.tabling, th.persistent_tabling],
+                    'schema': self._schema_snapshot(th.schema),
+                    'rules': [{'rule': str(rule), 'id': rule.id,
+                               'name': rule.name, 'comment': rule.comment,
+                               'original_str': rule.original_str}
+                              for rules in th.rules.rules.values()
+                              for rule in rules],
+                    'tables': snapshot.write_tables(writer, th.rules)})
+            writer.close(header)
+        except Exception:
+            writer.abort()
+            raise
+        LOG.info("Saved snapshot of %d policies to %s",
+                 len(header['policies']), path)
+
+    def load_snapshot(self, path, check_db=False):
+        """Create the policies saved in the snapshot file PATH.
+
+        None of the policies may exist already.  Rules are parsed again,
+        while facts are read from the columns of the snapshot.  Without
+        other policies, the dependency graph of the rules must be the one
+        saved.  With CHECK_DB, the policies and rules in the database
+        must be those recorded by save_snapshot; otherwise
+        PolicyException is raised before anything changes, and the
+        policies must be loaded from the database instead.
+        """
+        reader = snapshot.SnapshotReader(path)
+        try:
+            header = reader.header
+            names = [policy['name'] for policy in header['policies']]
+            existing = [name for name in names if name in self.theory]
+            if existing:
+                raise exception.PolicyException(
+                    "Cannot load snapshot %s over existing policies %s" %
+                    (path, ", ".join(existing)))
+            if check_db and header.get('db_digest') != self._db_digest():
+                raise exception.PolicyException(
+                    "Snapshot %s does not match the database" % path)
+            try:
+                self._load_snapshot(reader, header)
+            except Exception:
+                for name in names:
+                    if name in self.theory:
+                        self.delete_policy(name)
+                raise
+        finally:
+            reader.close()
+        LOG.info("Loaded snapshot of %d policies from %s", len(names), path)
+
+    def _load_snapshot(self, reader, header):
+        for policy in header['policies']:
+            th = self.create_policy(
+                policy['name'], abbr=policy['abbr'], kind=policy['kind'],
+                id_=policy['id'], desc=policy['desc'], owner=policy['owner'])
+            th.set_columnar(policy['columnar'])
+            th.set_vectorized(policy['vectorized'])
+            th.set_tabling(*policy['tabling'])
+        events = []
+        for policy in header['policies']:
+            for saved in policy['rules']:
+                rule = self.parse1(saved['rule'])
+                rule.set_id(saved['id'])
+                rule.set_name(saved['name'])
+                rule.set_comment(saved['comment'])
+                rule.set_original_str(saved['original_str'])
+                events.append(compile.Event(
+                    formula=rule, insert=True, target=policy['name']))
+        if events:
+            permitted, errors = self.update(events)
+            if not permitted:
+                raise exception.PolicyException(
+                    ";".join(str(e) for e in errors))
+        tables = set()
+        for policy in header['policies']:
+            th = self.theory[policy['name']]
+            snapshot.read_tables(reader, policy['tables'], th.rules)
+            if policy['schema'] is not None:
+                schema = policy['schema']
+                th.schema = compile.Schema(schema['map'],
+                                           complete=schema['complete'])
+                th.schema.count = schema['count']
+            tables |= set(compile.Tablename.build_service_table(
+                          th.name, entry['table'])
+                          for entry in policy['tables'])
+        if (len(self.theory) == len(header['policies']) and
+                self._graph_snapshot() != header['dependency_graph']):
+            raise exception.PolicyException(
+                "Dependency graph of snapshot %s differs from the one of "
+                "its rules" % reader.path)
+        self._tables_changed(tables)
+
+    def _graph_snapshot(self):
+        """Return the nodes and edges of the global dependency graph."""
+        graph = self.global_dependency_graph
+        edges = []
+        for src in graph.edges:
+            for edge in graph.edges[src]:
+                edges.append([src, edge.node, edge.label,
+                              graph.edge_count(src, edge.node, edge.label)])
+        return {'nodes': sorted([node, graph.node_count(node)]
+                                for node in graph.nodes),
+                'edges': sorted(edges, key=str)}
+
+    @staticmethod
+    def _schema_snapshot(schema):
+        if schema is None:
+            return None
+        return {'map': schema.map, 'count': schema.count,
+                'complete': schema.complete}
+
+    # Note(thread-safety): blocking function
+    def _db_digest(self):
+        """Return a digest of the policies and rules in the database."""
+        digest = hashlib.sha256()
+        for policy in sorted(db_policy_rules.get_policies(),
+                             key=lambda p: p.id):
+            digest.update(('policy %s %s %s\n' % (
+                policy.id, policy.name, policy.kind)).encode('utf-8'))
+        for rule in sorted(db_policy_rules.get_policy_rules(),
+                           key=lambda r: r.id):
+            digest.update(('rule %s %s %s\n' % (
+                rule.id, rule.policy_name, rule.rule)).encode('utf-8'))
+        return digest.hexdigest()
+
     def _safe_process_policy_update(self, parsed_rules, policy_name,
                                     insert=True, persistent=False):
         if policy_name not in self.theory:
@@ -618,6 +989,8 @@ class Runtime (object):
             kind = kind.lower()
         if kind == base.NONRECURSIVE_POLICY_TYPE:
             PolicyClass = nonrecursive.NonrecursiveRuleTheory
+        elif kind == base.BOTTOMUP_POLICY_TYPE:
+            PolicyClass = bottomup.BottomUpTheory
         elif kind == base.ACTION_POLICY_TYPE:
             PolicyClass = nonrecursive.ActionTheory
         elif kind == base.DATABASE_POLICY_TYPE:
@@ -639,6 +1012,7 @@ class Runtime (object):
                                  desc=desc, owner=owner)
         policy_obj.set_id(id_)
         policy_obj.set_tracer(self.tracer)
+        policy_obj.set_profiler(self.profiler)
         return policy_obj
 
     def add_policy_obj_to_runtime(self, policy_obj):
@@ -647,6 +1021,7 @@ class Runtime (object):
         if name in self.theory:
             raise KeyError("Policy with name %s already exists" % name)
         self.theory[name] = policy_obj
+        self._policies_changed()
         LOG.debug("Added to runtime policy <%s> with abbr <%s> and kind <%s>",
                   policy_obj.name, policy_obj.abbr, policy_obj.kind)
 
@@ -708,6 +1083,7 @@ class Runtime (object):
             self.theory[name].drop()
         # actually delete the theory
         del self.theory[name]
+        self._policies_changed()
 
     def rename_policy(self, oldname, newname):
         """Renames policy OLDNAME to NEWNAME or raises KeyError."""
@@ -720,6 +1096,7 @@ class Runtime (object):
         except KeyError:
             raise KeyError('Cannot rename %s to %s: %s does not exist' %
                            (oldname, newname, oldname))
+        self._policies_changed()
 
     # TODO(thinrichs): make Runtime act like a dictionary so that we
     #   can iterate over policy names (keys), check if a policy exists, etc.
@@ -836,20 +1213,60 @@ class Runtime (object):
         triggers = self.trigger_registry.relevant_triggers(alltables)
         LOG.info("relevant triggers (init): %s",
                  ";".join(str(x) for x in triggers))
-        # run queries on relevant triggers *before* applying changes
         table_triggers = self.trigger_registry.triggers_by_table(triggers)
-        table_data_old = self._compute_table_contents(table_triggers)
+        table_deltas = None
+        if table_triggers:
+            facts = list(facts)
+            events = self._initialization_events(
+                target_theory, tablenames, facts)
+            if events is not None:
+                order = self._propagation_order(events, table_triggers)
+                if order is not None:
+                    table_deltas = self._propagate_events(
+                        events, order, table_triggers)
+        # without incremental propagation, run queries on relevant triggers
+        #   *before* applying changes
+        if table_deltas is None:
+            table_data_old = self._compute_table_contents(table_triggers)
         # actually apply the updates
         target_theory.initialize_tables(tablenames, facts)
-        # rerun the trigger queries to check for changes
-        table_data_new = self._compute_table_contents(table_triggers)
-        # run triggers if tables changed
-        for table, triggers in table_triggers.items():
-            if table_data_old[table] != table_data_new[table]:
-                for trigger in triggers:
-                    trigger.callback(table,
-                                     table_data_old[table],
-                                     table_data_new[table])
+        self._tables_changed(alltables)
+        if table_deltas is None:
+            self._run_triggers(table_triggers, table_data_old)
+        else:
+            self._run_triggers(table_triggers, None, table_deltas)
+
+    def load_facts(self, table, rows, target=None, format=None):
+        """Replace the contents of TABLE with the facts ROWS.
+
+        ROWS is either an iterable of tuples of values (strings, ints and
+        floats), or the path of a CSV, TSV or JSON Lines file read by
+        loader.read_rows, whose FORMAT defaults to the one of its
+        extension.  The rows bypass the Datalog parser and are streamed
+        into the policy, so they are only held in memory all at once when
+        triggers depend on TABLE.  As with initialize_tables, the
+        triggers on TABLE run once.  Returns the number of rows read.
+        Only policies keeping their facts in a RuleSet, i.e. of the
+        nonrecursive kinds and bottom-up, can load facts.
+        """
+        th = self.get_target(target)
+        if th.kind not in (base.NONRECURSIVE_POLICY_TYPE,
+                           base.ACTION_POLICY_TYPE,
+                           base.DATASOURCE_POLICY_TYPE,
+                           base.BOTTOMUP_POLICY_TYPE):
+            raise exception.PolicyException(
+                "Cannot load facts into policy %s of kind %s" %
+                (th.name, th.kind))
+        if isinstance(rows, six.string_types):
+            rows = loader.read_rows(rows, format)
+        count = [0]
+
+        def facts():
+            for row in rows:
+                count[0] += 1
+                yield compile.Fact(table, row)
+        self.initialize_tables([table], facts(), target=th.name)
+        return count[0]
 
     def insert(self, formula, target=None):
         """Event handler for arbitrary insertion (rules and facts)."""
@@ -969,6 +1386,13 @@ class Runtime (object):
             raise exception.CongressException(m)
 
         gen_trace = None
+        cache = self.result_cache
+        if cache is not None and not trace:
+            key = (policy_name, 'rows', tablename)
+            rows = cache.get(key)
+            if rows is not None:
+                return [{'data': list(row)} for row in rows]
+            version = cache.version
         query = self.parse1(queries[0])
         # LOG.debug("query: %s", query)
         result = self.select(query, target=policy_name,
@@ -989,8 +1413,11 @@ class Runtime (object):
 
         if trace:
             return results, gen_trace
-        else:
-            return results
+        if cache is not None:
+            cache.put(key, tuple(tuple(d['data']) for d in results),
+                      self._query_tables(query, self.get_target(policy_name)),
+                      version)
+        return results
 
     def tablenames(self, body_only=False, include_builtin=False,
                    theory_name=None, include_modal=True):
@@ -1029,12 +1456,20 @@ class Runtime (object):
         else:
             return [modal + "[" + atom + "]"]
 
-    def register_trigger(self, tablename, callback, policy=None, modal=None):
-        """Register CALLBACK to run when table TABLENAME changes."""
+    def register_trigger(self, tablename, callback, policy=None, modal=None,
+                         delta=False):
+        """Register CALLBACK to run when table TABLENAME changes.
+
+        CALLBACK is called with the table, given as a (tablename, policy,
+        modal) triple, and two sets of Literals: the old and the new
+        contents of the table or, if DELTA is True, the rows added to and
+        the rows removed from it.
+        """
         # calling self.get_target_name to check if policy actually exists
         #   and to resolve None to a policy name
         return self.trigger_registry.register_table(
-            tablename, self.get_target_name(policy), callback, modal=modal)
+            tablename, self.get_target_name(policy), callback, modal=modal,
+            delta=delta)
 
     def unregister_trigger(self, trigger):
         """Unregister CALLBACK for table TABLENAME."""
@@ -1229,16 +1664,19 @@ class Runtime (object):
         # update dependency graph (and undo it if errors)
         graph_changes = self.global_dependency_graph.formula_update(
             events, include_atoms=False)
-        if graph_changes:
-            if (self.global_dependency_graph.has_cycle() and
+        graph = self.global_dependency_graph
+        if graph_changes and graph.has_cycle():
+            components = bottomup.cycles_outside_bottomup(
+                self.theory, graph.recursive_components())
+            if (components and
                 (not z3types.Z3_AVAILABLE or
-                 z3theory.cycle_not_contained_in_z3(
-                     self.theory,
-                     self.global_dependency_graph.cycles()))):
-                # TODO(thinrichs): include path
+                 z3theory.cycle_not_contained_in_z3(self.theory,
+                                                    components))):
+                cycle = graph.find_cycle(min(components[0]))
                 errors.append(exception.PolicyException(
-                    "Rules are recursive"))
-                self.global_dependency_graph.undo_changes(graph_changes)
+                    "Rules are recursive: %s" %
+                    " -> ".join(cycle)))
+                graph.undo_changes(graph_changes)
         if len(errors) > 0:
             return (False, errors)
         # modify execution triggers
@@ -1250,28 +1688,64 @@ class Runtime (object):
         # signal trigger registry about graph updates
         self.trigger_registry.update_dependencies(graph_changes)
 
-        # run queries on relevant triggers *before* applying changes
         table_triggers = self.trigger_registry.triggers_by_table(triggers)
-        table_data_old = self._compute_table_contents(table_triggers)
+        table_deltas = None
+        if table_triggers:
+            order = self._propagation_order(events, table_triggers)
+            if order is not None:
+                table_deltas = self._propagate_events(
+                    events, order, table_triggers)
+        # without incremental propagation, run queries on relevant triggers
+        #   *before* applying changes
+        if table_deltas is None:
+            table_data_old = self._compute_table_contents(table_triggers)
         # actually apply the updates
         changes = []
         for th, th_events in by_theory.items():
-            changes.extend(self.get_target(th).update(events))
-        # rerun the trigger queries to check for changes
-        table_data_new = self._compute_table_contents(table_triggers)
-        # run triggers if tables changed
-        for table, triggers in table_triggers.items():
-            if table_data_old[table] != table_data_new[table]:
-                for trigger in triggers:
-                    trigger.callback(table,
-                                     table_data_old[table],
-                                     table_data_new[table])
+            changes.extend(self.get_target(th).update(th_events))
+        self._tables_changed(events)
+        if table_deltas is None:
+            self._run_triggers(table_triggers, table_data_old)
+        else:
+            self._run_triggers(table_triggers, None, table_deltas)
         # return non-error and the list of changes
         return (True, changes)
 
     def _maintain_triggers(self):
         pass
 
+    def _tables_changed(self, events):
+        """Tell every theory which tables EVENTS changed.
+
+        Each EVENT may either be a compile.Event or a global tablename.
+        """
+        tables = set()
+        for event in events:
+            if isinstance(event, compile.Event):
+                if compile.is_rule(event.formula):
+                    tables |= set(
+                        [lit.table.global_tablename(event.target)
+                         for lit in event.formula.heads])
+                else:
+                    tables.add(
+                        event.formula.table.global_tablename(event.target))
+            else:
+                tables.add(event)
+        if self.result_cache is not None:
+            self.result_cache.invalidate(tables)
+        theories = [th for th in self.theory.values()
+                    if th.has_cached_results()]
+        if not theories:
+            return
+        tables = self.global_dependency_graph.find_dependent_nodes(tables)
+        for th in theories:
+            th.tables_changed(tables)
+
+    def _policies_changed(self):
+        """Drop the cached answers when policies are added or removed."""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
     def _actual_events(self, events):
         actual = []
         for event in events:
@@ -1290,6 +1764,221 @@ class Runtime (object):
                 data[(table, policy, modal)] |= ans
         return data
 
+    def _run_triggers(self, table_triggers, table_data_old,
+                      table_deltas=None):
+        """Run the triggers of the tables that changed.
+
+        TABLE_TRIGGERS maps each table to its triggers.  The changes are
+        either TABLE_DELTAS, a dictionary from each table to the pair of
+        sets of rows added to and removed from it, or the difference
+        between TABLE_DATA_OLD, the contents of the tables before the
+        update, and their current contents.
+        """
+        if table_deltas is None:
+            table_data_new = self._compute_table_contents(table_triggers)
+            table_deltas = {}
+            for table in table_triggers:
+                old = table_data_old[table]
+                new = table_data_new[table]
+                table_deltas[table] = (new - old, old - new)
+        for table, triggers in table_triggers.items():
+            added, removed = table_deltas[table]
+            if not added and not removed:
+                continue
+            if any(not trigger.delta for trigger in triggers):
+                if table_data_old is None:
+                    new = self._compute_table_contents([table])[table]
+                    old = (new - added) | removed
+                else:
+                    old = table_data_old[table]
+                    new = table_data_new[table]
+            for trigger in triggers:
+                if trigger.delta:
+                    trigger.callback(table, added, removed)
+                else:
+                    trigger.callback(table, old, new)
+
+    def _initialization_events(self, theory, tablenames, facts):
+        """Return the fact events turning TABLENAMES into FACTS.
+
+        Returns None if initializing the tables also deletes rules.
+        """
+        for table in tablenames:
+            if self.global_dependency_graph.edges.get(
+                    compile.Tablename.build_service_table(theory.name, table)):
+                return None
+        old = set()
+        for formula in theory.content(tablenames):
+            if compile.is_atom(formula):
+                old.add(formula)
+            elif not formula.body:
+                old.add(formula.head)
+        new = set(compile.Literal.create_from_table_tuple(fact.table, fact)
+                  for fact in facts if fact.table in tablenames)
+        return ([compile.Event(formula=atom, insert=False, target=theory.name)
+                 for atom in old - new] +
+                [compile.Event(formula=atom, insert=True, target=theory.name)
+                 for atom in new - old])
+
+    def _propagation_order(self, events, table_triggers):
+        """Return the derived tables to propagate EVENTS through.
+
+        The result is a list of levels, each a list of triples (global
+        tablename, theory, rules defining the table), such that the rules
+        of a level only read tables changed by EVENTS or by the levels
+        before.  Only the tables between EVENTS and the tables of
+        TABLE_TRIGGERS are included.  Returns None if the triggered tables
+        must be recomputed instead: when EVENTS change rules, or when a
+        table in between is recursive, reads modals or belongs to a theory
+        unable to list its rules.
+        """
+        if not all(compile.is_atom(event.formula) for event in events):
+            return None
+        graph = self.global_dependency_graph
+        changed = set(event.formula.table.global_tablename(event.target)
+                      for event in events)
+        triggered = set(compile.Tablename.build_service_table(policy, table)
+                        for table, policy, modal in table_triggers)
+        relevant = (graph.find_dependent_nodes(changed) &
+                    self.trigger_registry.dependencies(triggered))
+        levels = {}
+        visiting = set()
+
+        def visit(node):
+            """Compute the level of NODE and return False on a cycle."""
+            if node in levels:
+                return True
+            if node in visiting:
+                return False
+            visiting.add(node)
+            level = 0
+            for edge in graph.edges.get(node, ()):
+                if edge.node in relevant:
+                    if not visit(edge.node):
+                        return False
+                    level = max(level, levels[edge.node] + 1)
+            levels[node] = level
+            return True
+
+        by_level = {}
+        for node in relevant:
+            if not graph.edges.get(node):
+                continue
+            if not visit(node):
+                return None
+            policy, table = compile.Tablename.parse_service_table(node)
+            theory = self.theory.get(policy)
+            if theory is None:
+                return None
+            rules = theory.rules_defining(table)
+            if rules is None:
+                return None
+            for rule in rules:
+                if any(lit.table.modal is not None for lit in rule.body):
+                    return None
+            by_level.setdefault(levels[node], []).append(
+                (node, theory, rules))
+        return [by_level[level] for level in sorted(by_level)]
+
+    def _propagate_events(self, events, order, table_triggers):
+        """Return the rows EVENTS will add to and remove from triggered tables.
+
+        Called before EVENTS are applied, with the ORDER computed by
+        _propagation_order.  As MaterializedViewTheory does for its views,
+        every rule reading a changed row is evaluated with that row bound.
+        This is done in the current state, and in the state after EVENTS,
+        which is built in overlays of the policies (see _overlay) so that
+        the policies themselves are left untouched.  An answer found in
+        one state is a changed row if it does not hold in the other one.
+        Returns a dictionary from each table of TABLE_TRIGGERS to the pair
+        of sets of Literals added to and removed from it, or None if some
+        policy cannot be overlaid.
+        """
+        overlay = self._overlay()
+        if overlay is None:
+            return None
+        overlay._apply_fact_events(events)
+        # dictionary from global tablename to the pair of sets of
+        #   (modal, row) pairs added to and removed from the table
+        deltas = {}
+        for event in events:
+            atom = event.formula
+            table = atom.table.global_tablename(event.target)
+            if table not in deltas:
+                deltas[table] = (set(), set())
+            deltas[table][0 if event.insert else 1].add(
+                (atom.table.modal, tuple(arg.name for arg in atom.arguments)))
+        for level in order:
+            changed = dict((table, added | removed)
+                           for table, (added, removed) in deltas.items())
+            for node, theory, rules in level:
+                updated = overlay.theory[theory.name]
+                before = self._rule_answers(theory, node, rules, changed)
+                after = self._rule_answers(updated, node, rules, changed)
+                unknown = (after | changed.get(node, set())) - before
+                old = before | set(row for row in unknown
+                                   if self._row_holds(theory, node, row))
+                unknown = (before | changed.get(node, set())) - after
+                new = after | set(row for row in unknown
+                                  if self._row_holds(updated, node, row))
+                deltas[node] = (new - old, old - new)
+        results = {}
+        for table, policy, modal in table_triggers:
+            added, removed = deltas.get(
+                compile.Tablename.build_service_table(policy, table),
+                (set(), set()))
+            results[(table, policy, modal)] = tuple(
+                set(_row_literal(table, modal, row)
+                    for row_modal, row in rows if row_modal == modal)
+                for rows in (added, removed))
+        return results
+
+    def _rule_answers(self, theory, node, rules, changed):
+        """Return the rows of NODE that RULES prove from CHANGED rows.
+
+        CHANGED is a dictionary from global tablename to (modal, row)
+        pairs.  Each literal of the body of RULES is bound in turn to the
+        changed rows of its table before the body is evaluated in THEORY.
+        Returns a set of (modal, row) pairs.
+        """
+        policy, table = compile.Tablename.parse_service_table(node)
+        answers = set()
+        for rule in rules:
+            heads = [head for head in rule.heads if head.table.table == table]
+            for i, lit in enumerate(rule.body):
+                if lit.is_builtin():
+                    continue
+                rows = changed.get(lit.tablename(policy))
+                if not rows:
+                    continue
+                body = [lit] + rule.body[:i] + rule.body[i + 1:]
+                for modal, row in rows:
+                    binding = theory.new_bi_unifier(
+                        slots=rule.variable_slots())
+                    if (modal is not None or
+                            unify.match_values(lit, binding, row) is None):
+                        continue
+                    for answer in theory.top_down_evaluation(
+                            rule.variables(), body, binding=binding):
+                        for head in heads:
+                            atom = head.plug(answer)
+                            if atom.is_ground():
+                                answers.add((
+                                    head.table.modal,
+                                    tuple(arg.name for arg in atom.arguments)))
+        return answers
+
+    def _row_holds(self, theory, node, row):
+        """Return True if the (modal, row) pair ROW is in table NODE."""
+        policy, table = compile.Tablename.parse_service_table(node)
+        return len(theory.select(_row_literal(table, row[0], row[1]),
+                                 find_all=False)) > 0
+
+    def _apply_fact_events(self, events):
+        for target, th_events in self._group_events_by_target(events).items():
+            self.get_target(target).update(th_events)
+        self._tables_changed(events)
+
     def _group_events_by_target(self, events):
         """Return mapping of targets and events.
 
@@ -1332,6 +2021,14 @@ class Runtime (object):
 
     # select
     def _select_string(self, policy_string, theory, trace):
+        cache = self.result_cache
+        if cache is not None and not trace:
+            # the answers as a string are kept under the query as given
+            key = (theory.name, 'string', policy_string)
+            answers = cache.get(key)
+            if answers is not None:
+                return answers
+            version = cache.version
         policy = self.parse(policy_string)
         assert (len(policy) == 1), (
             "Queries can have only 1 statement: {}".format(
@@ -1339,8 +2036,11 @@ class Runtime (object):
         results = self._select_obj(policy[0], theory, trace)
         if trace:
             return (compile.formulas_to_string(results[0]), results[1])
-        else:
-            return compile.formulas_to_string(results)
+        answers = compile.formulas_to_string(results)
+        if cache is not None:
+            cache.put(key, answers, self._query_tables(policy[0], theory),
+                      version)
+        return answers
 
     def _select_tuple(self, tuple, theory, trace):
         return self._select_obj(compile.Literal.create_from_iter(tuple),
@@ -1355,7 +2055,32 @@ class Runtime (object):
             value = set(theory.select(query))
             self.set_tracer(old_tracer)
             return (value, tracer.get_value())
-        return set(theory.select(query))
+        cache = self.result_cache
+        if cache is None:
+            return set(theory.select(query))
+        key = (theory.name, 'set', str(query))
+        answers = cache.get(key)
+        if answers is None:
+            version = cache.version
+            answers = frozenset(theory.select(query))
+            cache.put(key, answers, self._query_tables(query, theory),
+                      version)
+        return set(answers)
+
+    def _query_tables(self, query, theory):
+        """Return the tables the answers to QUERY in THEORY depend on."""
+        if compile.is_rule(query):
+            literals = query.body
+        else:
+            literals = [query]
+        tables = set()
+        for lit in literals:
+            if lit.is_builtin():
+                continue
+            table = lit.tablename(theory.name)
+            tables |= (self.global_dependency_graph.dependencies(table) or
+                       set([table]))
+        return tables
 
     # simulate
     def _simulate_string(self, query, theory, sequence, action_theory, delta,
@@ -1409,19 +2134,27 @@ class Runtime (object):
                            "Original result of %s is %s",
                            query, utility.iterstr(oldresult))
 
-        # apply SEQUENCE
+        # apply SEQUENCE, to overlays of the policies if possible
         self.table_log(query.tablename(), "** Simulate: Applying sequence %s",
                        utility.iterstr(sequence))
-        undo = self.project(sequence, theory, action_theory)
+        overlay = self._overlay()
+        if overlay is None:
+            undo = self.project(sequence, theory, action_theory)
+        else:
+            overlay.project(sequence, theory, action_theory)
 
         # query the resulting state
         self.table_log(query.tablename(), "** Simulate: Querying %s", query)
-        result = set(th_object.select(query))
+        if overlay is None:
+            result = set(th_object.select(query))
+        else:
+            result = set(overlay.get_target(theory).select(query))
         self.table_log(query.tablename(), "Result of %s is %s", query,
                        utility.iterstr(result))
-        # rollback the changes
-        self.table_log(query.tablename(), "** Simulate: Rolling back")
-        self.project(undo, theory, action_theory)
+        # rollback the changes; overlays are just dropped
+        if overlay is None:
+            self.table_log(query.tablename(), "** Simulate: Rolling back")
+            self.project(undo, theory, action_theory)
 
         # if computing the delta, do it
         if delta:
@@ -1437,6 +2170,33 @@ class Runtime (object):
             return (result, tracer.get_value())
         return result
 
+    def _overlay(self):
+        """Return a copy of this Runtime for trying out updates.
+
+        The policies of the copy are overlays of the policies of this
+        Runtime (see Theory.overlay), with their own rules, facts and
+        schemas, so that updating those policies leaves this Runtime
+        untouched.  The global dependency graph and the trigger registry
+        are still shared with this Runtime, so the copy must be updated
+        through its policies directly, as project and
+        _apply_fact_events do, and never through insert, delete or
+        update.  Returns None if some policy cannot be overlaid.
+        """
+        theories = {}
+        for name, th in self.theory.items():
+            theories[name] = th.overlay(theories)
+            if theories[name] is None:
+                return None
+        overlays = dict((id(self.theory[name]), th)
+                        for name, th in theories.items())
+        for th in theories.values():
+            th.includes = [overlays.get(id(included), included)
+                           for included in th.includes]
+        runtime = copy.copy(self)
+        runtime.theory = theories
+        runtime.result_cache = None
+        return runtime
+
     # Helpers
 
     def _react_to_changes(self, changes):
@@ -1594,6 +2354,8 @@ class Runtime (object):
         changed = th_obj.update([compile.Event(formula=newdelta,
                                                insert=insert)])
         if changed:
+            self._tables_changed([compile.Event(formula=newdelta,
+                                                target=theory)])
             return delta.invert_update()
         else:
             return None
@@ -1664,7 +2426,8 @@ class Runtime (object):
         return [action.arguments[0].name for action in actions]
 
     def table_log(self, table, msg, *args):
-        self.tracer.log(table, "RT    : %s" % msg, *args)
+        if self.tracer.enabled:
+            self.tracer.log(table, "RT    : %s" % msg, *args)
 
     def set_tracer(self, tracer):
         if isinstance(tracer, base.Tracer):
@@ -1696,6 +2459,55 @@ class Runtime (object):
         tracer = base.Tracer()
         self.set_tracer(tracer)
 
+    def set_profiler(self, profiler):
+        self.profiler = profiler
+        for th in self.theory.values():
+            th.set_profiler(profiler)
+
+    def profile(self, enabled=True):
+        """Start or stop counting the work done for each rule and table.
+
+        Starting discards the counts collected so far.  See
+        base.Profiler for what is counted.
+        """
+        if enabled:
+            self.set_profiler(base.Profiler())
+        else:
+            self.set_profiler(None)
+
+    def set_result_cache(self, memory=64 * 1024 * 1024):
+        """Keep the answers to queries until the tables they use change.
+
+        The answers of select are kept in a ResultCache of at most
+        MEMORY bytes, and dropped as soon as a table they depend on
+        changes.  A MEMORY of None or 0 stops caching.  Changes to
+        policies made other than through this Runtime are not seen.
+        """
+        if memory:
+            self.result_cache = ResultCache(memory)
+        else:
+            self.result_cache = None
+
+    def result_cache_stats(self):
+        """Return the counts of the result cache, or None if it is off."""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.stats()
+
+    def profile_report(self, reset=False):
+        """Return the counts collected since profiling started.
+
+        The report is a dictionary as returned by base.Profiler.report,
+        with no entries if profiling is off.  With RESET, counting then
+        starts again from zero.
+        """
+        if self.profiler is None:
+            return {'tables': [], 'rules': []}
+        report = self.profiler.report()
+        if reset:
+            self.profiler.reset()
+        return report
+
 
 ##############################################################################
 # ExperimentalRuntime
@@ -27,7 +27,6 @@ from pylagolog.congress.datalog import base
 from pylagolog.congress.datalog import compile as ast
 from pylagolog.congress.datalog import nonrecursive
 from pylagolog.congress.datalog import ruleset
-from pylagolog.congress.datalog import unify
 from pylagolog.congress import exception
 from pylagolog.congress.z3 import typechecker
 from pylagolog.congress.z3 import z3builtins
@@ -153,12 +152,12 @@ class Z3Theory(nonrecursive.RuleHandlingMixin, base.Theory):
                         and not caller.find_all)
             return False
         for answer in answers:
-            changes = []
+            mark = context.binding.mark()
             for (val, var, trans) in six.moves.zip(answer, bvars, translators):
-                chg = context.binding.add(var, trans.to_os(val), None)
-                changes.append(chg)
+                context.binding.bind(
+                    var, ast.Term.create_from_python(trans.to_os(val)))
             context.theory._top_down_finish(context, caller)
-            unify.undo_all(changes)
+            context.binding.undo(mark)
             if not caller.find_all:
                 return True
         return False
@@ -4,6 +4,7 @@ import grpc
 from oslo_config import cfg
 from oslo_log import log as logging
 
+from pylagolog.congress.datalog import base
 from pylagolog.proto import pylagolog_pb2
 from pylagolog.proto import pylagolog_pb2_grpc
 
@@ -16,7 +17,25 @@ common_opts = [
                help='Delete a rule'),
     cfg.StrOpt('query',
                short='q',
-               help='Query')
+               help='Query'),
+    cfg.StrOpt('file',
+               short='f',
+               help='Add the rules in a file, one per line'),
+    cfg.StrOpt('rows',
+               help='Query, printing each answer as a row of values'),
+    cfg.IntOpt('limit',
+               default=0,
+               help='Print at most this many rows (0 for all)'),
+    cfg.IntOpt('offset',
+               default=0,
+               help='Skip this many rows first'),
+    cfg.BoolOpt('stats',
+                default=False,
+                help='Print the work counted by a server started with '
+                     '--profile'),
+    cfg.BoolOpt('reset',
+                default=False,
+                help='With --stats, start counting again from zero')
 ]
 
 def gen_message(type, message):
@@ -26,6 +45,14 @@ def gen_message(type, message):
     for msg in messages:
         yield msg
 
+def gen_file_messages(path):
+    with open(path) as f:
+        for line in f:
+            rule = line.split('#', 1)[0].strip()
+            if rule:
+                yield pylagolog_pb2.ModifyRule(Type=pylagolog_pb2.ADD,
+                                               Rule=rule)
+
 def gen_queries(query):
     messages = [
         pylagolog_pb2.Query(Query=query),
@@ -34,6 +61,30 @@ def gen_queries(query):
         yield msg
     
     
+def format_value(value):
+    kind = value.WhichOneof('Kind')
+    if kind is None:
+        return ''
+    if kind == 'String':
+        return '"%s"' % value.String
+    return str(getattr(value, kind))
+
+def stats_report(response):
+    """Return the StatsReport RESPONSE as returned by Profiler.report."""
+    report = {}
+    for kind, field, stats in (('tables', 'table', response.Tables),
+                               ('rules', 'rule', response.Rules)):
+        report[kind] = []
+        for stat in stats:
+            entry = {'theory': stat.Theory, field: stat.Name}
+            for counter in stat.Counters:
+                value = counter.Value
+                if counter.Name != 'time' and value.is_integer():
+                    value = int(value)
+                entry[counter.Name] = value
+            report[kind].append(entry)
+    return report
+
 def client():
     conf = cfg.ConfigOpts()
     conf.register_cli_opts(common_opts)
@@ -53,8 +104,29 @@ def client():
                 print("DEL: %s\n" % conf.delete)
             else :
                 print("Fail DEL: %s\n" % conf.delete)
+        if conf.file != None :
+            response = stub.ModRules(gen_file_messages(conf.file))
+            if response.Result == pylagolog_pb2.SUCCESS :
+                print("ADD: %s\n" % conf.file)
+            else :
+                print("Fail ADD: %s\n" % conf.file)
         if conf.query != None :
             responses = stub.Queries(gen_queries(conf.query))
             for response in responses:
                 print(response)
+        if conf.rows != None :
+            pages = stub.QueryRows(pylagolog_pb2.RowQuery(
+                Query=conf.rows, Limit=conf.limit, Offset=conf.offset))
+            for page in pages:
+                if page.Result != pylagolog_pb2.SUCCESS :
+                    print("Fail Query: %s\n" % conf.rows)
+                for row in page.Rows:
+                    print(", ".join(format_value(value)
+                                    for value in row.Columns))
+        if conf.stats :
+            response = stub.Stats(pylagolog_pb2.StatsQuery(Reset=conf.reset))
+            if response.Result == pylagolog_pb2.SUCCESS :
+                print(base.Profiler.format_report(stats_report(response)))
+            else :
+                print("Fail Stats: is the server started with --profile?\n")
 
@@ -0,0 +1,288 @@
+# Copyright (c) 2019 Nippon Telegraph and Telephone Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import contextlib
+import multiprocessing
+import threading
+
+from oslo_log import log as logging
+
+from pylagolog.congress.datalog import compile
+from pylagolog.congress import exception
+
+LOG = logging.getLogger(__name__)
+
+
+class ReadWriteLock(object):
+    """Lock shared by any number of readers or held by one writer.
+
+    A waiting writer keeps new readers out, so a steady stream of
+    queries cannot starve updates.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+def replay(runtime, entry):
+    """Apply the write log ENTRY to RUNTIME as one update.
+
+    ENTRY is a list of (policy string, insert) pairs.
+    """
+    permitted, errors = runtime.update(
+        [compile.Event(formula=formula, insert=insert)
+         for text, insert in entry for formula in runtime.parse(text)])
+    if not permitted:
+        raise exception.PolicyException(
+            "; ".join(str(e) for e in errors))
+
+
+class NoReplicas(exception.PolicyException):
+    """Every replica of a ReplicaPool has broken."""
+
+
+class _Replica(object):
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        # position in the write log up to which updates were sent
+        self.applied = 0
+
+
+class ReplicaPool(object):
+    """Answer queries from copies of a Runtime in forked processes.
+
+    Each replica starts as the copy of RUNTIME made by fork.  Updates
+    committed to the primary are appended to a write log, and a replica
+    replays the entries it has not seen before answering a query, so a
+    query sees every update committed before it was sent.  EVALUATE is
+    called as EVALUATE(runtime, query, rows) in the replica and must
+    return something that can be pickled.  EVALUATE and the functions
+    given to gather must be defined at module level, so that they can be
+    pickled themselves.
+
+    A replica that fails to replay an entry no longer matches the
+    primary, and one whose process died cannot answer: either is
+    terminated and dropped from the pool.  Replicas are not forked again,
+    and once none is left select raises NoReplicas.
+
+    The pool has to be created before any gRPC server or channel, since
+    those do not survive a fork.
+    """
+
+    def __init__(self, runtime, processes, evaluate):
+        context = multiprocessing.get_context('fork')
+        self._evaluate = evaluate
+        # entries not yet sent to every replica, starting at position BASE
+        self._log = []
+        self._base = 0
+        self._mutex = threading.Lock()
+        # held while gather takes every replica
+        self._gathering = threading.Lock()
+        # guards the replicas and the idle ones among them
+        self._cond = threading.Condition()
+        self._idle = []
+        self._replicas = []
+        for _ in range(processes):
+            conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_serve_replica, args=(runtime, child_conn))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            replica = _Replica(process, conn)
+            self._replicas.append(replica)
+            self._idle.append(replica)
+        LOG.info("Started %d query replicas", processes)
+
+    def __len__(self):
+        """Return the number of replicas still in use."""
+        with self._cond:
+            return len(self._replicas)
+
+    def append(self, entry):
+        """Add ENTRY, as taken by replay, to the write log."""
+        with self._mutex:
+            self._log.append(entry)
+
+    def select(self, query, rows):
+        """Return EVALUATE(replica, QUERY, ROWS) from an idle replica.
+
+        A replica that breaks is dropped, and the query is sent to
+        another one.
+        """
+        while True:
+            replica = self._take()
+            try:
+                ok, result = self._call(replica, self._evaluate,
+                                        (query, rows))
+            finally:
+                self._release(replica)
+            if ok is not None:
+                break
+        if not ok:
+            raise exception.PolicyException(result)
+        return result
+
+    def gather(self, function, *args):
+        """Return the list of FUNCTION(replica, *ARGS) of every replica.
+
+        Waits until each replica is idle, and keeps it until all of them
+        have answered.  Replicas that break are left out.
+        """
+        with self._gathering:
+            replicas = []
+            with self._cond:
+                while True:
+                    replicas.extend(self._idle)
+                    del self._idle[:]
+                    if len(replicas) == len(self._replicas):
+                        break
+                    self._cond.wait()
+            try:
+                answers = [self._call(replica, function, args)
+                           for replica in replicas]
+            finally:
+                for replica in replicas:
+                    self._release(replica)
+        for ok, result in answers:
+            if ok is False:
+                raise exception.PolicyException(result)
+        return [result for ok, result in answers if ok]
+
+    def close(self):
+        with self._cond:
+            replicas = list(self._replicas)
+        for replica in replicas:
+            replica.conn.close()
+        for replica in replicas:
+            replica.process.join(1)
+            if replica.process.is_alive():
+                replica.process.terminate()
+
+    def _take(self):
+        """Return an idle replica, waiting for one if needed."""
+        with self._cond:
+            while not self._idle:
+                if not self._replicas:
+                    raise NoReplicas("No query replica is left")
+                self._cond.wait()
+            return self._idle.pop(0)
+
+    def _release(self, replica):
+        """Make REPLICA idle again, unless it was dropped."""
+        with self._cond:
+            if replica in self._replicas:
+                self._idle.append(replica)
+            self._cond.notify_all()
+
+    def _call(self, replica, function, args):
+        """Bring REPLICA up to date and return (ok, FUNCTION result).
+
+        OK is None, and REPLICA dropped, if REPLICA broke.
+        """
+        with self._mutex:
+            end = self._base + len(self._log)
+            pending = self._log[replica.applied - self._base:]
+        if not replica.process.is_alive():
+            answer = (None, "replica process exited")
+        else:
+            try:
+                replica.conn.send((pending, function, args))
+                answer = replica.conn.recv()
+            except (EOFError, OSError) as e:
+                answer = (None, "replica process exited: %s" % e)
+        if answer[0] is None:
+            self._drop(replica, answer[1])
+        else:
+            replica.applied = end
+        self._trim()
+        return answer
+
+    def _drop(self, replica, reason):
+        """Stop using REPLICA, which no longer matches the primary."""
+        LOG.error("Dropping query replica %s: %s", replica.process.pid,
+                  reason)
+        with self._cond:
+            self._replicas.remove(replica)
+            self._cond.notify_all()
+        replica.conn.close()
+        replica.process.terminate()
+        replica.process.join(1)
+
+    def _trim(self):
+        """Drop the log entries every replica has replayed."""
+        with self._cond:
+            applied = [replica.applied for replica in self._replicas]
+        with self._mutex:
+            low = min(applied) if applied else self._base + len(self._log)
+            del self._log[:low - self._base]
+            self._base = low
+
+
+def _serve_replica(runtime, conn):
+    while True:
+        try:
+            pending, function, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            for entry in pending:
+                replay(runtime, entry)
+        except Exception as e:
+            # the state no longer matches the primary: report and stop
+            conn.send((None, "failed to replay %s: %s" % (entry, e)))
+            return
+        try:
+            result = (True, function(runtime, *args))
+        except Exception as e:
+            result = (False, str(e))
+        conn.send(result)
@@ -20,7 +20,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   package='pylagolog',
   syntax='proto3',
   serialized_options=None,
-  serialized_pb=_b('\n\x0fpylagolog.proto\x12\tpylagolog\"?\n\nModifyRule\x12#\n\x04Type\x18\x01 \x01(\x0e\x32\x15.pylagolog.ModifyType\x12\x0c\n\x04Rule\x18\x02 \x01(\t\"/\n\x06Result\x12%\n\x06Result\x18\x01 \x01(\x0e\x32\x15.pylagolog.ReturnCode\"\x16\n\x05Query\x12\r\n\x05Query\x18\x01 \x01(\t\"\x1d\n\x0bQueryResult\x12\x0e\n\x06Result\x18\x01 \x01(\t*$\n\nReturnCode\x12\x0b\n\x07SUCCESS\x10\x00\x12\t\n\x05\x45RROR\x10\x01*!\n\nModifyType\x12\x07\n\x03\x41\x44\x44\x10\x00\x12\n\n\x06\x44\x45LETE\x10\x01\x32~\n\x07\x44\x61talog\x12\x38\n\x08ModRules\x12\x15.pylagolog.ModifyRule\x1a\x11.pylagolog.Result\"\x00(\x01\x12\x39\n\x07Queries\x12\x10.pylagolog.Query\x1a\x16.pylagolog.QueryResult\"\x00(\x01\x30\x01\x62\x06proto3')
+  serialized_pb=_b('\n\x0fpylagolog.proto\x12\tpylagolog\"?\n\nModifyRule\x12#\n\x04Type\x18\x01 \x01(\x0e\x32\x15.pylagolog.ModifyType\x12\x0c\n\x04Rule\x18\x02 \x01(\t\"/\n\x06Result\x12%\n\x06Result\x18\x01 \x01(\x0e\x32\x15.pylagolog.ReturnCode\"\x16\n\x05Query\x12\r\n\x05Query\x18\x01 \x01(\t\"\x1d\n\x0bQueryResult\x12\x0e\n\x06Result\x18\x01 \x01(\t\"A\n\x05Value\x12\r\n\x03Int\x18\x01 \x01(\x03H\x00\x12\x0f\n\x05\x46loat\x18\x02 \x01(\x01H\x00\x12\x10\n\x06String\x18\x03 \x01(\tH\x00\x42\x06\n\x04Kind\"(\n\x03Row\x12!\n\x07\x43olumns\x18\x01 \x03(\x0b\x32\x10.pylagolog.Value\"K\n\x08RowQuery\x12\r\n\x05Query\x18\x01 \x01(\t\x12\x11\n\tBatchSize\x18\x02 \x01(\r\x12\r\n\x05Limit\x18\x03 \x01(\x04\x12\x0e\n\x06Offset\x18\x04 \x01(\x04\"N\n\x07RowPage\x12%\n\x06Result\x18\x01 \x01(\x0e\x32\x15.pylagolog.ReturnCode\x12\x1c\n\x04Rows\x18\x02 \x03(\x0b\x32\x0e.pylagolog.Row\"\x1b\n\nStatsQuery\x12\r\n\x05Reset\x18\x01 \x01(\x08\"&\n\x07\x43ounter\x12\x0c\n\x04Name\x18\x01 \x01(\t\x12\r\n\x05Value\x18\x02 \x01(\x01\"J\n\x04Stat\x12\x0e\n\x06Theory\x18\x01 \x01(\t\x12\x0c\n\x04Name\x18\x02 \x01(\t\x12$\n\x08\x43ounters\x18\x03 \x03(\x0b\x32\x12.pylagolog.Counter\"u\n\x0bStatsReport\x12%\n\x06Result\x18\x01 \x01(\x0e\x32\x15.pylagolog.ReturnCode\x12\x1f\n\x06Tables\x18\x02 \x03(\x0b\x32\x0f.pylagolog.Stat\x12\x1e\n\x05Rules\x18\x03 \x03(\x0b\x32\x0f.pylagolog.Stat*$\n\nReturnCode\x12\x0b\n\x07SUCCESS\x10\x00\x12\t\n\x05\x45RROR\x10\x01*!\n\nModifyType\x12\x07\n\x03\x41\x44\x44\x10\x00\x12\n\n\x06\x44\x45LETE\x10\x01\x32\xf2\x01\n\x07\x44\x61talog\x12\x38\n\x08ModRules\x12\x15.pylagolog.ModifyRule\x1a\x11.pylagolog.Result\"\x00(\x01\x12\x39\n\x07Queries\x12\x10.pylagolog.Query\x1a\x16.pylagolog.QueryResult\"\x00(\x01\x30\x01\x12\x38\n\tQueryRows\x12\x13.pylagolog.RowQuery\x1a\x12.pylagolog.RowPage\"\x00\x30\x01\x12\x38\n\x05Stats\x12\x15.pylagolog.StatsQuery\x1a\x16.pylagolog.StatsReport\"\x00\x62\x06proto3')
 )
 
 _RETURNCODE = _descriptor.EnumDescriptor(
@@ -40,8 +40,8 @@ _RETURNCODE = _descriptor.EnumDescriptor(
   ],
   containing_type=None,
   serialized_options=None,
-  serialized_start=199,
-  serialized_end=235,
+  serialized_start=729,
+  serialized_end=765,
 )
 _sym_db.RegisterEnumDescriptor(_RETURNCODE)
 
@@ -63,8 +63,8 @@ _MODIFYTYPE = _descriptor.EnumDescriptor(
   ],
   containing_type=None,
   serialized_options=None,
-  serialized_start=237,
-  serialized_end=270,
+  serialized_start=767,
+  serialized_end=800,
 )
 _sym_db.RegisterEnumDescriptor(_MODIFYTYPE)
 
@@ -206,12 +206,364 @@ _QUERYRESULT = _descriptor.Descriptor(
   serialized_end=197,
 )
 
+
+_VALUE = _descriptor.Descriptor(
+  name='Value',
+  full_name='pylagolog.Value',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='Int', full_name='pylagolog.Value.Int', index=0,
+      number=1, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='Float', full_name='pylagolog.Value.Float', index=1,
+      number=2, type=1, cpp_type=5, label=1,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='String', full_name='pylagolog.Value.String', index=2,
+      number=3, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+    _descriptor.OneofDescriptor(
+      name='Kind', full_name='pylagolog.Value.Kind',
+      index=0, containing_type=None, fields=[]),
+  ],
+  serialized_start=199,
+  serialized_end=264,
+)
+
+
+_ROW = _descriptor.Descriptor(
+  name='Row',
+  full_name='pylagolog.Row',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='Columns', full_name='pylagolog.Row.Columns', index=0,
+      number=1, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=266,
+  serialized_end=306,
+)
+
+
+_ROWQUERY = _descriptor.Descriptor(
+  name='RowQuery',
+  full_name='pylagolog.RowQuery',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='Query', full_name='pylagolog.RowQuery.Query', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='BatchSize', full_name='pylagolog.RowQuery.BatchSize', index=1,
+      number=2, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='Limit', full_name='pylagolog.RowQuery.Limit', index=2,
+      number=3, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='Offset', full_name='pylagolog.RowQuery.Offset', index=3,
+      number=4, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=308,
+  serialized_end=383,
+)
+
+
+_ROWPAGE = _descriptor.Descriptor(
+  name='RowPage',
+  full_name='pylagolog.RowPage',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='Result', full_name='pylagolog.RowPage.Result', index=0,
+      number=1, type=14, cpp_type=8, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='Rows', full_name='pylagolog.RowPage.Rows', index=1,
+      number=2, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=385,
+  serialized_end=463,
+)
+
+
+_STATSQUERY = _descriptor.Descriptor(
+  name='StatsQuery',
+  full_name='pylagolog.StatsQuery',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='Reset', full_name='pylagolog.StatsQuery.Reset', index=0,
+      number=1, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=465,
+  serialized_end=492,
+)
+
+
+_COUNTER = _descriptor.Descriptor(
+  name='Counter',
+  full_name='pylagolog.Counter',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='Name', full_name='pylagolog.Counter.Name', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='Value', full_name='pylagolog.Counter.Value', index=1,
+      number=2, type=1, cpp_type=5, label=1,
+      has_default_value=False, default_value=float(0),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=494,
+  serialized_end=532,
+)
+
+
+_STAT = _descriptor.Descriptor(
+  name='Stat',
+  full_name='pylagolog.Stat',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='Theory', full_name='pylagolog.Stat.Theory', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='Name', full_name='pylagolog.Stat.Name', index=1,
+      number=2, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='Counters', full_name='pylagolog.Stat.Counters', index=2,
+      number=3, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=534,
+  serialized_end=608,
+)
+
+
+_STATSREPORT = _descriptor.Descriptor(
+  name='StatsReport',
+  full_name='pylagolog.StatsReport',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='Result', full_name='pylagolog.StatsReport.Result', index=0,
+      number=1, type=14, cpp_type=8, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='Tables', full_name='pylagolog.StatsReport.Tables', index=1,
+      number=2, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='Rules', full_name='pylagolog.StatsReport.Rules', index=2,
+      number=3, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=610,
+  serialized_end=727,
+)
+
 _MODIFYRULE.fields_by_name['Type'].enum_type = _MODIFYTYPE
 _RESULT.fields_by_name['Result'].enum_type = _RETURNCODE
+_VALUE.oneofs_by_name['Kind'].fields.append(
+  _VALUE.fields_by_name['Int'])
+_VALUE.fields_by_name['Int'].containing_oneof = _VALUE.oneofs_by_name['Kind']
+_VALUE.oneofs_by_name['Kind'].fields.append(
+  _VALUE.fields_by_name['Float'])
+_VALUE.fields_by_name['Float'].containing_oneof = _VALUE.oneofs_by_name['Kind']
+_VALUE.oneofs_by_name['Kind'].fields.append(
+  _VALUE.fields_by_name['String'])
+_VALUE.fields_by_name['String'].containing_oneof = _VALUE.oneofs_by_name['Kind']
+_ROW.fields_by_name['Columns'].message_type = _VALUE
+_ROWPAGE.fields_by_name['Result'].enum_type = _RETURNCODE
+_ROWPAGE.fields_by_name['Rows'].message_type = _ROW
+_STAT.fields_by_name['Counters'].message_type = _COUNTER
+_STATSREPORT.fields_by_name['Result'].enum_type = _RETURNCODE
+_STATSREPORT.fields_by_name['Tables'].message_type = _STAT
+_STATSREPORT.fields_by_name['Rules'].message_type = _STAT
 DESCRIPTOR.message_types_by_name['ModifyRule'] = _MODIFYRULE
 DESCRIPTOR.message_types_by_name['Result'] = _RESULT
 DESCRIPTOR.message_types_by_name['Query'] = _QUERY
 DESCRIPTOR.message_types_by_name['QueryResult'] = _QUERYRESULT
+DESCRIPTOR.message_types_by_name['Value'] = _VALUE
+DESCRIPTOR.message_types_by_name['Row'] = _ROW
+DESCRIPTOR.message_types_by_name['RowQuery'] = _ROWQUERY
+DESCRIPTOR.message_types_by_name['RowPage'] = _ROWPAGE
+DESCRIPTOR.message_types_by_name['StatsQuery'] = _STATSQUERY
+DESCRIPTOR.message_types_by_name['Counter'] = _COUNTER
+DESCRIPTOR.message_types_by_name['Stat'] = _STAT
+DESCRIPTOR.message_types_by_name['StatsReport'] = _STATSREPORT
 DESCRIPTOR.enum_types_by_name['ReturnCode'] = _RETURNCODE
 DESCRIPTOR.enum_types_by_name['ModifyType'] = _MODIFYTYPE
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
@@ -244,6 +596,62 @@ QueryResult = _reflection.GeneratedProtocolMessageType('QueryResult', (_message.
   ))
 _sym_db.RegisterMessage(QueryResult)
 
+Value = _reflection.GeneratedProtocolMessageType('Value', (_message.Message,), dict(
+  DESCRIPTOR = _VALUE,
+  __module__ = 'pylagolog_pb2'
+  # @@protoc_insertion_point(class_scope:pylagolog.Value)
+  ))
+_sym_db.RegisterMessage(Value)
+
+Row = _reflection.GeneratedProtocolMessageType('Row', (_message.Message,), dict(
+  DESCRIPTOR = _ROW,
+  __module__ = 'pylagolog_pb2'
+  # @@protoc_insertion_point(class_scope:pylagolog.Row)
+  ))
+_sym_db.RegisterMessage(Row)
+
+RowQuery = _reflection.GeneratedProtocolMessageType('RowQuery', (_message.Message,), dict(
+  DESCRIPTOR = _ROWQUERY,
+  __module__ = 'pylagolog_pb2'
+  # @@protoc_insertion_point(class_scope:pylagolog.RowQuery)
+  ))
+_sym_db.RegisterMessage(RowQuery)
+
+RowPage = _reflection.GeneratedProtocolMessageType('RowPage', (_message.Message,), dict(
+  DESCRIPTOR = _ROWPAGE,
+  __module__ = 'pylagolog_pb2'
+  # @@protoc_insertion_point(class_scope:pylagolog.RowPage)
+  ))
+_sym_db.RegisterMessage(RowPage)
+
+StatsQuery = _reflection.GeneratedProtocolMessageType('StatsQuery', (_message.Message,), dict(
+  DESCRIPTOR = _STATSQUERY,
+  __module__ = 'pylagolog_pb2'
+  # @@protoc_insertion_point(class_scope:pylagolog.StatsQuery)
+  ))
+_sym_db.RegisterMessage(StatsQuery)
+
+Counter = _reflection.GeneratedProtocolMessageType('Counter', (_message.Message,), dict(
+  DESCRIPTOR = _COUNTER,
+  __module__ = 'pylagolog_pb2'
+  # @@protoc_insertion_point(class_scope:pylagolog.Counter)
+  ))
+_sym_db.RegisterMessage(Counter)
+
+Stat = _reflection.GeneratedProtocolMessageType('Stat', (_message.Message,), dict(
+  DESCRIPTOR = _STAT,
+  __module__ = 'pylagolog_pb2'
+  # @@protoc_insertion_point(class_scope:pylagolog.Stat)
+  ))
+_sym_db.RegisterMessage(Stat)
+
+StatsReport = _reflection.GeneratedProtocolMessageType('StatsReport', (_message.Message,), dict(
+  DESCRIPTOR = _STATSREPORT,
+  __module__ = 'pylagolog_pb2'
+  # @@protoc_insertion_point(class_scope:pylagolog.StatsReport)
+  ))
+_sym_db.RegisterMessage(StatsReport)
+
 
 
 _DATALOG = _descriptor.ServiceDescriptor(
@@ -252,8 +660,8 @@ _DATALOG = _descriptor.ServiceDescriptor(
   file=DESCRIPTOR,
   index=0,
   serialized_options=None,
-  serialized_start=272,
-  serialized_end=398,
+  serialized_start=803,
+  serialized_end=1045,
   methods=[
   _descriptor.MethodDescriptor(
     name='ModRules',
@@ -273,6 +681,24 @@ _DATALOG = _descriptor.ServiceDescriptor(
     output_type=_QUERYRESULT,
     serialized_options=None,
   ),
+  _descriptor.MethodDescriptor(
+    name='QueryRows',
+    full_name='pylagolog.Datalog.QueryRows',
+    index=2,
+    containing_service=None,
+    input_type=_ROWQUERY,
+    output_type=_ROWPAGE,
+    serialized_options=None,
+  ),
+  _descriptor.MethodDescriptor(
+    name='Stats',
+    full_name='pylagolog.Datalog.Stats',
+    index=3,
+    containing_service=None,
+    input_type=_STATSQUERY,
+    output_type=_STATSREPORT,
+    serialized_options=None,
+  ),
 ])
 _sym_db.RegisterServiceDescriptor(_DATALOG)
 
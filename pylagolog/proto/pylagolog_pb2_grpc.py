@@ -24,6 +24,16 @@ class DatalogStub(object):
         request_serializer=pylagolog__pb2.Query.SerializeToString,
         response_deserializer=pylagolog__pb2.QueryResult.FromString,
         )
+    self.QueryRows = channel.unary_stream(
+        '/pylagolog.Datalog/QueryRows',
+        request_serializer=pylagolog__pb2.RowQuery.SerializeToString,
+        response_deserializer=pylagolog__pb2.RowPage.FromString,
+        )
+    self.Stats = channel.unary_unary(
+        '/pylagolog.Datalog/Stats',
+        request_serializer=pylagolog__pb2.StatsQuery.SerializeToString,
+        response_deserializer=pylagolog__pb2.StatsReport.FromString,
+        )
 
 
 class DatalogServicer(object):
@@ -44,6 +54,20 @@ class DatalogServicer(object):
     context.set_details('Method not implemented!')
     raise NotImplementedError('Method not implemented!')
 
+  def QueryRows(self, request, context):
+    # missing associated documentation comment in .proto file
+    pass
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
+  def Stats(self, request, context):
+    # missing associated documentation comment in .proto file
+    pass
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
 
 def add_DatalogServicer_to_server(servicer, server):
   rpc_method_handlers = {
@@ -57,6 +81,16 @@ def add_DatalogServicer_to_server(servicer, server):
           request_deserializer=pylagolog__pb2.Query.FromString,
           response_serializer=pylagolog__pb2.QueryResult.SerializeToString,
       ),
+      'QueryRows': grpc.unary_stream_rpc_method_handler(
+          servicer.QueryRows,
+          request_deserializer=pylagolog__pb2.RowQuery.FromString,
+          response_serializer=pylagolog__pb2.RowPage.SerializeToString,
+      ),
+      'Stats': grpc.unary_unary_rpc_method_handler(
+          servicer.Stats,
+          request_deserializer=pylagolog__pb2.StatsQuery.FromString,
+          response_serializer=pylagolog__pb2.StatsReport.SerializeToString,
+      ),
   }
   generic_handler = grpc.method_handlers_generic_handler(
       'pylagolog.Datalog', rpc_method_handlers)
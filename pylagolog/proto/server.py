@@ -1,3 +1,6 @@
+import collections
+import os
+import signal
 import sys
 import grpc
 from concurrent import futures
@@ -6,9 +9,13 @@ from oslo_config import cfg
 from oslo_log import log as logging
 
 import time
+from pylagolog.proto import concurrency
 from pylagolog.proto import pylagolog_pb2
 from pylagolog.proto import pylagolog_pb2_grpc
 
+from pylagolog.congress.datalog import base
+from pylagolog.congress.datalog import compile
+from pylagolog.congress import exception
 from pylagolog.congress.policy_engines import agnostic
 
 _ONE_DAY_IN_SECONDS = 60 * 60 * 24
@@ -25,52 +32,269 @@ common_opts = [
         short='p',
         default='[::]:10484',
         help='An insecure port for accepting RPCs'),
+    cfg.BoolOpt('batch',
+        default=True,
+        help='Apply each ModRules stream atomically as a single update'),
+    cfg.IntOpt('page_size',
+        default=1000,
+        min=1,
+        help='Rows per page of QueryRows when the query sets no BatchSize'),
+    cfg.IntOpt('replicas',
+        default=0,
+        help='Answer queries from this many forked read replicas '
+             'instead of the server process'),
+    cfg.BoolOpt('profile',
+        default=False,
+        help='Count the work done for each rule and table, '
+             'reported by Stats'),
+    cfg.IntOpt('cache_memory',
+        default=0,
+        help='Megabytes of query answers kept until the tables they '
+             'depend on change (0 disables the cache)'),
+    cfg.StrOpt('snapshot',
+        help='Restore the policies from this snapshot file at startup, '
+             'if it exists, and save them to it at shutdown'),
+    cfg.BoolOpt('snapshot_check_db',
+        default=False,
+        help='Record the state of the policy database in the snapshot, '
+             'and refuse to restore a snapshot that does not match it'),
 ]
 
+# int64 range of Value.Int; larger integers are sent as strings
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
 class DatalogServicer(pylagolog_pb2_grpc.DatalogServicer):
 
-    def __init__(self, runtime):
+    def __init__(self, runtime, batch=True, page_size=1000, replicas=None):
         self.run = runtime
+        self.batch = batch
+        self.page_size = page_size
+        # queries share the runtime with each other but never with an
+        #   update, so each one sees the state between two updates
+        self.lock = concurrency.ReadWriteLock()
+        # ReplicaPool answering the queries, if any
+        self.replicas = replicas
         return
 
     def ModRules(self, request_iterator, context):
         LOG.info("ModRules:")
+        if self.batch:
+            return self._mod_rules_batch(request_iterator)
         for command in request_iterator:
-            if command.Type == pylagolog_pb2.ADD :
-                LOG.info("ADD: %s" % command.Rule)
-                self.run.insert(command.Rule)
-            else :
-                LOG.info("DEL: %s" % command.Rule)
-                self.run.delete(command.Rule)
+            insert = command.Type == pylagolog_pb2.ADD
+            with self.lock.write():
+                if insert :
+                    LOG.info("ADD: %s" % command.Rule)
+                    permitted, _ = self.run.insert(command.Rule)
+                else :
+                    LOG.info("DEL: %s" % command.Rule)
+                    permitted, _ = self.run.delete(command.Rule)
+                if permitted:
+                    self._log([(command.Rule, insert)])
+        return pylagolog_pb2.Result(Result = pylagolog_pb2.SUCCESS)
+
+    def _mod_rules_batch(self, request_iterator):
+        """Apply the whole stream of ModifyRule in one update.
+
+        Consecutive commands of the same type are parsed in a single pass.
+        Either every statement is applied or, on any error, none is.
+        """
+        groups = []
+        for command in request_iterator:
+            insert = command.Type == pylagolog_pb2.ADD
+            if groups and groups[-1][0] == insert:
+                groups[-1][1].append(command.Rule)
+            else:
+                groups.append((insert, [command.Rule]))
+        # only the last command on a statement matters, as when the
+        #   commands are applied one by one
+        statements = collections.OrderedDict()
+        with self.lock.write():
+            try:
+                for insert, rules in groups:
+                    for formula in self.run.parse("\n".join(rules)):
+                        statements.pop(formula, None)
+                        statements[formula] = insert
+            except exception.PolicyException as e:
+                LOG.error("ModRules: %s" % e)
+                return pylagolog_pb2.Result(Result = pylagolog_pb2.ERROR)
+            permitted, errors = self.run.update(
+                [compile.Event(formula=formula, insert=insert)
+                 for formula, insert in statements.items()])
+            if not permitted:
+                LOG.error("ModRules: %s" % "; ".join(str(e) for e in errors))
+                return pylagolog_pb2.Result(Result = pylagolog_pb2.ERROR)
+            self._log([(str(formula), insert)
+                       for formula, insert in statements.items()])
+        LOG.info("ModRules: applied %d statements" % len(statements))
         return pylagolog_pb2.Result(Result = pylagolog_pb2.SUCCESS)
 
     def Queries(self, request_iterator, context):
-        results = []
         for query in request_iterator:
             LOG.info("Query: %s" % query.Query)
-            ans = self.run.select(query.Query)
+            ans = self._select(query.Query, False)
+            LOG.info("ANS: %s" % ans)
             if ans != "":
-                results.append(pylagolog_pb2.QueryResult(Result=ans))
-        LOG.info("ANS: %s" % results)
-        for result in results:
-            yield result
-    
+                yield pylagolog_pb2.QueryResult(Result=ans)
+
+    def QueryRows(self, request, context):
+        """Stream the answers to one query as pages of typed rows.
+
+        Each row holds the arguments of one instance of the query (of its
+        head, for a rule).  Answers are sorted, so OFFSET and LIMIT page
+        through the same order on every call; a LIMIT of 0 means no limit.
+        Pages are built one at a time as the stream is consumed.
+        """
+        LOG.info("QueryRows: %s" % request.Query)
+        try:
+            answers = self._select(request.Query, True)
+        except exception.PolicyException as e:
+            LOG.error("QueryRows: %s" % e)
+            yield pylagolog_pb2.RowPage(Result = pylagolog_pb2.ERROR)
+            return
+        end = len(answers)
+        if request.Limit:
+            end = min(end, request.Offset + request.Limit)
+        start = min(request.Offset, end)
+        size = request.BatchSize or self.page_size
+        LOG.info("QueryRows: %d of %d rows" % (end - start, len(answers)))
+        if start == end:
+            yield pylagolog_pb2.RowPage(Result = pylagolog_pb2.SUCCESS)
+        for first in range(start, end, size):
+            yield pylagolog_pb2.RowPage(
+                Result = pylagolog_pb2.SUCCESS,
+                Rows = [_row(args)
+                        for args in answers[first:min(first + size, end)]])
+
+    def Stats(self, request, context):
+        """Report the work counted for each table and rule.
+
+        With replicas, the counts of the server and of every replica are
+        summed.  With RESET, counting starts again from zero.
+        """
+        LOG.info("Stats:")
+        if self.run.profiler is None:
+            LOG.error("Stats: profiling is off")
+            return pylagolog_pb2.StatsReport(Result = pylagolog_pb2.ERROR)
+        profiler = base.Profiler()
+        profiler.merge(_profile_report(self.run, request.Reset))
+        if self.replicas is not None:
+            for report in self.replicas.gather(_profile_report,
+                                               request.Reset):
+                profiler.merge(report)
+        report = profiler.report()
+        return pylagolog_pb2.StatsReport(
+            Result = pylagolog_pb2.SUCCESS,
+            Tables = [_stat(entry, 'table') for entry in report['tables']],
+            Rules = [_stat(entry, 'rule') for entry in report['rules']])
+
+    def _select(self, query, rows):
+        replicas = self.replicas
+        if replicas is not None:
+            try:
+                return replicas.select(query, rows)
+            except concurrency.NoReplicas:
+                LOG.error("Every replica broke, answering from the server")
+                self.replicas = None
+        with self.lock.read():
+            return _evaluate(self.run, query, rows)
+
+    def _log(self, entry):
+        """Send the update ENTRY applied to the runtime to the replicas."""
+        if self.replicas is not None:
+            self.replicas.append(entry)
+
+
+def _evaluate(run, query, rows):
+    """Return the answers to the string QUERY in RUN.
+
+    The answers are a string, as from select, or if ROWS is True the
+    sorted list of row arguments QueryRows pages through.
+    """
+    if not rows:
+        return run.select(query)
+    policy = run.parse(query)
+    if len(policy) != 1:
+        raise exception.PolicyException(
+            "Query %s must be 1 statement" % query)
+    return sorted(_row_arguments(answer) for answer in run.select(policy[0]))
+
+
+def _profile_report(run, reset):
+    return run.profile_report(reset=reset)
+
+
+def _stat(entry, field):
+    """Return the Stat of the profile report ENTRY named by FIELD."""
+    return pylagolog_pb2.Stat(
+        Theory = entry['theory'], Name = entry[field],
+        Counters = [pylagolog_pb2.Counter(Name = name, Value = value)
+                    for name, value in sorted(entry.items())
+                    if name not in ('theory', field)])
+
+
+def _row_arguments(answer):
+    """Return the arguments of ANSWER as a tuple that sorts the rows."""
+    if compile.is_rule(answer):
+        answer = answer.head
+    return tuple((arg.is_variable(), getattr(arg, 'type', ''), arg.name)
+                 for arg in answer.arguments)
+
+
+def _row(args):
+    columns = []
+    for is_variable, type, name in args:
+        if is_variable:
+            columns.append(pylagolog_pb2.Value(String=str(name)))
+        elif (type == compile.ObjectConstant.INTEGER and
+                _INT64_MIN <= name <= _INT64_MAX):
+            columns.append(pylagolog_pb2.Value(Int=name))
+        elif type == compile.ObjectConstant.FLOAT:
+            columns.append(pylagolog_pb2.Value(Float=name))
+        else:
+            columns.append(pylagolog_pb2.Value(String=str(name)))
+    return pylagolog_pb2.Row(Columns=columns)
+
 def serve():
     conf = cfg.ConfigOpts()
     conf.register_cli_opts(common_opts)
     conf(sys.argv[1:])
     policy = "default"
     run = agnostic.Runtime()
-    run.create_policy(policy)
-    
+    if conf.snapshot and os.path.exists(conf.snapshot):
+        run.load_snapshot(conf.snapshot, check_db=conf.snapshot_check_db)
+    if policy not in run.theory:
+        run.create_policy(policy)
+    if conf.profile:
+        run.profile()
+    if conf.cache_memory > 0:
+        run.set_result_cache(conf.cache_memory * 1024 * 1024)
+    # forked before gRPC starts any thread
+    replicas = None
+    if conf.replicas > 0:
+        replicas = concurrency.ReplicaPool(run, conf.replicas, _evaluate)
+
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    pylagolog_pb2_grpc.add_DatalogServicer_to_server(
-        DatalogServicer(run), server)
+    servicer = DatalogServicer(run, batch=conf.batch,
+                               page_size=conf.page_size, replicas=replicas)
+    pylagolog_pb2_grpc.add_DatalogServicer_to_server(servicer, server)
     server.add_insecure_port(conf.port)
     LOG.info("Server Start %s" % (conf.port))
     server.start()
+    # shut down cleanly, saving the snapshot, when terminated
+    signal.signal(signal.SIGTERM, _interrupt)
     try:
         while True:
             time.sleep(_ONE_DAY_IN_SECONDS)
     except KeyboardInterrupt:
         server.stop(0)
+        if replicas is not None:
+            replicas.close()
+        if conf.snapshot:
+            with servicer.lock.write():
+                run.save_snapshot(conf.snapshot, db=conf.snapshot_check_db)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
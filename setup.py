@@ -17,12 +17,16 @@ setup(
     license="Apache license 2.0",
     packages=find_packages(),
     install_requires=reqs('requirements.txt'),
+    extras_require={
+        'vectorized': ['numpy'],
+    },
     test_suite='nose.collector',
     entry_points={
         "console_scripts":[
             "pylagolog = pylagolog.cmd.pylagolog:main",
             "pylagolog-server = pylagolog.proto.server:serve",
-            "pylagolog-client = pylagolog.proto.client:client"
+            "pylagolog-client = pylagolog.proto.client:client",
+            "pylagolog-benchmark = pylagolog.benchmark.runner:main"
         ]
     }
 )
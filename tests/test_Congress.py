@@ -14,6 +14,11 @@
 #    under the License.
 #
 
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 import mock
@@ -21,11 +26,16 @@ import mock
 from oslo_log import log as logging
 
 from birdwatcher.congress.datalog import base as datalog_base
+from birdwatcher.congress.datalog import bottomup
 from birdwatcher.congress.datalog import database
+from birdwatcher.congress.datalog import factset
+from birdwatcher.congress.datalog import loader
 from birdwatcher.congress.datalog import nonrecursive
 from birdwatcher.congress.datalog import compile
 from birdwatcher.congress.datalog import materialized
+from birdwatcher.congress.datalog import unify
 from birdwatcher.congress.datalog import utility
+from birdwatcher.congress.datalog import vectorized
 from birdwatcher.congress.tests import helper
 from birdwatcher.congress.policy_engines import agnostic
 
@@ -170,6 +180,10 @@ class TestsRuntime(unittest.TestCase):
         self.assertIsInstance(run.policy_object('test4'),
                               materialized.MaterializedViewTheory,
                               'Materialized policy addition')
+        run.create_policy('test5', kind=datalog_base.BOTTOMUP_POLICY_TYPE)
+        self.assertIsInstance(run.policy_object('test5'),
+                              bottomup.BottomUpTheory,
+                              'Bottom-up policy addition')
 
     def test_policy_errors(self):
         """Test errors for multiple policies."""
@@ -197,6 +211,23 @@ class TestsRuntime(unittest.TestCase):
         # double-check that the error didn't result in an inconsistent state
         self.assertEqual(run.select('q(5)'), '')
 
+    def test_database_head_index(self):
+        db = database.Database()
+        db.insert(helper.str2form('q(1, 2)'))
+        db.insert(helper.str2form('q(1, 3)'))
+        db.insert(helper.str2form('q(2, 3)'))
+        lit = helper.str2form('q(1, x)')
+        self.assertEqual(set(x.tuple for x in db.head_index('q', lit)),
+                         set([(1, 2), (1, 3)]))
+        # index is maintained across inserts and deletes
+        db.insert(helper.str2form('q(1, 4)'))
+        db.delete(helper.str2form('q(1, 2)'))
+        self.assertEqual(set(x.tuple for x in db.head_index('q', lit)),
+                         set([(1, 3), (1, 4)]))
+        self.assertEqual(len(db.head_index('q')), 3)
+        self.assertTrue(helper.str2form('q(2, 3)') in db)
+        self.assertFalse(helper.str2form('q(1, 2)') in db)
+
     def test_get_tablename(self):
         # run = agnostic.DseRuntime('dse')
         # run.synchronizer = mock.MagicMock()
@@ -781,6 +812,79 @@ class TestTriggers(unittest.TestCase):
         run.initialize_tables(['q'], [compile.Fact('q', [1])], 'alice')
         self.assertEqual(obj.value, 1)
 
+    def test_index_maintenance(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.register_trigger('p', lambda tbl, old, new: None)
+        run.insert('p(x) :- q(x), not s(x)')
+        run.insert('q(x) :- r(x)')
+        index = run.trigger_registry.index
+        self.assertEqual(set(index), set(['test:p', 'test:q', 'test:r',
+                                          'test:s']))
+        run.insert('q(x) :- s(x)')
+        run.delete('q(x) :- r(x)')
+        self.assertEqual(set(index), set(['test:p', 'test:q', 'test:s']))
+        run.delete('p(x) :- q(x), not s(x)')
+        self.assertEqual(set(index), set(['test:p']))
+
+    def test_delta(self):
+        calls = []
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.insert('p(x) :- q(x)')
+        run.insert('q(x) :- r(x), not s(x)')
+        run.insert('r(1) r(2) r(3)')
+        run.insert('s(2)')
+        run.register_trigger('p', lambda tbl, added, removed:
+                             calls.append((added, removed)), delta=True)
+        run.update([compile.Event(compile.parse1('s(3)')),
+                    compile.Event(compile.parse1('s(2)'), insert=False)])
+        self.assertEqual(calls, [(set(compile.parse('p(2)')),
+                                  set(compile.parse('p(3)')))])
+        run.insert('r(4) s(4)')
+        self.assertEqual(len(calls), 1)
+
+    def test_delta_initialize(self):
+        calls = []
+        run = agnostic.Runtime()
+        run.create_policy('alice')
+        run.create_policy('bob')
+        run.insert('p(x) :- bob:q(x), r(x)  r(1) r(2)', 'alice')
+        run.insert('q(1) q(3)', 'bob')
+        run.register_trigger('p', lambda tbl, added, removed:
+                             calls.append((added, removed)), 'alice',
+                             delta=True)
+        run.initialize_tables(['q'], [compile.Fact('q', [2]),
+                                      compile.Fact('q', [3])], 'bob')
+        self.assertEqual(calls, [(set(compile.parse('p(2)')),
+                                  set(compile.parse('p(1)')))])
+
+    def test_delta_leaves_policies_alone(self):
+        calls = []
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.insert('p(x) :- q(x)  q(x) :- r(x), not s(x)  r(1) r(2)')
+        run.register_trigger('p', lambda tbl, added, removed:
+                             calls.append((added, removed)), delta=True)
+        th = run.policy_object('test')
+        # the state after the update is evaluated on overlays, so the
+        #   policy itself is updated once
+        original = nonrecursive.NonrecursiveRuleTheory.update
+        with mock.patch.object(nonrecursive.NonrecursiveRuleTheory, 'update',
+                               autospec=True,
+                               side_effect=original) as update:
+            run.insert('s(1) r(3)')
+        self.assertEqual(
+            [call for call in update.call_args_list if call[0][0] is th],
+            [mock.call(th, mock.ANY)])
+        self.assertEqual(calls, [(set(compile.parse('p(3)')),
+                                  set(compile.parse('p(1)')))])
+        # a policy that cannot be overlaid falls back to recomputing
+        run.create_policy('mat', kind=datalog_base.MATERIALIZED_POLICY_TYPE)
+        run.insert('s(3)', 'test')
+        self.assertEqual(calls[1], (set(), set(compile.parse('p(3)'))))
+
+
 class TestMultipolicyRules(unittest.TestCase):
     def test_external(self):
         """Test ability to write rules that span multiple policies."""
@@ -1093,6 +1197,690 @@ class TestSelect(unittest.TestCase):
         run.insert('r(1)')
         self.assertEqual(run.select('p(x)'), 'p(1)')
 
+    def test_trace_disabled(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.insert('p(x) :- q(x)')
+        run.insert('q(1)')
+        self.assertFalse(run.tracer.enabled)
+        with mock.patch.object(datalog_base.Tracer, 'log') as log:
+            self.assertEqual(run.select('p(x)'), 'p(1)')
+            run.insert('q(2)')
+        self.assertFalse(log.called)
+
+        run.debug_mode()
+        self.assertTrue(run.tracer.enabled)
+        result, trace = run.select('p(x)', trace=True)
+        self.assertEqual(set(result.split()), set(['p(1)', 'p(2)']))
+        self.assertIn('Found answer', trace)
+        run.production_mode()
+        self.assertFalse(run.tracer.enabled)
+
+    def test_result_cache(self):
+        run = agnostic.Runtime()
+        run.create_policy('ds', kind='datasource')
+        run.create_policy('test')
+        run.set_result_cache()
+        run.insert('p(x) :- q(x), ds:s(x)', 'test')
+        run.insert('r(x) :- t(x)', 'test')
+        run.insert('q(1)', 'test')
+        run.insert('q(2)', 'test')
+        run.insert('s(1)', 'ds')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(1)')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(1)')
+        self.assertEqual(run.select('r(x)', 'test'), '')
+        self.assertEqual(run.get_row_data('p', 'test'), [{'data': [1]}])
+        stats = run.result_cache_stats()
+        self.assertEqual(stats['hits'], 1)
+
+        # only the answers depending on the datasource table are dropped
+        run.insert('s(2)', 'ds')
+        stats = run.result_cache_stats()
+        self.assertEqual(stats['invalidations'], 4)
+        self.assertTrue(helper.datalog_equal(run.select('p(x)', 'test'),
+                                             'p(1) p(2)'))
+        self.assertEqual(run.select('r(x)', 'test'), '')
+        self.assertEqual(run.result_cache_stats()['hits'], 2)
+
+        run.initialize_tables(['s'], [], target='ds')
+        self.assertEqual(run.select('p(x)', 'test'), '')
+        run.delete('p(x) :- q(x), ds:s(x)', 'test')
+        run.insert('p(x) :- q(x)', 'test')
+        self.assertTrue(helper.datalog_equal(run.select('p(x)', 'test'),
+                                             'p(1) p(2)'))
+
+        run.set_result_cache(memory=None)
+        self.assertIsNone(run.result_cache_stats())
+
+
+class TestBottomUp(unittest.TestCase):
+    def prep_runtime(self):
+        run = agnostic.Runtime()
+        run.create_policy('test', kind=datalog_base.BOTTOMUP_POLICY_TYPE)
+        run.create_policy('nova')
+        return run
+
+    def test_recursion(self):
+        run = self.prep_runtime()
+        permitted, errors = run.insert(
+            'path(x, y) :- edge(x, y) '
+            'path(x, z) :- path(x, y), edge(y, z)', 'test')
+        self.assertTrue(permitted)
+        run.insert('edge(1, 2) edge(2, 3) edge(3, 1) edge(4, 5)', 'test')
+        self.assertTrue(helper.datalog_equal(
+            run.select('path(1, x)', 'test'),
+            'path(1, 1) path(1, 2) path(1, 3)'))
+        run.delete('edge(3, 1)', 'test')
+        self.assertTrue(helper.datalog_equal(
+            run.select('path(1, x)', 'test'), 'path(1, 2) path(1, 3)'))
+
+    def test_join_plans(self):
+        run = self.prep_runtime()
+        run.insert('path(x, y) :- edge(x, y) '
+                   'path(x, z) :- path(x, y), path(y, z) '
+                   'far(x, y) :- path(x, y), not edge(x, y), lt(x, y) '
+                   'local(x) :- path(x, y), nova:q(y)', 'test')
+        run.insert('edge(1, 2) edge(2, 3) edge(3, 4) path(4, 5)', 'test')
+        run.insert('q(5)', 'nova')
+        run.profile()
+        self.assertTrue(helper.datalog_equal(
+            run.select('far(x, y)', 'test'),
+            'far(1, 3) far(1, 4) far(1, 5) far(2, 4) far(2, 5) far(3, 5) '
+            'far(4, 5)'))
+        self.assertTrue(helper.datalog_equal(
+            run.select('local(x)', 'test'),
+            'local(1) local(2) local(3) local(4)'))
+        rules = dict((entry['rule'], entry)
+                     for entry in run.profile_report()['rules'])
+        # every round of the recursive rule joins its deltas natively
+        recursive = rules['path(x, z) :- path(x, y), path(y, z)']
+        self.assertGreater(recursive['invocations'], 1)
+        self.assertEqual(recursive['plan_runs'],
+                         recursive['invocations'])
+        self.assertNotIn('plan_runs',
+                         rules['local(x) :- path(x, y), nova:q(y)'])
+
+    def test_stratified_negation(self):
+        run = self.prep_runtime()
+        run.insert('reach(x, y) :- edge(x, y) '
+                   'reach(x, z) :- reach(x, y), edge(y, z) '
+                   'acyclic(x) :- node(x), not reach(x, x)', 'test')
+        run.insert('node(1) node(2) node(3) edge(1, 2) edge(2, 1) '
+                   'edge(2, 3)', 'test')
+        self.assertTrue(helper.datalog_equal(
+            run.select('acyclic(x)', 'test'), 'acyclic(3)'))
+        permitted, errors = run.insert('p(x) :- node(x), not p(x)', 'test')
+        self.assertFalse(permitted)
+        self.assertIsInstance(errors[0], exception.PolicyException)
+
+    def test_recursion_limited_to_policy(self):
+        run = self.prep_runtime()
+        permitted, errors = run.insert('p(x) :- q(x)  q(x) :- p(x)', 'nova')
+        self.assertFalse(permitted)
+        run.insert('p(x) :- nova:q(x)', 'test')
+        permitted, errors = run.insert('q(x) :- test:p(x)', 'nova')
+        self.assertFalse(permitted)
+
+    def test_other_policy_changes(self):
+        run = self.prep_runtime()
+        run.insert('p(x) :- nova:q(x), r(x)  r(1) r(2)', 'test')
+        self.assertEqual(run.select('p(x)', 'test'), '')
+        run.insert('q(1)', 'nova')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(1)')
+        run.initialize_tables(['q'], [compile.Fact('q', [2])], 'nova')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(2)')
+        run.insert('s(x) :- test:p(x)', 'nova')
+        self.assertEqual(run.select('s(x)', 'nova'), 's(2)')
+
+    def test_modal_heads(self):
+        run = self.prep_runtime()
+        run.insert('execute[p(x)] :- q(x)  q(x) :- r(x)  r(1)', 'test')
+        self.assertEqual(run.select('execute[p(x)]', 'test'),
+                         'execute[p(1)]')
+        self.assertEqual(run.select('p(x)', 'test'), '')
+
+    def test_concurrent_queries(self):
+        run = self.prep_runtime()
+        run.insert('path(x, y) :- edge(x, y) '
+                   'path(x, z) :- edge(x, y), path(y, z)', 'test')
+        run.insert('edge(1, 2) edge(2, 3)', 'test')
+        th = run.policy_object('test')
+        evaluate_stratum = th._evaluate_stratum
+
+        def switching_evaluate_stratum(stratum):
+            # let the other queries run while the model is partial
+            time.sleep(0.01)
+            evaluate_stratum(stratum)
+        results = []
+
+        def query():
+            results.append(run.select('path(1, x)', 'test'))
+        threads = [threading.Thread(target=query) for _ in range(4)]
+        with mock.patch.object(th, '_evaluate_stratum',
+                               side_effect=switching_evaluate_stratum):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(results), 4)
+        for result in results:
+            self.assertTrue(helper.datalog_equal(result,
+                                                 'path(1, 2) path(1, 3)'))
+
+
+class TestCounting(unittest.TestCase):
+    def prep_runtime(self):
+        run = agnostic.Runtime()
+        run.create_policy('test', kind=datalog_base.MATERIALIZED_POLICY_TYPE)
+        run.policy_object('test').set_counting()
+        return run
+
+    def count(self, th, atom):
+        return len(th.database.explain(compile.parse1(atom)))
+
+    def test_counting(self):
+        run = self.prep_runtime()
+        th = run.policy_object('test')
+        run.insert('p(x) :- q(x, y)  r(x) :- p(x), not s(x)', 'test')
+        run.insert('q(1, 2) q(1, 3) q(2, 3)', 'test')
+        self.assertEqual(self.count(th, 'p(1)'), 2)
+        self.assertTrue(helper.datalog_equal(run.select('r(x)', 'test'),
+                                             'r(1) r(2)'))
+        run.delete('q(1, 2)', 'test')
+        self.assertEqual(self.count(th, 'p(1)'), 1)
+        run.insert('s(2)', 'test')
+        run.delete('q(1, 3)', 'test')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(2)')
+        self.assertEqual(run.select('r(x)', 'test'), '')
+        proof = th.explain(compile.parse1('p(2)'), None, False)[0]
+        self.assertEqual(str(proof.root), 'p(2)')
+        self.assertEqual([str(p.root) for p in proof.children], ['q(2, 3)'])
+
+        counter = database.Database.ProofCount(2)
+        counter -= None
+        counter |= None
+        self.assertEqual(len(counter), 2)
+
+    def test_recursion(self):
+        th = materialized.MaterializedViewTheory(name='test')
+        th.set_counting()
+        for rule in ['path(x, y) :- edge(x, y)',
+                     'path(x, z) :- edge(x, y), path(y, z)',
+                     'acyclic(x) :- node(x), not path(x, x)']:
+            th.insert(compile.parse1(rule))
+        th.update([compile.Event(compile.parse1(fact)) for fact in
+                   ['node(1)', 'node(2)', 'node(3)', 'edge(1, 2)',
+                    'edge(2, 1)', 'edge(2, 3)']])
+        self.assertEqual(th.select(compile.parse1('acyclic(x)')),
+                         [compile.parse1('acyclic(3)')])
+        self.assertIsNotNone(th.explain(compile.parse1('path(1, 1)'),
+                                        None, False))
+        th.delete(compile.parse1('edge(2, 1)'))
+        self.assertEqual(
+            set(th.select(compile.parse1('path(x, y)'))),
+            set(compile.parse('path(1, 2) path(1, 3) path(2, 3)')))
+        self.assertEqual(len(th.select(compile.parse1('acyclic(x)'))), 3)
+        th.delete(compile.parse1('path(x, z) :- edge(x, y), path(y, z)'))
+        self.assertEqual(self.count(th, 'path(2, 3)'), 1)
+        self.assertEqual(th.select(compile.parse1('path(1, 3)')), [])
+
+
+class TestTabling(unittest.TestCase):
+    def prep_runtime(self, persistent=False):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.create_policy('nova')
+        run.policy_object('test').set_tabling(persistent=persistent)
+        run.insert('p(x) :- q(x, y), r(y) '
+                   's(x, z) :- p(x), p(z), not r(x) '
+                   't(x) :- nova:u(x), p(x)', 'test')
+        run.insert('q(1, 2) q(2, 3) q(3, 4) r(2) r(3)', 'test')
+        return run
+
+    def test_tabling(self):
+        run = self.prep_runtime()
+        self.assertTrue(helper.datalog_equal(
+            run.select('s(x, y)', 'test'),
+            's(1, 1) s(1, 2)'))
+        self.assertEqual(run.policy_object('test').answer_tables, {})
+
+    def test_persistent_tabling(self):
+        run = self.prep_runtime(persistent=True)
+        th = run.policy_object('test')
+        self.assertTrue(helper.datalog_equal(
+            run.select('p(x)', 'test'), 'p(1) p(2)'))
+        self.assertTrue(th.has_cached_results())
+        run.insert('r(4)', 'test')
+        self.assertFalse(th.has_cached_results())
+        self.assertTrue(helper.datalog_equal(
+            run.select('p(x)', 'test'), 'p(1) p(2) p(3)'))
+        self.assertEqual(run.select('t(x)', 'test'), '')
+        run.insert('u(3)', 'nova')
+        self.assertEqual(run.select('t(x)', 'test'), 't(3)')
+        run.delete('u(3)', 'nova')
+        self.assertEqual(run.select('t(x)', 'test'), '')
+
+
+class TestJoinPlan(unittest.TestCase):
+    def test_join_plan(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.insert('p(x, z) :- q(x, y), r(y, z), not s(z) '
+                   'p2(x) :- q(x, x) '
+                   'p3(x, w) :- q(x, y), plus(y, 1, w), r(w, w)', 'test')
+        run.insert('q(1, 2) q(2, 2) q(3, 4) r(2, 5) r(2, 6) r(3, 3) s(6)',
+                   'test')
+        self.assertTrue(helper.datalog_equal(
+            run.select('p(x, y)', 'test'), 'p(1, 5) p(2, 5)'))
+        self.assertEqual(run.select('p(1, 6)', 'test'), '')
+        self.assertEqual(run.select('p2(x)', 'test'), 'p2(2)')
+        self.assertTrue(helper.datalog_equal(
+            run.select('p3(x, y)', 'test'), 'p3(1, 3) p3(2, 3)'))
+        plans = run.policy_object('test').join_plans
+        self.assertTrue(plans)
+        self.assertTrue(all(plan.steps is not None
+                            for plan in plans.values()))
+
+        # tables defined by rules are evaluated literal by literal
+        run.insert('s(x) :- r(x, x)', 'test')
+        self.assertTrue(helper.datalog_equal(
+            run.select('p(x, y)', 'test'), 'p(1, 5) p(2, 5)'))
+        run.insert('r(4, 7)', 'test')
+        self.assertTrue(helper.datalog_equal(
+            run.select('p(x, y)', 'test'), 'p(1, 5) p(2, 5) p(3, 7)'))
+
+    def test_join_order(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.insert('p(x) :- big(x, y), small(y)', 'test')
+        run.insert(' '.join('small(%d)' % i for i in range(20)), 'test')
+        run.insert('big(1, 3)', 'test')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(1)')
+        plan, = run.policy_object('test').join_plans.values()
+        self.assertEqual(plan.body[0].table.table, 'big')
+
+        # once big outgrows small, the body is ordered again
+        run.insert(' '.join('big(%d, %d)' % (i, i + 10) for i in range(100)),
+                   'test')
+        self.assertTrue(helper.datalog_equal(
+            run.select('p(x)', 'test'),
+            ' '.join('p(%d)' % i for i in range(10))))
+        plan, = run.policy_object('test').join_plans.values()
+        self.assertEqual(plan.body[0].table.table, 'small')
+
+    def test_initialized_tables(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.insert('p(x) :- q(x, y), r(y)', 'test')
+        run.initialize_tables(
+            ['q', 'r'], [compile.Fact('q', (1, 2)), compile.Fact('r', (2,))],
+            target='test')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(1)')
+        plan, = run.policy_object('test').join_plans.values()
+        self.assertTrue(plan.usable(run.policy_object('test').rules))
+
+
+class TestLoadFacts(unittest.TestCase):
+    def test_rows(self):
+        calls = []
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.policy_object('test').INITIALIZE_CHUNK_SIZE = 2
+        run.insert('p(x) :- q(x, y), r(y)  r("a")  q(0, "a")')
+        run.register_trigger('p', lambda tbl, added, removed:
+                             calls.append((added, removed)), delta=True)
+        rows = ((i, 'a' if i % 2 else 'b') for i in range(1, 6))
+        self.assertEqual(run.load_facts('q', rows), 5)
+        self.assertEqual(calls, [(set(compile.parse('p(1) p(3) p(5)')),
+                                  set(compile.parse('p(0)')))])
+        self.assertTrue(helper.datalog_equal(
+            run.select('p(x)'), 'p(1) p(3) p(5)'))
+        self.assertEqual(run.select('q(2, "b")'), 'q(2, "b")')
+
+    def test_files(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        contents = {'q.csv': '1,a b,2.5\n\n"x,y",3,\n',
+                    'q.tsv': '1\ta b\t2.5\nx,y\t3\t\n',
+                    'q.jsonl': '[1, "a b", 2.5]\n["x,y", 3, ""]\n'}
+        for name, content in contents.items():
+            path = os.path.join(directory, name)
+            with open(path, 'w') as f:
+                f.write(content)
+            run = agnostic.Runtime()
+            run.create_policy('test')
+            self.assertEqual(
+                run.load_facts(loader.file_table(path), path), 2)
+            self.assertTrue(helper.datalog_equal(
+                run.select('q(x, y, z)'),
+                'q(1, "a b", 2.5) q("x,y", 3, "")'))
+        self.assertEqual(loader.parse_value('-3'), -3)
+        self.assertEqual(loader.parse_value('1e3'), 1000.0)
+        self.assertEqual(loader.parse_value('-'), '-')
+        self.assertRaises(exception.PolicyException,
+                          loader.read_rows, 'q.txt')
+
+    def test_unsupported_kind(self):
+        run = agnostic.Runtime()
+        run.create_policy('mat', kind=datalog_base.MATERIALIZED_POLICY_TYPE)
+        with self.assertRaises(exception.PolicyException) as cm:
+            run.load_facts('q', [(1,)], 'mat')
+        self.assertIn('mat', str(cm.exception))
+        self.assertIn(datalog_base.MATERIALIZED_POLICY_TYPE,
+                      str(cm.exception))
+        self.assertEqual(run.select('q(x)', 'mat'), '')
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'snapshot')
+
+    def test_save_load(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.create_policy('rec', kind=datalog_base.BOTTOMUP_POLICY_TYPE)
+        run.policy_object('test').set_columnar()
+        run.insert('p(x) :- q(x, y), not rec:r(y)  s()  '
+                   't(1, 2.5, "a")  t("b", 2, 3)', 'test')
+        run.insert('r(x) :- e(x)  r(x) :- e(y), f(y, x)  e(1)  f(1, 2)',
+                   'rec')
+        run.load_facts('q', [(i, i % 3) for i in range(10)], 'test')
+        run.select('q(1, x)', 'test')
+        run.save_snapshot(self.path)
+
+        restored = agnostic.Runtime()
+        restored.load_snapshot(self.path)
+        for name in ('test', 'rec'):
+            self.assertEqual(
+                set(str(x) for x in run.theory[name].content()),
+                set(str(x) for x in restored.theory[name].content()))
+        th = restored.policy_object('test')
+        self.assertIsInstance(th.rules.facts['q'], factset.ColumnarFactSet)
+        self.assertEqual(th.rules.facts['q'].indexes(), [(0,)])
+        self.assertTrue(helper.datalog_equal(
+            restored.select('p(x)', 'test'), 'p(0) p(3) p(6) p(9)'))
+        self.assertRaises(exception.PolicyException,
+                          restored.load_snapshot, self.path)
+
+    @mock.patch.object(db_policy_rules, 'get_policy_rules')
+    @mock.patch.object(db_policy_rules, 'get_policies')
+    def test_check_db(self, get_policies, get_policy_rules):
+        policy = mock.Mock(id='1', kind='nonrecursive')
+        policy.name = 'test'
+        get_policies.return_value = [policy]
+        get_policy_rules.return_value = [
+            mock.Mock(id='2', policy_name='test', rule='p(x) :- q(x)')]
+        run = agnostic.Runtime()
+        run.create_policy('test', id_='1')
+        run.insert('p(x) :- q(x)  q(1)')
+        run.save_snapshot(self.path, db=True)
+        restored = agnostic.Runtime()
+        restored.load_snapshot(self.path, check_db=True)
+        self.assertEqual(restored.select('p(x)'), 'p(1)')
+
+        get_policy_rules.return_value = []
+        restored = agnostic.Runtime()
+        self.assertRaises(exception.PolicyException,
+                          restored.load_snapshot, self.path, check_db=True)
+        self.assertEqual(restored.policy_names(), [])
+
+    def test_not_snapshot(self):
+        with open(self.path, 'w') as f:
+            f.write('p(1)\n' * 10)
+        run = agnostic.Runtime()
+        self.assertRaises(exception.PolicyException,
+                          run.load_snapshot, self.path)
+
+
+class TestColumnar(unittest.TestCase):
+    def rows(self, facts):
+        return set(tuple(fact) for fact in facts)
+
+    def test_factset(self):
+        facts = factset.ColumnarFactSet()
+        facts.COMPACT_MIN = 2
+        rows = [(1, 'a', 1.5), (2, 'a', 2.5), (3, 'b', 1), (1, True, 1.0)]
+        for row in rows:
+            self.assertTrue(facts.add(compile.Fact('p', row)))
+        self.assertFalse(facts.add(compile.Fact('p', (2, 'a', 2.5))))
+        self.assertTrue(facts.add(compile.Fact('p', (4,))))
+        self.assertEqual(len(facts), 5)
+        self.assertEqual([repr(f) for f in facts],
+                         [repr(f) for f in rows] + ['(4,)'])
+        self.assertEqual(next(iter(facts)).table, 'p')
+        self.assertTrue(facts.remove(compile.Fact('p', (4,))))
+
+        iterations = []
+        self.assertEqual(self.rows(facts.find(((1, 'a'),), iterations)),
+                         set([(1, 'a', 1.5), (2, 'a', 2.5)]))
+        facts.create_index((1,))
+        self.assertEqual(self.rows(facts.find(((1, 'a'),), iterations)),
+                         set([(1, 'a', 1.5), (2, 'a', 2.5)]))
+        self.assertEqual(iterations, [4, 1])
+        self.assertEqual(self.rows(facts.lookup((0, 2), (3, 1))),
+                         set([(3, 'b', 1)]))
+
+        self.assertTrue(facts.remove(compile.Fact('p', (1, 'a', 1.5))))
+        self.assertFalse(facts.remove(compile.Fact('p', (1, 'a', 1.5))))
+        self.assertTrue(facts.remove(compile.Fact('p', (3, 'b', 1))))
+        self.assertEqual(self.rows(facts),
+                         set([(2, 'a', 2.5), (1, True, 1.0)]))
+        self.assertEqual(self.rows(facts.find(((1, 'a'),))),
+                         set([(2, 'a', 2.5)]))
+        self.assertIn((2, 'a', 2.5), facts)
+        self.assertNotIn((3, 'b', 1), facts)
+
+    def test_policy(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.insert('p(x) :- q(x, y), not r(y) q(1, 2) q(3, 4) r(4)', 'test')
+        run.policy_object('test').set_columnar()
+        self.assertEqual(run.select('p(x)', 'test'), 'p(1)')
+        run.insert('q(5, "a")', 'test')
+        run.delete('q(1, 2)', 'test')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(5)')
+        self.assertEqual(run.select('q(x, 4)', 'test'), 'q(3, 4)')
+        run.policy_object('test').set_columnar(False)
+        self.assertTrue(helper.datalog_equal(
+            run.select('q(x, y)', 'test'), 'q(3, 4) q(5, "a")'))
+
+    @unittest.skipUnless(vectorized.NUMPY_AVAILABLE, "NumPy not installed")
+    def test_vectorized(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.policy_object('test').set_vectorized()
+        run.insert('over(h) :- cap(h, c), use(h, u), gt(u, c) '
+                   'free(h, f) :- cap(h, c), use(h, u), gteq(c, u), '
+                   '    minus(c, u, f) '
+                   'idle(h) :- cap(h, c), not use(h, 0) '
+                   'odd(h) :- cap(h, c), lt(h, 1)', 'test')
+        run.insert('cap("a", 4) cap("b", 8) cap("c", 2) '
+                   'use("a", 5) use("b", 1) use("c", 0)', 'test')
+        results = []
+        execute = vectorized.execute
+
+        def record(*args, **kwargs):
+            results.append(execute(*args, **kwargs))
+            return results[-1]
+        with mock.patch.object(vectorized, 'execute', side_effect=record):
+            self.assertEqual(run.select('over(h)', 'test'), 'over("a")')
+            self.assertTrue(helper.datalog_equal(
+                run.select('free(h, f)', 'test'),
+                'free("b", 7) free("c", 2)'))
+            self.assertTrue(helper.datalog_equal(
+                run.select('idle(h)', 'test'), 'idle("a") idle("b")'))
+            self.assertEqual(len(results), 3)
+            self.assertNotIn(None, results)
+            # strings compared with ints fall back to one tuple at a time
+            self.assertEqual(run.select('odd(h)', 'test'), '')
+            self.assertIsNone(results[-1])
+            # rules with bound arguments run a tuple at a time
+            self.assertEqual(run.select('over("a")', 'test'), 'over("a")')
+            self.assertEqual(len(results), 4)
+
+    def test_vectorized_unavailable(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        with mock.patch.object(vectorized, 'NUMPY_AVAILABLE', False):
+            self.assertRaises(exception.PolicyException,
+                              run.policy_object('test').set_vectorized)
+
+
+class TestUnify(unittest.TestCase):
+    def test_trail(self):
+        rule = compile.parse1('p(x, y) :- q(x, z), r(z, y)')
+        query = compile.parse1('p(1, w)')
+        top = unify.Frame(compile.variable_slots([query]))
+        frame = top.activation(rule.variable_slots())
+        self.assertEqual(len(top.trail.cells), 4)
+        mark = unify.bi_unify_atoms(rule.head, frame, query, top)
+        self.assertIsNotNone(mark)
+        self.assertEqual(rule.head.plug(frame), query)
+        self.assertIsNotNone(unify.match_values(rule.body[1], frame, (2, 3)))
+        self.assertEqual(query.plug(top), compile.parse1('p(1, 3)'))
+        self.assertIsNone(unify.match_values(rule.body[0], frame, (1, 4)))
+        self.assertEqual(rule.body[0].plug(frame), compile.parse1('q(1, 2)'))
+        top.undo(mark)
+        self.assertEqual(query.plug(top), query)
+        self.assertEqual(top.trail.trail, [])
+        frame.release()
+        self.assertEqual(len(top.trail.cells), 1)
+
+    def test_same(self):
+        def same(formula1, formula2):
+            return unify.same(compile.parse1(formula1),
+                              compile.parse1(formula2)) is not None
+        self.assertTrue(same('p(x, y) :- q(x, y)', 'p(a, b) :- q(a, b)'))
+        self.assertFalse(same('p(x, y) :- q(x, y)', 'p(a, b) :- q(b, a)'))
+        self.assertFalse(same('p(x, x)', 'p(x, y)'))
+        self.assertFalse(same('p(x, y)', 'p(x, x)'))
+        self.assertTrue(same('p(x, 1)', 'p(y, 1)'))
+
+    def test_plug(self):
+        literal = compile.parse1('p(x, 1)')
+        binding = {compile.Variable('x'): compile.Term.create_from_python(2)}
+        plugged = literal.plug(binding)
+        self.assertEqual(plugged, compile.parse1('p(2, 1)'))
+        self.assertEqual(hash(plugged), hash(compile.parse1('p(2, 1)')))
+        self.assertEqual(literal, compile.parse1('p(x, 1)'))
+        self.assertIs(plugged.plug(binding), plugged)
+        self.assertEqual(plugged.named_arguments, {})
+        # literals without named arguments share a read-only mapping
+        with self.assertRaises(TypeError):
+            plugged.named_arguments['x'] = 1
+        self.assertEqual(literal.named_arguments, {})
+        rule = compile.parse1('p(x) :- q(x)')
+        self.assertEqual(rule.id, rule.id)
+
+
+class TestProfile(unittest.TestCase):
+    def entry(self, report, kind, name, theory='test'):
+        field = 'table' if kind == 'tables' else 'rule'
+        for entry in report[kind]:
+            if entry['theory'] == theory and entry[field] == name:
+                return entry
+        self.fail("no %s %s in %s" % (kind, name, report))
+
+    def test_profile(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.insert('p(x) :- q(x, y), not r(y), plus(y, 1, z) '
+                   'q(1, 2) q(3, 4) r(4)', 'test')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(1)')
+        self.assertEqual(run.profile_report(), {'tables': [], 'rules': []})
+
+        run.profile()
+        run.create_policy('mat', kind='materialized')
+        run.insert('s(x) :- a(x), b(x)', 'mat')
+        run.insert('a(1) b(1)', 'mat')
+        self.assertEqual(run.select('p(x)', 'test'), 'p(1)')
+        self.assertEqual(run.select('p(1)', 'test'), 'p(1)')
+        report = run.profile_report()
+        rule = self.entry(report, 'rules',
+                          'p(x) :- q(x, y), not r(y), plus(y, 1, z)')
+        self.assertEqual(rule['invocations'], 2)
+        self.assertEqual(rule['plan_runs'], 2)
+        self.assertGreater(rule['time'], 0)
+        self.assertEqual(self.entry(report, 'tables', 'p')['calls'], 2)
+        q = self.entry(report, 'tables', 'q')
+        self.assertEqual(q['facts_scanned'], 3)
+        self.assertEqual(q['facts_returned'], 3)
+        self.assertEqual(q['index_hits'], 1)
+        self.assertEqual(self.entry(report, 'tables', 'r')['negations'], 3)
+        self.assertEqual(
+            self.entry(report, 'tables', 'plus')['builtin_calls'], 2)
+        self.assertEqual(self.entry(report, 'rules', 's(x) :- a(x), b(x)',
+                                    'mat')['delta_firings'], 2)
+        self.assertIn('invocations=2', datalog_base.Profiler.format_report(
+            run.profile_report(reset=True)))
+        self.assertEqual(run.profile_report(), {'tables': [], 'rules': []})
+
+        # the literal-by-literal evaluation counts unifications with facts
+        run.debug_mode()
+        self.assertEqual(run.select('p(x)', 'test'), 'p(1)')
+        q = self.entry(run.profile_report(), 'tables', 'q')
+        self.assertEqual(q['unify_attempts'], 2)
+        self.assertEqual(q['unify_successes'], 2)
+
+        run.profile(False)
+        self.assertIsNone(run.policy_object('mat').database.profiler)
+        run.select('p(x)', 'test')
+        self.assertEqual(run.profile_report(), {'tables': [], 'rules': []})
+
+
+class TestParse(unittest.TestCase):
+    def grammar(self, text):
+        compiler = compile.Compiler()
+        compiler.read_source(text, input_string=True)
+        return compiler.theory
+
+    def test_parse_atoms(self):
+        for text in ['p(1, "a b", 2.5, x)', ' nova:servers(x,\ty) q\n r() ',
+                     "p('s')q(0)"]:
+            fast = compile.parse_atoms(text)
+            self.assertEqual(fast, self.grammar(text))
+            self.assertEqual([repr(x) for x in fast],
+                             [repr(x) for x in self.grammar(text)])
+        for text in ['p(x) :- q(x)', 'not p(1)', 'execute[p(1)]', 'p+(1)',
+                     'p(-1)', 'p(1e3)', 'p(x.y)', 'p(1); q(2)', 'p(y=1)',
+                     'p("a\\"b")', 'p(1,\n2)', '', '# p(1)']:
+            self.assertIsNone(compile.parse_atoms(text), text)
+
+    def test_parse_cache(self):
+        text = 'p(x) :- q(x), not r(x, "cache")'
+        compile.parse_cache.clear()
+        first = compile.parse(text)
+        self.assertEqual(len(compile.parse_cache), 1)
+        first[0].body.reverse()
+        second = compile.parse(text)
+        third = compile.parse(text)
+        self.assertEqual(second, self.grammar(text))
+        self.assertEqual(second, third)
+        self.assertIsNot(second[0].head, third[0].head)
+        self.assertNotEqual(second[0].id, third[0].id)
+
+    def test_symbols(self):
+        constant = compile.Term.create_from_python(''.join(['inter', 'ned']))
+        self.assertIs(constant.name, 'interned')
+        self.assertIs(compile.parse1('p("interned")').arguments[0].name,
+                      constant.name)
+        self.assertEqual(compile.intern_row(['interned', 1, 2.5]),
+                         ('interned', 1, 2.5))
+
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.initialize_tables(
+            ['p'], [compile.Fact('p', (''.join(['inter', 'ned']), 1))],
+            target='test')
+        run.insert('p("interned", 2)', 'test')
+        first, second = run.policy_object('test').rules.get_facts('p')
+        self.assertIs(first[0], second[0])
+        self.assertTrue(helper.datalog_equal(
+            run.select('p("interned", x)', 'test'),
+            'p("interned", 1) p("interned", 2)'))
+
 
 class TestPolicyCreationDeletion(unittest.TestCase):
     def test_policy_creation_after_ref(self):
@@ -1167,6 +1955,53 @@ class TestDependencyGraph(unittest.TestCase):
         # actually just testing that no error is thrown
         self.assertFalse(run.global_dependency_graph.has_cycle())
 
+    def test_components(self):
+        g = compile.RuleDependencyGraph()
+        edges = [('p', 'q', False), ('q', 'r', False), ('r', 'p', True),
+                 ('r', 's', True), ('s', 't', False)]
+        for edge in edges:
+            g.add_edge(*edge)
+        self.assertTrue(g.has_cycle())
+        self.assertEqual(sorted(map(sorted, g.recursive_components())),
+                         [['p', 'q', 'r']])
+        self.assertIsNone(g.stratification([True]))
+        self.assertEqual(g.dependencies('s'), set(['s', 't']))
+        self.assertEqual(g.find_dependent_nodes(['s']),
+                         set(['p', 'q', 'r', 's']))
+        self.assertEqual(g.find_cycle('p'), ['p', 'q', 'r', 'p'])
+        self.assertIsNone(g.find_cycle('s'))
+
+        g.delete_edge('q', 'r', False)
+        self.assertFalse(g.has_cycle())
+        self.assertEqual(g.stratification([True]),
+                         {'p': 1, 'q': 1, 'r': 2, 's': 1, 't': 1})
+        g.add_edge('t', 'r', False)
+        self.assertEqual(sorted(map(sorted, g.recursive_components())),
+                         [['r', 's', 't']])
+        g.delete_edge('r', 's', True)
+        g.add_edge('r', 's', False)
+        self.assertEqual(g.stratification([True]),
+                         {'p': 1, 'q': 1, 'r': 2, 's': 2, 't': 2})
+
+        # kept up to date the same as computed from scratch
+        fresh = compile.RuleDependencyGraph()
+        for edge in [('p', 'q', False), ('r', 'p', True), ('r', 's', False),
+                     ('s', 't', False), ('t', 'r', False)]:
+            fresh.add_edge(*edge)
+        self.assertEqual(g.stratification([True]),
+                         fresh.stratification([True]))
+
+    def test_recursion_error(self):
+        run = agnostic.Runtime()
+        run.create_policy('test')
+        run.insert('p(x) :- q(x)')
+        run.insert('q(x) :- r(x)')
+        permitted, errors = run.insert('r(x) :- p(x), s(x)')
+        self.assertFalse(permitted)
+        self.assertEqual(str(errors[0]), "Rules are recursive: "
+                         "test:p -> test:q -> test:r -> test:p")
+        self.assertFalse(run.global_dependency_graph.has_cycle())
+
 
 class TestSimulate(unittest.TestCase):
     DEFAULT_THEORY = 'test_default'
@@ -1213,6 +2048,36 @@ class TestSimulate(unittest.TestCase):
             str(run.theory[self.DEFAULT_THEORY]), original_db)
         self.assertTrue(e, msg + " (Rollback failed)")
 
+    def test_overlay(self):
+        """Test simulation leaves the policies untouched."""
+        run = self.create('action("act") q+(x) :- act(x) r-(x) :- act(x)',
+                          'p(x) :- q(x), not r(x) q(1) r(2) r(3)')
+        run.set_result_cache()
+        self.assertEqual(run.select('p(x)', self.DEFAULT_THEORY), 'p(1)')
+        self.check(run, 'act(2) q-(1)', 'p(x)', 'p(2)', 'Overlay')
+        self.check(run, 'act(3) p2+(x) :- r(x)', 'p2(x)', 'p2(2)',
+                   'Overlay rules')
+        # the answers cached before were never invalidated
+        self.assertEqual(run.result_cache_stats()['invalidations'], 0)
+
+        overlay = run._overlay()
+        th = overlay.theory[self.DEFAULT_THEORY]
+        th.insert(compile.parse1('q(4)'))
+        th.insert(compile.parse1('q(2)'))
+        th.delete(compile.parse1('r(2)'))
+        self.assertTrue(helper.datalog_equal(
+            overlay.select('p(x)', self.DEFAULT_THEORY), 'p(1) p(2) p(4)'))
+        self.assertEqual(run.select('p(x)', self.DEFAULT_THEORY), 'p(1)')
+
+    def test_overlay_schema(self):
+        """Test simulation leaves the schema untouched."""
+        run = self.create('action("act")', '')
+        self.check(run, 'p+(1, 2)', 'p(x, y)', 'p(1, 2)', 'Overlay schema')
+        self.assertNotIn('p', run.theory[self.DEFAULT_THEORY].schema)
+        permitted, errors = run.insert('p(7)', self.DEFAULT_THEORY)
+        self.assertTrue(permitted, utility.iterstr(errors))
+        self.assertEqual(run.select('p(x)', self.DEFAULT_THEORY), 'p(7)')
+
     def test_multipolicy_state_1(self):
         """Test update sequence affecting datasources."""
         run = self.prep_runtime(theories=['nova', 'neutron'])
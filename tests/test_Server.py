@@ -0,0 +1,194 @@
+# Copyright (c) 2019 Nippon Telegraph and Telephone Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import unittest
+
+from oslo_config import cfg
+
+from birdwatcher.congress.policy_engines import agnostic
+from birdwatcher.congress.tests import helper
+from birdwatcher.proto import concurrency
+from birdwatcher.proto import pylagolog_pb2
+from birdwatcher.proto import server
+
+
+def add(rule):
+    return pylagolog_pb2.ModifyRule(Type=pylagolog_pb2.ADD, Rule=rule)
+
+
+def delete(rule):
+    return pylagolog_pb2.ModifyRule(Type=pylagolog_pb2.DELETE, Rule=rule)
+
+
+class TestModRules(unittest.TestCase):
+    def setUp(self):
+        self.run = agnostic.Runtime()
+        self.run.create_policy('default')
+        self.servicer = server.DatalogServicer(self.run)
+
+    def test_success(self):
+        result = self.servicer.ModRules(
+            iter([add('p(1)'), add('p(2)'), add('q(x) :- p(x)')]), None)
+        self.assertEqual(result.Result, pylagolog_pb2.SUCCESS)
+        self.assertTrue(helper.datalog_equal(
+            self.run.select('q(x)'), 'q(1) q(2)'))
+
+    def test_parse_error_rolls_back(self):
+        result = self.servicer.ModRules(
+            iter([add('p(1)'), add('q(x) :- '), add('p(2)')]), None)
+        self.assertEqual(result.Result, pylagolog_pb2.ERROR)
+        self.assertEqual(self.run.select('p(x)'), '')
+
+    def test_update_error_rolls_back(self):
+        # recursion is not permitted in a nonrecursive policy
+        result = self.servicer.ModRules(
+            iter([add('p(1)'), add('r(x) :- r(x)')]), None)
+        self.assertEqual(result.Result, pylagolog_pb2.ERROR)
+        self.assertEqual(self.run.select('p(x)'), '')
+        self.assertEqual(self.run.policy(), '')
+
+    def test_last_command_wins(self):
+        result = self.servicer.ModRules(
+            iter([add('p(1)'), add('p(2)'), delete('p(1)')]), None)
+        self.assertEqual(result.Result, pylagolog_pb2.SUCCESS)
+        self.assertEqual(self.run.select('p(x)'), 'p(2)')
+        result = self.servicer.ModRules(
+            iter([delete('p(2)'), add('p(2)')]), None)
+        self.assertEqual(result.Result, pylagolog_pb2.SUCCESS)
+        self.assertEqual(self.run.select('p(x)'), 'p(2)')
+
+
+class TestQueryRows(unittest.TestCase):
+    def setUp(self):
+        self.run = agnostic.Runtime()
+        self.run.create_policy('default')
+        self.run.insert(' '.join('p(%d)' % i for i in range(10)))
+        self.servicer = server.DatalogServicer(self.run, page_size=4)
+
+    def query(self, query, **kwargs):
+        return list(self.servicer.QueryRows(
+            pylagolog_pb2.RowQuery(Query=query, **kwargs), None))
+
+    def values(self, pages):
+        return [[getattr(column, column.WhichOneof('Kind'))
+                 for column in row.Columns]
+                for page in pages for row in page.Rows]
+
+    def test_pages(self):
+        pages = self.query('p(x)')
+        self.assertEqual([len(page.Rows) for page in pages], [4, 4, 2])
+        self.assertTrue(all(page.Result == pylagolog_pb2.SUCCESS
+                            for page in pages))
+        self.assertEqual(self.values(pages), [[i] for i in range(10)])
+        pages = self.query('p(x)', BatchSize=3)
+        self.assertEqual([len(page.Rows) for page in pages], [3, 3, 3, 1])
+
+    def test_limit_offset(self):
+        pages = self.query('p(x)', Offset=3, Limit=5)
+        self.assertEqual([len(page.Rows) for page in pages], [4, 1])
+        self.assertEqual(self.values(pages), [[i] for i in range(3, 8)])
+        pages = self.query('p(x)', Offset=8)
+        self.assertEqual(self.values(pages), [[8], [9]])
+        pages = self.query('p(x)', Offset=20)
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(pages[0].Result, pylagolog_pb2.SUCCESS)
+        self.assertEqual(len(pages[0].Rows), 0)
+
+    def test_value_types(self):
+        self.run.load_facts('q', [(1, 2.5, 'a', -(1 << 63)),
+                                  (2, 0.0, 'b', 1 << 63)])
+        pages = self.query('q(w, x, y, z)')
+        self.assertEqual(
+            [[column.WhichOneof('Kind') for column in row.Columns]
+             for page in pages for row in page.Rows],
+            [['Int', 'Float', 'String', 'Int'],
+             ['Int', 'Float', 'String', 'String']])
+        self.assertEqual(self.values(pages),
+                         [[1, 2.5, 'a', -(1 << 63)],
+                          [2, 0.0, 'b', str(1 << 63)]])
+        pages = self.query('q(1, x, y, z)')
+        self.assertEqual(self.values(pages), [[1, 2.5, 'a', -(1 << 63)]])
+
+    def test_rule_heads(self):
+        pages = self.query('r(x) :- p(x), lt(x, 2)')
+        self.assertEqual(self.values(pages), [[0], [1]])
+
+    def test_error(self):
+        pages = self.query('p(x) q(x)')
+        self.assertEqual([page.Result for page in pages],
+                         [pylagolog_pb2.ERROR])
+
+    def test_page_size_bound(self):
+        conf = cfg.ConfigOpts()
+        conf.register_cli_opts(server.common_opts)
+        self.assertRaises(SystemExit, conf, ['--page_size', '0'])
+
+
+class TestReplicaPool(unittest.TestCase):
+    def setUp(self):
+        self.run = agnostic.Runtime()
+        self.run.create_policy('default')
+        self.run.insert('p(1)')
+
+    def make_pool(self, processes):
+        pool = concurrency.ReplicaPool(self.run, processes, server._evaluate)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_replay(self):
+        pool = self.make_pool(2)
+        self.run.insert('p(2)')
+        pool.append([('p(2)', True)])
+        self.assertTrue(helper.datalog_equal(
+            pool.select('p(x)', False), 'p(1) p(2)'))
+        self.assertEqual(pool.select('q(x)', False), '')
+        self.assertEqual(len(pool), 2)
+
+    def test_replay_failure(self):
+        pool = self.make_pool(1)
+        replica = pool._replicas[0]
+        # recursion is not permitted in a nonrecursive policy
+        pool.append([('r(x) :- r(x)', True)])
+        self.assertRaises(concurrency.NoReplicas,
+                          pool.select, 'p(x)', False)
+        self.assertEqual(len(pool), 0)
+        self.assertFalse(replica.process.is_alive())
+        self.assertRaises(concurrency.NoReplicas,
+                          pool.select, 'p(x)', False)
+
+    def test_dead_replica(self):
+        pool = self.make_pool(2)
+        dead = pool._replicas[0]
+        dead.process.terminate()
+        dead.process.join()
+        for _ in range(3):
+            self.assertEqual(pool.select('p(x)', False), 'p(1)')
+        self.assertEqual(len(pool), 1)
+        self.assertNotIn(dead, pool._replicas)
+        self.assertEqual(len(pool.gather(server._profile_report, False)),
+                         1)
+
+    def test_servicer_fallback(self):
+        pool = self.make_pool(1)
+        servicer = server.DatalogServicer(self.run, replicas=pool)
+        result = servicer.ModRules(iter([add('p(2)')]), None)
+        self.assertEqual(result.Result, pylagolog_pb2.SUCCESS)
+        pool._replicas[0].process.terminate()
+        pool._replicas[0].process.join()
+        answer = list(servicer.Queries(
+            iter([pylagolog_pb2.Query(Query='p(x)')]), None))
+        self.assertTrue(helper.datalog_equal(answer[0].Result,
+                                             'p(1) p(2)'))
+        self.assertIsNone(servicer.replicas)